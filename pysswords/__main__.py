@@ -1,12 +1,16 @@
-from __future__ import unicode_literals
+from __future__ import print_function, unicode_literals
 import argparse
 import logging
-import os
 from pkg_resources import get_distribution
 
 from .cli import CLI
+from .clipboard import CLEAR_AFTER
+from .completion import SHELLS, default_db, script
+from .crypt import CIPHERTEXT_FORMATS, KEY_PROFILES
+from .db.credential import LAYOUTS
 from .db import (
     CredentialExistsError,
+    CredentialModifiedError,
     CredentialNotFoundError,
     DatabaseExistsError
 )
@@ -17,24 +21,50 @@ __project__ = 'pysswords'
 __version__ = get_distribution('pysswords').version
 
 
-def default_db():
-    return os.path.join(os.path.expanduser("~"), ".pysswords")
-
-
 def parse_args(cli_args=None):
     parser = argparse.ArgumentParser(prog="Pysswords")
 
     group_db = parser.add_argument_group("Database options")
     group_db.add_argument("-I", "--init", action="store_true",
                           help="create a new Pysswords database")
-    group_db.add_argument("-D", "--database", default=default_db(),
-                          help="specify path to database")
+    group_db.add_argument("-D", "--database", dest="databases",
+                          action="append", metavar="DATABASE",
+                          help="specify path to database, repeat to also "
+                               "get and search other databases")
+    group_db.add_argument("--key-profile", choices=sorted(KEY_PROFILES),
+                          help="key type generated by --init and --rekey")
+    group_db.add_argument("--import-key", dest="keyfile", metavar="KEY_FILE",
+                          help="use an existing ascii armored key with --init")
+    group_db.add_argument("--layout", choices=LAYOUTS,
+                          help="credential directory layout used by --init, "
+                               "sharded suits databases with many names")
+    group_db.add_argument("--migrate", choices=LAYOUTS, metavar="LAYOUT",
+                          help="move credentials to another layout")
+    group_db.add_argument("--sync", metavar="DATABASE",
+                          help="exchange changes with a replica of the "
+                               "database, such as a copy on a share")
+    group_db.add_argument("--prefer", choices=["local", "remote"],
+                          help="side kept by --sync when both changed a "
+                               "credential. Default: keep both, warn")
+    group_db.add_argument("--blobs", action="store_true",
+                          help="store each distinct comment once, used by "
+                               "--init")
+    group_db.add_argument("--collect-blobs", action="store_true",
+                          help="delete comments no credential uses anymore")
+    group_db.add_argument("--ciphertext", choices=CIPHERTEXT_FORMATS,
+                          help="password storage used by --init, compact "
+                               "drops the ascii armor")
+    group_db.add_argument("--convert", choices=CIPHERTEXT_FORMATS,
+                          metavar="CIPHERTEXT",
+                          help="store passwords in another ciphertext format")
     group_db.add_argument("--export", dest="exportdb", metavar="DATABASE_FILE",
                           help="export encrypted Pysswords database")
     group_db.add_argument("--import", dest="importdb", metavar="DATABASE_FILE",
                           help="import encrypted Pysswords database")
     group_db.add_argument("--clean", action="store_true",
                           help="delete database, cleaning all files")
+    group_db.add_argument("--rekey", action="store_true",
+                          help="re-encrypt database with a new key")
 
     group_cred = parser.add_argument_group("Credential options")
     group_cred.add_argument("-a", "--add", action="store_true",
@@ -47,32 +77,93 @@ def parse_args(cli_args=None):
                             help="remove credentials")
     group_cred.add_argument("-c", "--clipboard", metavar="FULLNAME",
                             help="copy credential password to clipboard")
+    group_cred.add_argument("--clear-after", type=int, default=CLEAR_AFTER,
+                            metavar="SECONDS",
+                            help="clear clipboard after seconds, 0 to keep")
+    group_cred.add_argument("--history", metavar="FULLNAME",
+                            help="show previous versions of a credential")
+    group_cred.add_argument("--restore", metavar="FULLNAME",
+                            help="make a previous version current again")
+    group_cred.add_argument("--restore-version", type=int, default=0,
+                            metavar="NUMBER",
+                            help="version restored, as numbered by "
+                                 "--history. Default: 0, the latest")
+    group_cred.add_argument("-i", "--interactive", action="store_true",
+                            help="search names as you type, copy the "
+                                 "selected password to clipboard")
     group_cred.add_argument("-s", "--search",
-                            help="search credentials. [regex supported]")
+                            help="search credentials. [name:, login:, "
+                                 "comment: globs, AND, OR, NOT]")
     group_cred.add_argument("-P", "--show-password", action="store_true",
                             help="show credentials passwords as plain text")
     group_cred.add_argument("-R", "--random", action="store_true",
                             help="randomly generate a password for credential")
 
+    group_rotate = parser.add_argument_group("Rotation options")
+    group_rotate.add_argument("--rotate", metavar="QUERY",
+                              help="generate new passwords for credentials "
+                                   "matching query. [name:, login:, "
+                                   "comment: globs, AND, OR, NOT]")
+    group_rotate.add_argument("--hook", metavar="COMMAND",
+                              help="command receiving rotated passwords "
+                                   "as json on stdin")
+    group_rotate.add_argument("--report", metavar="REPORT_FILE",
+                              help="append rotated passwords as json lines "
+                                   "to file")
+    group_rotate.add_argument("--batch-size", type=int, default=50,
+                              help="credentials rotated per transaction")
+
+    group_audit = parser.add_argument_group("Audit options")
+    group_audit.add_argument("--audit", metavar="HASH_FILE",
+                             help="check passwords against a sorted list of "
+                                  "breached password sha1 hashes")
+    group_audit.add_argument("--reuse-report", action="store_true",
+                             help="group credentials sharing a password, "
+                                  "then warn about reuse on every add")
+    group_audit.add_argument("--bloom", metavar="BLOOM_FILE",
+                             help="Bloom filter of the hash list skipping "
+                                  "most lookups. Default: HASH_FILE.bloom")
+    group_audit.add_argument("--build-bloom", metavar="HASH_FILE",
+                             help="write the Bloom filter of a hash list to "
+                                  "HASH_FILE.bloom")
+
     group_runtime = parser.add_argument_group("Default options")
     group_runtime.add_argument("--version", action="version",
                                version="Pysswords {}".format(__version__),
                                help="Print version")
     group_runtime.add_argument("--verbose", "-v", action="store_true",
                                help="Print verbose output")
+    group_runtime.add_argument("--completion", choices=SHELLS,
+                               help="print the shell completion script, "
+                                    "load it with eval")
 
     args = parser.parse_args(cli_args)
+    # the first database is the one modified, others are only queried
+    databases = args.databases or [default_db()]
+    args.database, args.vaults = databases[0], databases[1:]
     return args
 
 
+def cli_options(args):
+    """Optional settings given on the command line, as CLI keyword
+    arguments"""
+    options = [("key_profile", args.key_profile), ("keyfile", args.keyfile),
+               ("vaults", args.vaults), ("layout", args.layout),
+               ("blobs", args.blobs), ("ciphertext", args.ciphertext)]
+    return {name: value for name, value in options if value}
+
+
 def main(cli_args=None):
+    args = parse_args(cli_args)
+
+    if args.completion:
+        print(script(args.completion), end="")
+        return
 
     if not which("gpg"):
         logging.error("GPG not installed: https://gnupg.org/download")
         exit(1)
 
-    args = parse_args(cli_args)
-
     if args.verbose:
         logger = logging.getLogger()
         logger.setLevel(logging.INFO)
@@ -82,7 +173,8 @@ def main(cli_args=None):
             database_path=args.database,
             show_password=args.show_password,
             init=args.init,
-            randompass=args.random
+            randompass=args.random,
+            **cli_options(args)
         )
 
         if args.exportdb:
@@ -91,10 +183,28 @@ def main(cli_args=None):
             interface.importdb(args.importdb)
         elif args.clean:
             interface.clean_database()
+        elif args.rekey:
+            interface.rekey_database()
+        elif args.migrate:
+            interface.migrate_database(layout=args.migrate)
+        elif args.sync:
+            interface.sync_database(path=args.sync, prefer=args.prefer)
+        elif args.collect_blobs:
+            interface.collect_blobs()
+        elif args.convert:
+            interface.convert_database(ciphertext=args.convert)
         elif args.add:
             interface.add_credential()
         elif args.clipboard:
-            interface.copy_to_clipboard(fullname=args.clipboard)
+            interface.copy_to_clipboard(fullname=args.clipboard,
+                                        clear_after=args.clear_after)
+        elif args.history:
+            interface.show_history(fullname=args.history)
+        elif args.restore:
+            interface.restore_credential(fullname=args.restore,
+                                         number=args.restore_version)
+        elif args.interactive:
+            interface.interactive(clear_after=args.clear_after)
         elif args.get:
             interface.get_credentials(fullname=args.get)
         elif args.search:
@@ -103,12 +213,26 @@ def main(cli_args=None):
             interface.update_credentials(fullname=args.update)
         elif args.remove:
             interface.remove_credentials(fullname=args.remove)
+        elif args.rotate:
+            interface.rotate_credentials(
+                query=args.rotate,
+                hook=args.hook,
+                report=args.report,
+                batch_size=args.batch_size)
+        elif args.audit:
+            interface.audit_credentials(hashlist=args.audit, bloom=args.bloom)
+        elif args.reuse_report:
+            interface.reuse_report()
+        elif args.build_bloom:
+            interface.build_bloom(hashlist=args.build_bloom)
         else:
             interface.show()
     except CredentialExistsError as e:
         logging.error("Credential '{}' exists".format(e))
     except CredentialNotFoundError as e:
         logging.error("Credential '{}' not found".format(e))
+    except CredentialModifiedError as e:
+        logging.error("Credential '{}' was modified concurrently".format(e))
     except DatabaseExistsError as e:
         logging.error(str(e))
     except ValueError as e:
@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+import binascii
+import hashlib
+import math
+import mmap
+import os
+import struct
+from multiprocessing.pool import ThreadPool
+
+from .db.credential import asfullname
+
+
+DIGEST_SIZE = 20
+HEX_SIZE = DIGEST_SIZE * 2
+
+
+def sha1(password):
+    return hashlib.sha1(password.encode("utf-8")).digest()
+
+
+def mapped(filename):
+    with open(filename, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def byte(buffer, i):
+    value = buffer[i]
+    # python 2 buffers index as one character strings
+    return ord(value) if isinstance(value, bytes) else value
+
+
+class HashList(object):
+    """Breached password hashes, as `SHA1:COUNT` lines sorted by hash like
+    the "ordered by hash" Pwned Passwords download. Counts are optional.
+
+    The file is memory mapped and binary searched on byte offsets, moving
+    to the start of the line found at each step, so lookups read a few
+    pages and memory stays flat whatever the size of the list. A Bloom
+    filter built from the list can answer most misses without reading it.
+    """
+
+    def __init__(self, filename, bloom=None):
+        self.buffer = mapped(filename)
+        self.size = len(self.buffer)
+        self.bloom = bloom
+
+    def close(self):
+        self.buffer.close()
+        if self.bloom is not None:
+            self.bloom.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count(self, digest):
+        """Times the password of sha1 digest was breached, 0 if never"""
+        if self.bloom is not None and digest not in self.bloom:
+            return 0
+        target = binascii.hexlify(digest).upper()
+        low, high = 0, self.size
+        # low and high always sit at line starts
+        while low < high:
+            middle = (low + high) // 2
+            newline = self.buffer.rfind(b"\n", low, middle)
+            start = low if newline < 0 else newline + 1
+            end = self.buffer.find(b"\n", start)
+            end = self.size if end < 0 else end + 1
+            key = self.buffer[start:start + HEX_SIZE].upper()
+            if key == target:
+                line = self.buffer[start:end].strip()
+                count = line[HEX_SIZE + 1:]
+                return int(count) if count.isdigit() else 1
+            elif key < target:
+                low = end
+            else:
+                high = start
+        return 0
+
+
+class BloomFilter(object):
+    """Bit array answering whether a sha1 digest may be in a hash list.
+
+    Digests are uniformly distributed already, so bit positions are derived
+    from two of their 64 bit words by double hashing instead of hashing
+    again. The file is memory mapped like the list.
+    """
+
+    MAGIC = b"PYBF"
+    HEADER = struct.Struct("<4sQI")
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic, self.bits, self.hashes = self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC:
+            raise ValueError("Not a Bloom filter")
+
+    @classmethod
+    def open(cls, filename):
+        return cls(mapped(filename))
+
+    def close(self):
+        self.buffer.close()
+
+    @staticmethod
+    def dimensions(count, error_rate):
+        """Bits and hash functions giving error_rate false positives for
+        count entries"""
+        bits = int(math.ceil(-count * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, int(round(bits / float(count) * math.log(2))))
+        return max(bits, 8), hashes
+
+    def positions(self, digest):
+        first, second = struct.unpack_from("<QQ", digest)
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, digest):
+        offset = self.HEADER.size
+        return all(byte(self.buffer, offset + p // 8) & (1 << p % 8)
+                   for p in self.positions(digest))
+
+    @classmethod
+    def build(cls, hashlist, filename, error_rate=0.001):
+        """Write the filter of a hash list file, built in a memory mapped
+        file rather than in memory"""
+        with open(hashlist, "rb") as f:
+            count = sum(1 for line in f if line.strip())
+        bits, hashes = cls.dimensions(max(count, 1), error_rate)
+        size = cls.HEADER.size + (bits + 7) // 8
+        with open(filename, "w+b") as f:
+            f.truncate(size)
+            buffer = mmap.mmap(f.fileno(), size)
+        try:
+            buffer[:cls.HEADER.size] = cls.HEADER.pack(cls.MAGIC, bits,
+                                                       hashes)
+            bloom = cls(buffer)
+            with open(hashlist, "rb") as f:
+                for line in f:
+                    key = line[:HEX_SIZE]
+                    if len(key) < HEX_SIZE:
+                        continue
+                    for p in bloom.positions(binascii.unhexlify(key)):
+                        i = cls.HEADER.size + p // 8
+                        buffer[i:i + 1] = struct.pack(
+                            "B", byte(buffer, i) | 1 << p % 8)
+            buffer.flush()
+        finally:
+            buffer.close()
+        return filename
+
+
+def audit(database, passphrase, hashes, credentials=None, workers=8):
+    """Credentials whose password is in hashes, with its breach count.
+
+    Passwords are decrypted by a pool of workers, so gpg processes run
+    side by side, and only their sha1 digest leaves the worker: plaintext
+    is never kept nor written anywhere.
+    """
+    credentials = (database.credentials if credentials is None
+                   else credentials)
+
+    def check(credential):
+        password = database.decrypt(credential.password, passphrase)
+        if not password:
+            raise ValueError("Could not decrypt '{}'".format(
+                asfullname(credential.name, credential.login)))
+        return credential, hashes.count(sha1(password))
+
+    if not credentials:
+        return []
+    pool = ThreadPool(min(workers, len(credentials)))
+    try:
+        found = [(credential, count)
+                 for credential, count in pool.imap(check, credentials)
+                 if count]
+    finally:
+        pool.close()
+        pool.join()
+    return found
+
+
+def default_bloom(hashlist):
+    """Filter found next to a hash list, used when it exists"""
+    filename = hashlist + ".bloom"
+    return filename if os.path.isfile(filename) else None
@@ -1,30 +1,51 @@
 from __future__ import unicode_literals
 from getpass import getpass
+import os
 import shutil
 import logging
+import time
 import colorama
 import pyperclip
 from tabulate import tabulate
 
+from .audit import BloomFilter, HashList, audit, default_bloom
+from .clipboard import CLEAR_AFTER, schedule_clear
+from .crypt import ARMOR, DEFAULT_PROFILE
 from .python_two import input
-from .db.credential import splitname, asfullname
+from .db.credential import FLAT, splitname, asfullname
 from .db import(
     Database,
-    Credential
+    Credential,
+    CredentialNotFoundError,
+    Federation
 )
+from .rotation import Rotation
+from . import tui
 from .utils import genpass
 
 
 class CLI(object):
 
-    def __init__(self, database_path, show_password, init=False, randompass=False):
+    def __init__(self, database_path, show_password, init=False, randompass=False,
+                 key_profile=None, keyfile=None, vaults=None, layout=None,
+                 blobs=False, ciphertext=None):
         if init:
-            self.create_database(path=database_path)
+            options = {k: v for k, v in [("profile", key_profile),
+                                         ("keyfile", keyfile),
+                                         ("layout", layout),
+                                         ("blobs", blobs),
+                                         ("ciphertext", ciphertext)] if v}
+            self.create_database(path=database_path, **options)
         self.database = Database(database_path)
+        # extra vaults are only queried, changes go to the main database
+        self.federation = Federation(
+            [self.database] + [Database(path) for path in vaults]
+        ) if vaults else None
         self.headers = ["Name", "Login", "Password", "Comment"]
         self.tablefmt = "orgtbl"
         self.show_password = show_password
         self.randompass = randompass
+        self.key_profile = key_profile or DEFAULT_PROFILE
 
     @classmethod
     def colored(cls, text, color):
@@ -32,9 +53,16 @@ class CLI(object):
         return colorama_color + text + colorama.Fore.RESET
 
     @classmethod
-    def create_database(cls, path):
-        passphrase = CLI.prompt("Passphrase for database: ", password=True)
-        database = Database.create(path, passphrase)
+    def create_database(cls, path, profile=DEFAULT_PROFILE, keyfile=None,
+                        layout=FLAT, blobs=False, ciphertext=ARMOR):
+        if keyfile:
+            # imported keys keep their own passphrase
+            passphrase = None
+        else:
+            passphrase = CLI.prompt("Passphrase for database: ",
+                                    password=True)
+        database = Database.create(path, passphrase, profile, keyfile,
+                                   layout, blobs, ciphertext)
         cls.write("Database initialized in '{}'".format(path))
         return database
 
@@ -99,7 +127,22 @@ class CLI(object):
             plaintext_credentials.append(new_credential)
         return plaintext_credentials
 
-    def build_table(self, credentials, color):
+    def get_vault_passphrases(self, vaults):
+        """Passphrase of every vault, asked once for all the vaults it
+        opens, then for each vault it did not"""
+        passphrase = getpass("Passphrase: ")
+        opened = self.federation.unlocked(passphrase, vaults)
+        passphrases = {}
+        for vault in vaults:
+            if vault not in opened:
+                passphrase = getpass("Passphrase for vault '{}': ".format(
+                    vault))
+                if not self.federation.check(vault, passphrase):
+                    raise ValueError("Wrong passphrase")
+            passphrases[vault] = passphrase
+        return passphrases
+
+    def build_table(self, credentials, color, vaults=None):
         table = []
         for credential in credentials:
             row = [
@@ -109,7 +152,11 @@ class CLI(object):
                 credential.comment
             ]
             table.append(row)
-        return tabulate(table, self.headers, tablefmt=self.tablefmt)
+        headers = self.headers
+        if vaults:
+            headers = ["Vault"] + headers
+            table = [[vault] + row for vault, row in zip(vaults, table)]
+        return tabulate(table, headers, tablefmt=self.tablefmt)
 
     def show(self, credentials=None, color="yellow"):
         if not credentials:
@@ -123,18 +170,49 @@ class CLI(object):
             table = self.build_table(credentials, color)
             self.write("\n{}\n".format(table))
 
+    def show_vaults(self, found, color="yellow"):
+        """Show (vault, credential) pairs found in a federation"""
+        if not found:
+            return
+        vaults = [vault for vault, _ in found]
+        credentials = [credential for _, credential in found]
+        if self.show_password:
+            passphrases = self.get_vault_passphrases(
+                [v for v in self.federation.vaults if v in vaults])
+            credentials = [
+                c._replace(password=self.federation.vaults[v].decrypt(
+                    c.password, passphrases[v]))
+                for v, c in found]
+        table = self.build_table(credentials, color, vaults)
+        self.write("\n{}\n".format(table))
+
     def add_credential(self):
         credential = self.prompt_credential(random_password=self.randompass)
         fullname = asfullname(credential["name"], credential["login"])
+        # databases fingerprinting passwords check reuse on every add
+        if self.database.fingerprints.enabled:
+            if not self.database.unlock_fingerprints(self.get_passphrase()):
+                raise ValueError("Wrong passphrase")
+            reused = self.database.fingerprints.reused(
+                credential["password"])
+            if reused:
+                logging.warning("Password already used by {}".format(
+                    ", ".join(reused)))
         self.database.add(**credential)
         logging.info("Added credential '{}'".format(fullname))
 
     def get_credentials(self, fullname):
         name, login = splitname(fullname)
-        self.show(self.database.get(name=name, login=login))
+        if self.federation is not None:
+            self.show_vaults(self.federation.get(name=name, login=login))
+        else:
+            self.show(self.database.get(name=name, login=login))
 
     def search_credentials(self, query):
-        self.show(self.database.search(query=query))
+        if self.federation is not None:
+            self.show_vaults(self.federation.search(query=query))
+        else:
+            self.show(self.database.search(query=query))
 
     def remove_credentials(self, fullname):
         name, login = splitname(fullname)
@@ -162,7 +240,103 @@ class CLI(object):
                 logging.info("Updated credential: {}".format(
                     asfullname(cred.name, cred.login)))
 
-    def copy_to_clipboard(self, fullname):
+    def show_history(self, fullname, color="yellow"):
+        """Previous versions of a credential, numbered for restore"""
+        name, login = splitname(fullname)
+        versions = self.database.versions(name=name, login=login)
+        if not versions:
+            raise ValueError("No previous version of '{}'".format(fullname))
+        credentials = [v.credential for v in versions]
+        if self.show_password:
+            credentials = self.decrypt_credentials(
+                credentials, passphrase=self.get_passphrase())
+        table = [
+            [number,
+             time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(v.time)),
+             CLI.colored(c.name, color),
+             c.login,
+             c.password if self.show_password else "***",
+             c.comment]
+            for number, (v, c) in enumerate(zip(versions, credentials))]
+        headers = ["Version", "Replaced"] + self.headers
+        self.write("\n{}\n".format(
+            tabulate(table, headers, tablefmt=self.tablefmt)))
+
+    def restore_credential(self, fullname, number=0):
+        name, login = splitname(fullname)
+        versions = self.database.versions(name=name, login=login)
+        if number >= len(versions):
+            raise ValueError("'{}' has no version {}".format(fullname,
+                                                             number))
+        self.show([versions[number].credential], color="Red")
+        if self.prompt_confirmation("Restore this version?"):
+            restored = self.database.restore(name=name, login=login,
+                                             number=number)
+            logging.info("Restored version {} of {}".format(
+                number, asfullname(restored.name, restored.login)))
+
+    def rotate_credentials(self, query, hook=None, report=None,
+                           batch_size=50):
+        credentials = self.database.search(query=query)
+        if not credentials:
+            raise CredentialNotFoundError(query)
+        self.show(credentials, color="Red")
+        confirmed = self.prompt_confirmation(
+            "Rotate passwords of these credentials?")
+        if confirmed:
+            passphrase = self.get_passphrase()
+            if self.database.fingerprints.enabled:
+                self.database.unlock_fingerprints(passphrase)
+            rotation = Rotation(
+                self.database,
+                passphrase,
+                batch_size=batch_size,
+                hook=hook,
+                report=report)
+            for cred in rotation.run(credentials):
+                logging.info("Rotated password: {}".format(
+                    asfullname(cred.name, cred.login)))
+            for batch, error in rotation.failed:
+                logging.warning("Not rotated, {}: {}".format(
+                    error.__class__.__name__, ", ".join(
+                        asfullname(c.name, c.login) for c in batch)))
+
+    def audit_credentials(self, hashlist, bloom=None):
+        """Show credentials whose password appears in a breached password
+        hash list"""
+        passphrase = self.get_passphrase()
+        bloom = bloom or default_bloom(hashlist)
+        with HashList(hashlist, BloomFilter.open(bloom) if bloom else None
+                      ) as hashes:
+            found = audit(self.database, passphrase, hashes)
+        if not found:
+            logging.info("No breached password found")
+            return
+        table = [[CLI.colored(asfullname(c.name, c.login), "red"), count]
+                 for c, count in found]
+        self.write("\n{}\n".format(
+            tabulate(table, ["Credential", "Breaches"],
+                     tablefmt=self.tablefmt)))
+
+    def reuse_report(self):
+        """Show groups of credentials sharing a password. The first report
+        starts fingerprinting passwords, later ones decrypt nothing"""
+        groups = self.database.reuse(self.get_passphrase())
+        if not groups:
+            logging.info("No reused password found")
+            return
+        table = [[number, CLI.colored(fullname, "red")]
+                 for number, group in enumerate(groups, 1)
+                 for fullname in group]
+        self.write("\n{}\n".format(
+            tabulate(table, ["Group", "Credential"],
+                     tablefmt=self.tablefmt)))
+
+    def build_bloom(self, hashlist, error_rate=0.001):
+        logging.info("Wrote {}".format(BloomFilter.build(
+            hashlist, hashlist + ".bloom", error_rate)))
+
+    def copy_to_clipboard(self, fullname, clear_after=CLEAR_AFTER):
         name, login = splitname(fullname)
         credentials = self.database.get(name=name, login=login)
 
@@ -170,12 +344,72 @@ class CLI(object):
             logging.warning("Multiple credentials were found."
                             "Copying first credential password to clipboard")
 
-        credential = credentials[0]
-        passphrase = self.get_passphrase()
-        pyperclip.copy(
-            self.database.decrypt(credential.password, passphrase))
+        self.copy_password(credentials[0], clear_after)
+
+    def copy_password(self, credential, clear_after=CLEAR_AFTER):
+        # a successful decryption proves the passphrase, no need to check
+        password = self.database.unlock(credential.password,
+                                        getpass("Passphrase: "))
+        if password is None:
+            raise ValueError("Wrong passphrase")
+        pyperclip.copy(password)
         logging.info("Password for `{}` copied to clipboard".format(
             asfullname(credential.name, credential.login)))
+        if clear_after:
+            schedule_clear(password, clear_after)
+            logging.info("Clipboard cleared in {} seconds".format(
+                clear_after))
+
+    def interactive(self, clear_after=CLEAR_AFTER):
+        """Pick a credential by incremental search, copy its password"""
+        with self.database.load_index() as index:
+            lines = [index.line(i) for i in range(len(index))]
+            paths = [index.path(i) for i in range(len(index))]
+            fullnames = [asfullname(index.name(i).decode("utf-8"),
+                                    index.login(i))
+                         for i in range(len(index))]
+        chosen = tui.select(lines)
+        if chosen is None:
+            return
+        credentials = self.database.load_paths([paths[chosen]])
+        if not credentials:
+            # removed since the index was read
+            raise CredentialNotFoundError(fullnames[chosen])
+        self.copy_password(credentials[0], clear_after)
+
+    def rekey_database(self):
+        passphrase = self.get_passphrase()
+        new_passphrase = self.prompt("New passphrase for database: ",
+                                     password=True)
+        self.database.rekey(passphrase, new_passphrase,
+                            profile=self.key_profile)
+        logging.info("Database '{}' re-encrypted with a new key".format(
+            self.database.path))
+
+    def migrate_database(self, layout):
+        moved = self.database.migrate(layout)
+        logging.info("Moved {} credentials to the {} layout".format(
+            moved, layout))
+
+    def sync_database(self, path, prefer=None):
+        # opening a missing database would start creating one
+        if not os.path.isdir(os.path.join(path, ".keys")):
+            raise ValueError("Database not found at '{}'".format(path))
+        result = self.database.sync(Database(path), prefer=prefer)
+        logging.info("Pulled {} and pushed {} credentials".format(
+            len(result.pulled), len(result.pushed)))
+        for relpath in result.conflicts:
+            logging.warning("Conflict, changed on both sides: {}".format(
+                relpath))
+
+    def convert_database(self, ciphertext):
+        converted = self.database.convert(ciphertext)
+        logging.info("Converted {} passwords to {} ciphertext".format(
+            converted, ciphertext))
+
+    def collect_blobs(self):
+        removed = self.database.collect_blobs()
+        logging.info("Deleted {} unreferenced blobs".format(removed))
 
     def exportdb(self, dbfile):
         self.database.exportdb(dbfile)
@@ -0,0 +1,76 @@
+"""Clear the clipboard once a copied password expired.
+
+`schedule_clear` spawns a detached python process running this module: it
+sleeps, then clears the clipboard only if it still holds the copied value.
+The value itself never leaves the parent process, the child only gets a
+salted digest of it on stdin.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+CLEAR_AFTER = 30
+
+
+def digest(text, salt):
+    return hmac.new(salt, text.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def detached():
+    """Popen options running the child outside of our session, so it
+    outlives the terminal and is not killed by a ctrl-c"""
+    if os.name == "nt":
+        # DETACHED_PROCESS
+        return {"creationflags": 0x00000008}
+    return {"preexec_fn": os.setsid}
+
+
+def schedule_clear(text, seconds=CLEAR_AFTER):
+    """Clear the clipboard in seconds unless text was replaced meanwhile"""
+    salt = os.urandom(16)
+    devnull = open(os.devnull, "w")
+    try:
+        child = subprocess.Popen(
+            [sys.executable, "-m", "pysswords.clipboard", str(seconds)],
+            stdin=subprocess.PIPE,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            **detached())
+    finally:
+        devnull.close()
+    message = {"salt": binascii.hexlify(salt).decode("ascii"),
+               "digest": digest(text, salt)}
+    child.stdin.write(json.dumps(message).encode("utf-8"))
+    child.stdin.close()
+    return child
+
+
+def clear_if_unchanged(salt, expected):
+    """Clear the clipboard if it holds the value digested as expected"""
+    # imported here, pyperclip refuses to import without a clipboard
+    import pyperclip
+    current = pyperclip.paste() or ""
+    if hmac.compare_digest(str(digest(current, salt)), str(expected)):
+        pyperclip.copy("")
+        return True
+    return False
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    seconds = float(argv[0])
+    message = json.loads(sys.stdin.read())
+    time.sleep(seconds)
+    clear_if_unchanged(binascii.unhexlify(message["salt"]),
+                       message["digest"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Shell completion of credential full names.
+
+Completion runs on every TAB press, so this module only uses the standard
+library and never starts gpg or reads credentials: it answers from the
+names cache databases keep next to their index. Shells run this file
+directly, without site packages, to keep interpreter start up short.
+
+    eval "$(pysswords --completion bash)"
+"""
+from __future__ import print_function, unicode_literals
+import io
+import os
+import re
+import shlex
+import sys
+
+
+NAMES_FILE = os.path.join(".index", "names")
+OPTIONS = ("-g", "--get", "-c", "--clipboard", "-u", "--update",
+           "-r", "--remove")
+DATABASE_OPTIONS = ("-D", "--database")
+SHELLS = ("bash", "zsh")
+
+BASH_SCRIPT = """\
+_pysswords() {
+    local line=${COMP_LINE:0:COMP_POINT} word=${COMP_WORDS[COMP_CWORD]}
+    local current=${line##*[[:space:]]}
+    # bash splits words on @, only the part after it gets replaced
+    local typed=${current%%"$word"}
+    local IFS=$'\\n'
+    COMPREPLY=($("%(python)s" -S -E "%(script)s" --line "$line"))
+    COMPREPLY=("${COMPREPLY[@]#"$typed"}")
+}
+complete -o default -F _pysswords pysswords
+"""
+
+ZSH_SCRIPT = """\
+_pysswords() {
+    local line="${(j: :)${(@q)words[1,CURRENT-1]}} ${(q)PREFIX}"
+    local -a names
+    names=(${(f)"$("%(python)s" -S -E "%(script)s" --line "$line")"})
+    if (( ${#names} )); then
+        compadd -- $names
+    else
+        _files
+    fi
+}
+compdef _pysswords pysswords
+"""
+
+
+def default_db():
+    return os.path.join(os.path.expanduser("~"), ".pysswords")
+
+
+def names_path(path):
+    return os.path.join(path, NAMES_FILE)
+
+
+def read_names(path):
+    """Generation the names cache of the database at path was built at
+    and its full names, None and no names without a cache"""
+    try:
+        with io.open(names_path(path), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return None, []
+    return (lines[0], lines[1:]) if lines else (None, [])
+
+
+def read_cache(path):
+    """Raw full name lines of the names cache of the database at path"""
+    try:
+        with open(names_path(path), "rb") as f:
+            data = f.read()
+    except IOError:
+        return b""
+    return data[data.find(b"\n") + 1:]
+
+
+def candidates(data, prefix):
+    """Full names and bare names of names cache lines starting with prefix,
+    credentials without login only by name. Lines are matched as bytes,
+    without splitting or decoding the whole cache"""
+    escaped = re.escape(prefix.encode("utf-8"))
+    # every line ends with a newline, one is added before the first so a
+    # literal newline starts each line. Names follow the last @ of their
+    # line, logins may contain some
+    data = b"\n" + data
+    found = set(re.findall(b"@(" + escaped + b"[^\n@]*)\n", data))
+    found.update(fullname for fullname in re.findall(
+        b"\n(" + escaped + b"[^\n]*)", data)
+        if fullname and not fullname.startswith(b"@"))
+    return sorted(name.decode("utf-8") for name in found)
+
+
+def complete(line):
+    """Completions of the last word of a command line"""
+    try:
+        words = shlex.split(line)
+    except ValueError:
+        # unterminated quote while typing
+        words = line.split()
+    if not line or line[-1].isspace():
+        words.append("")
+    if len(words) < 3 or words[-2] not in OPTIONS:
+        return []
+    databases = [words[i + 1] for i, word in enumerate(words[:-2])
+                 if word in DATABASE_OPTIONS]
+    data = b"".join(read_cache(os.path.expanduser(database))
+                    for database in databases or [default_db()])
+    return candidates(data, words[-1])
+
+
+def script(shell):
+    """Completion function for shell, calling this file with the running
+    python"""
+    template = {"bash": BASH_SCRIPT, "zsh": ZSH_SCRIPT}[shell]
+    filename = os.path.abspath(__file__)
+    if filename.endswith((".pyc", ".pyo")):
+        filename = filename[:-1]
+    return template % {"python": sys.executable, "script": filename}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 2 and argv[0] == "--line":
+        line = argv[1]
+        if isinstance(line, bytes):
+            # python 2 arguments
+            line = line.decode("utf-8")
+        output = "".join(c + "\n" for c in complete(line))
+        getattr(sys.stdout, "buffer", sys.stdout).write(
+            output.encode("utf-8"))
+    elif len(argv) == 2 and argv[0] == "--script" and argv[1] in SHELLS:
+        print(script(argv[1]), end="")
+    else:
+        print("usage: completion.py --line LINE | --script {}".format(
+            "|".join(SHELLS)), file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
+import base64
+import struct
+
 import gnupg
 from .utils import which
 
@@ -6,16 +9,33 @@ def getgpg(path):
     return gnupg.GPG(binary=which("gpg"), homedir=path)
 
 
-def generate_key_input(path, passphrase):
+# ECC profiles need GnuPG 2.1 or later, they generate in milliseconds
+# where RSA 4096 can take minutes on entropy starved machines
+KEY_PROFILES = {
+    "rsa4096": dict(key_type="RSA", key_length=4096,
+                    subkey_type="RSA", subkey_length=4096),
+    "rsa3072": dict(key_type="RSA", key_length=3072,
+                    subkey_type="RSA", subkey_length=3072),
+    "rsa2048": dict(key_type="RSA", key_length=2048,
+                    subkey_type="RSA", subkey_length=2048),
+    "ed25519": dict(key_type="EDDSA", key_curve="ed25519",
+                    subkey_type="ECDH", subkey_curve="cv25519"),
+}
+DEFAULT_PROFILE = "rsa4096"
+
+
+def generate_key_input(path, passphrase, profile=DEFAULT_PROFILE):
+    try:
+        params = KEY_PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown key profile: {}".format(profile))
     return getgpg(path).gen_key_input(
         name_real="Pysswords",
         name_email="pysswords@pysswords",
         name_comment="Auto-generated by Pysswords",
-        key_length=4096,
-        key_type="RSA",
-        subkey_type="RSA",
         expire_date=0,
-        passphrase=passphrase)
+        passphrase=passphrase,
+        **params)
 
 
 def generate_keys(path, key_input):
@@ -23,14 +43,154 @@ def generate_keys(path, key_input):
     return key
 
 
-def create_keyring(path, passphrase):
-    key_input = generate_key_input(path, passphrase)
+def create_keyring(path, passphrase, profile=DEFAULT_PROFILE):
+    key_input = generate_key_input(path, passphrase, profile)
     generate_keys(path, key_input)
     return path
 
 
+def import_keyring(path, keyfile):
+    """Use an existing ascii armored key pair instead of generating one"""
+    with open(keyfile) as f:
+        result = getgpg(path).import_keys(f.read())
+    if not getgpg(path).list_keys(secret=True):
+        raise ValueError("No private key found in '{}'".format(keyfile))
+    return result
+
+
+ARMOR_HEADER = "-----BEGIN PGP MESSAGE-----"
+ARMOR_FOOTER = "-----END PGP MESSAGE-----"
+COMPACT_PREFIX = "pgp:"
+ARMOR = "armor"
+COMPACT = "compact"
+CIPHERTEXT_FORMATS = (ARMOR, COMPACT)
+# public key and symmetric key encrypted session key packets: versions
+# and smallest body, with a key id and one MPI or a simple S2K specifier
+SESSION_KEYS = {1: ((3, 6), 13), 3: ((4, 5, 6), 4)}
+# symmetrically encrypted, integrity protected and AEAD encrypted data
+ENCRYPTED_DATA_TAGS = (9, 18, 20)
+
+
+def crc24(data):
+    """OpenPGP armor checksum (RFC 4880 section 6.1)"""
+    crc = 0xB704CE
+    for byte in bytearray(data):
+        crc ^= byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+    return crc & 0xFFFFFF
+
+
+def is_compact(data):
+    """Compact ciphertext: the binary OpenPGP message, base64 encoded on
+    a single line after a `pgp:` prefix"""
+    if not data.startswith(COMPACT_PREFIX):
+        return False
+    try:
+        packet = base64.b64decode(data[len(COMPACT_PREFIX):].encode("ascii"))
+    except (TypeError, ValueError):
+        return False
+    return is_message(bytearray(packet))
+
+
+def packet_header(data, offset):
+    """Tag, header length and body length of the OpenPGP packet at offset
+    (RFC 4880 section 4.2), None when malformed. The body length is None
+    for partial and indeterminate lengths, only used by data packets"""
+    if len(data) < offset + 2 or not data[offset] & 0x80:
+        return None
+    if data[offset] & 0x40:
+        tag, first = data[offset] & 0x3F, data[offset + 1]
+        if first < 192:
+            return tag, 2, first
+        if first < 224:
+            if len(data) < offset + 3:
+                return None
+            return tag, 3, ((first - 192) << 8) + data[offset + 2] + 192
+        if first < 255:
+            return tag, 2, None
+        if len(data) < offset + 6:
+            return None
+        return tag, 6, struct.unpack(
+            ">I", bytes(data[offset + 2:offset + 6]))[0]
+    tag, size = (data[offset] >> 2) & 0x0F, data[offset] & 0x03
+    if size == 3:
+        return tag, 1, None
+    header = 1 + (1, 2, 4)[size]
+    if len(data) < offset + header:
+        return None
+    length = 0
+    for byte in data[offset + 1:offset + header]:
+        length = length * 256 + byte
+    return tag, header, length
+
+
+def is_message(data):
+    """Whether data is an encrypted OpenPGP message (RFC 4880 section
+    11.3): session key packets whose bodies start with a known version
+    and are long enough, followed by an encrypted data packet"""
+    offset, session_keys = 0, 0
+    while offset < len(data):
+        found = packet_header(data, offset)
+        if found is None:
+            return False
+        tag, header, length = found
+        if tag in ENCRYPTED_DATA_TAGS:
+            return session_keys > 0 and (length is None or 0 < length <=
+                                         len(data) - offset - header)
+        if tag not in SESSION_KEYS or length is None or (
+                offset + header + length > len(data)):
+            return False
+        versions, min_length = SESSION_KEYS[tag]
+        if length < min_length or data[offset + header] not in versions:
+            return False
+        session_keys += 1
+        offset += header + length
+    return False
+
+
+def compact(text):
+    """Compact form of an ascii armored message, unchanged otherwise"""
+    if not text.startswith(ARMOR_HEADER):
+        return text
+    lines = [line.strip() for line in text.strip().splitlines()]
+    body = lines[1:-1]
+    if "" in body:
+        # armor headers, such as Version, end with a blank line
+        body = body[body.index("") + 1:]
+    checksum = [line for line in body if line.startswith("=")]
+    encoded = "".join(line for line in body if not line.startswith("="))
+    data = base64.b64decode(encoded.encode("ascii"))
+    if checksum:
+        expected = base64.b64decode(checksum[0][1:].encode("ascii"))
+        if crc24(data) != struct.unpack(">I", b"\0" + expected)[0]:
+            raise ValueError("Corrupted PGP message: bad armor checksum")
+    return COMPACT_PREFIX + base64.b64encode(data).decode("ascii")
+
+
+def armor(text):
+    """Ascii armored form of a compact message, unchanged otherwise"""
+    if not is_compact(text):
+        return text
+    data = base64.b64decode(text[len(COMPACT_PREFIX):].encode("ascii"))
+    encoded = base64.b64encode(data).decode("ascii")
+    checksum = base64.b64encode(struct.pack(">I", crc24(data))[1:])
+    lines = [ARMOR_HEADER, ""]
+    lines.extend(encoded[i:i + 64] for i in range(0, len(encoded), 64))
+    lines.append("=" + checksum.decode("ascii"))
+    lines.append(ARMOR_FOOTER)
+    return "\n".join(lines) + "\n"
+
+
+def encode(text, ciphertext=ARMOR):
+    """Message in the ciphertext format"""
+    return compact(text) if ciphertext == COMPACT else armor(text)
+
+
 def is_encrypted(data):
-    if data.startswith("-----BEGIN PGP MESSAGE-----"):
+    if data.startswith(ARMOR_HEADER) or is_compact(data):
         return True
     else:
         return False
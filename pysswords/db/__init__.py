@@ -1,4 +1,7 @@
 from .credential import Credential
 from .credential import CredentialExistsError
 from .credential import CredentialNotFoundError
+from .credential import CredentialModifiedError
 from .database import Database, DatabaseExistsError
+from .cache import SecretCache
+from .federation import Federation
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .storage import atomic_write
+from . import scanner
+
+
+BLOBS_DIR = ".blobs"
+# comments shorter than this, in utf-8 bytes, stay in the credential file:
+# a reference takes about 80 bytes, plus a file of its own
+MIN_SIZE = 256
+
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def isref(value):
+    return isinstance(value, dict) and "blob" in value
+
+
+class BlobStore(object):
+    """Content addressed storage of credential comments.
+
+    Each distinct comment of at least min_size bytes is written once under
+    `.blobs`, named by its sha256, and credential files hold a
+    `{"blob": digest}` reference instead. Blobs never change once written,
+    so they are cached in memory after their first read and writing one
+    that exists only touches it.
+    Blobs are shared, removing a credential leaves them in place until
+    `collect`.
+    """
+
+    def __init__(self, path, fsync=True, min_size=MIN_SIZE):
+        self.root = os.path.join(path, BLOBS_DIR)
+        self.fsync = fsync
+        self.min_size = min_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def blobpath(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, text):
+        key = digest(text)
+        blobpath = self.blobpath(key)
+        try:
+            # a fresh mtime protects the blob from a concurrent collect
+            os.utime(blobpath, None)
+        except OSError:
+            atomic_write(blobpath, json.dumps(text), fsync=self.fsync)
+        with self._lock:
+            self._cache[key] = text
+        return key
+
+    def get(self, key):
+        with self._lock:
+            text = self._cache.get(key)
+        if text is None:
+            with open(self.blobpath(key)) as f:
+                text = json.load(f)
+            with self._lock:
+                self._cache[key] = text
+        return text
+
+    def pack(self, credential):
+        """Credential with its comment replaced by a blob reference, short
+        comments are kept inline"""
+        comment = credential.comment
+        if (not comment or isref(comment) or
+                len("{}".format(comment).encode("utf-8")) < self.min_size):
+            return credential
+        return credential._replace(comment={"blob": self.put(
+            credential.comment)})
+
+    def unpack(self, credential):
+        """Credential with its comment blob reference resolved"""
+        if not isref(credential.comment):
+            return credential
+        return credential._replace(comment=self.get(
+            credential.comment["blob"]))
+
+    def collect(self, referenced, grace=3600):
+        """Delete blobs whose digest is not in referenced, returns their
+        number. Blobs written or reused less than grace seconds ago are
+        kept, their credential may not be written yet"""
+        referenced = set(referenced)
+        expired = time.time() - grace
+        removed = 0
+        for shard in scanner.entries(self.root):
+            for entry in scanner.entries(shard.path):
+                if (entry.name in referenced or entry.name.startswith(".")
+                        or entry.stat().st_mtime > expired):
+                    continue
+                os.remove(entry.path)
+                removed += 1
+            try:
+                os.rmdir(shard.path)
+            except OSError:
+                pass
+        with self._lock:
+            self._cache.clear()
+        return removed
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+clock = getattr(time, "monotonic", time.time)
+
+
+def wipe(buf):
+    """Overwrite bytearray contents with zeros. Best effort only, copies
+    handed out as strings are beyond our reach."""
+    for i in range(len(buf)):
+        buf[i] = 0
+
+
+class SecretCache(object):
+    """Bounded LRU cache of decrypted passwords with per entry TTL.
+
+    Entries are keyed by a digest of the ciphertext and a salted digest of
+    the passphrase, so a wrong passphrase never hits a cached plaintext.
+    Plaintext is kept in a bytearray that is wiped on eviction.
+    """
+
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._salt = os.urandom(16)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cipher_digest(self, ciphertext):
+        return hashlib.sha256(ciphertext.encode("utf-8")).hexdigest()
+
+    def _key(self, ciphertext, passphrase):
+        passphrase_digest = hmac.new(
+            self._salt,
+            passphrase.encode("utf-8"),
+            hashlib.sha256
+        ).hexdigest()
+        return (self._cipher_digest(ciphertext), passphrase_digest)
+
+    def _evict(self, key):
+        _, secret = self._entries.pop(key)
+        wipe(secret)
+
+    def get(self, ciphertext, passphrase):
+        key = self._key(ciphertext, passphrase)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, secret = entry
+            if expires <= clock():
+                self._evict(key)
+                return None
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            return secret.decode("utf-8")
+
+    def put(self, ciphertext, passphrase, plaintext):
+        if self.maxsize <= 0:
+            return
+        key = self._key(ciphertext, passphrase)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            secret = bytearray(plaintext.encode("utf-8"))
+            self._entries[key] = (clock() + self.ttl, secret)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, ciphertext):
+        digest = self._cipher_digest(ciphertext)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == digest]:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+
+def signature(stat):
+    """Version stamp of a file: changes whenever the file is rewritten."""
+    mtime = getattr(stat, "st_mtime_ns", None) or stat.st_mtime
+    return (mtime, stat.st_size, stat.st_ino)
+
+
+class CredentialCache(object):
+    """Parsed credentials keyed by file path and file signature.
+
+    Files whose signature did not change since the last load are served
+    from memory, costing one stat instead of a YAML parse.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, path, stat=None):
+        stat = stat or os.stat(path)
+        sig = signature(stat)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        credential = self.loader(path)
+        with self._lock:
+            self._entries[path] = (sig, credential)
+        return credential
+
+    def version(self, path):
+        """Signature of path when it was last loaded"""
+        entry = self._entries.get(path)
+        return entry[0] if entry is not None else None
+
+    def retain(self, paths):
+        """Forget every cached path not in paths"""
+        paths = set(paths)
+        with self._lock:
+            for path in [p for p in self._entries if p not in paths]:
+                del self._entries[path]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,8 +1,8 @@
 from __future__ import unicode_literals
 from collections import namedtuple
+import hashlib
 import os
 import re
-import shutil
 import yaml
 
 
@@ -17,7 +17,24 @@ class CredentialNotFoundError(Exception):
     pass
 
 
-def expandpath(path, name, login):
+class CredentialModifiedError(Exception):
+    pass
+
+
+FLAT = "flat"
+SHARDED = "sharded"
+LAYOUTS = (FLAT, SHARDED)
+
+
+def shard(name):
+    """Two levels of directories spreading names evenly, as `ab/cd`"""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def expandpath(path, name, login, layout=FLAT):
+    if layout == SHARDED:
+        path = os.path.join(path, *shard(name))
     return os.path.join(path, name, "{}.pyssword".format(login))
 
 
@@ -37,16 +54,41 @@ def asstring(credential):
     )
 
 
-def exists(path, name, login):
-    return True if os.path.isfile(expandpath(path, name, login)) else False
-
-
-def clean(path, name, login):
-    if exists(path, name, login):
-        os.remove(expandpath(path, name, login))
-    credential_dir = os.path.dirname(expandpath(path, name, login))
-    if not os.listdir(credential_dir):
-        shutil.rmtree(credential_dir)
+def exists(path, name, login, layout=FLAT):
+    cred_path = expandpath(path, name, login, layout)
+    return True if os.path.isfile(cred_path) else False
+
+
+def prune(credential_dir, root=None):
+    """Remove credential_dir if empty, then the parents it leaves empty
+    below root, as shard directories or those of names with slashes"""
+    # rmdir only removes empty directories, so a credential written
+    # concurrently in the same directory is never deleted with it
+    while True:
+        try:
+            os.rmdir(credential_dir)
+        except OSError:
+            return
+        credential_dir = os.path.dirname(credential_dir)
+        if root is None or os.path.relpath(credential_dir,
+                                           root).startswith("."):
+            return
+
+
+def clean(path, name, login, layout=FLAT):
+    cred_path = expandpath(path, name, login, layout)
+    if os.path.isfile(cred_path):
+        os.remove(cred_path)
+    prune(os.path.dirname(cred_path), path)
+
+
+def check_name(name):
+    """Raise ValueError for names the database would hide: directories
+    starting with a dot are reserved for its internals"""
+    parts = name.replace(os.sep, "/").split("/")
+    if any(part.startswith(".") for part in parts):
+        raise ValueError("Credential names can't start with '.': {}".format(
+            name))
 
 
 def splitname(fullname):
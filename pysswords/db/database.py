@@ -1,23 +1,57 @@
-import fnmatch
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 import os
-import re
 import shutil
 import tarfile
 import yaml
 
-from pysswords.crypt import create_keyring, getgpg, is_encrypted
+from pysswords.crypt import (
+    ARMOR,
+    CIPHERTEXT_FORMATS,
+    DEFAULT_PROFILE,
+    armor,
+    encode,
+    create_keyring,
+    getgpg,
+    import_keyring,
+    is_encrypted
+)
 from .credential import (
+    FLAT,
+    LAYOUTS,
     Credential,
     CredentialNotFoundError,
     CredentialExistsError,
+    CredentialModifiedError,
     content,
     expandpath,
     exists,
+    check_name,
     clean,
-    asstring,
     asfullname
 )
+from . import history
 from . import parsers
+from . import scanner
+from . import index
+from .journal import Transaction, recover, version
+from .layout import (
+    config_path,
+    layouts,
+    migrate,
+    read_config,
+    update_config,
+    write_config
+)
+from .locking import MultiLock, index_lock, name_lock, writers_lock
+from .rekey import Rekey, complete as complete_rekey
+from .storage import atomic_write
+from .blobs import BlobStore, isref
+from .sync import sync
+from .watch import LiveView
+from .query import compile_query
+from .fingerprints import Fingerprints
+from .cache import CredentialCache, SecretCache, signature
 from pysswords.python_two import makedirs
 
 
@@ -27,28 +61,157 @@ class DatabaseExistsError(Exception):
 
 class Database(object):
 
-    def __init__(self, path):
+    def __init__(self, path, cache_size=0, cache_ttl=300, workers=8,
+                 durability="fsync"):
         self.path = path
         self.keys_path = os.path.join(self.path, ".keys")
+        rekeyed = complete_rekey(self.path)
         self.gpg = getgpg(self.keys_path)
+        self.workers = workers
+        self.durability = durability
+        self.blobs = None
+        self.configured = False
+        self.configure()
+        self.cache = SecretCache(cache_size, cache_ttl) if cache_size else None
+        self.fingerprints = Fingerprints(self)
+        self.parsed = CredentialCache(self.load_credential)
+        self._batch = None
+        self._batch_names = []
+        if recover(self.path, fsync=durability != "none") or rekeyed:
+            self.changed()
+
+    def configure(self):
+        """Read the database settings again if another process changed
+        them since, as a layout migration does while the database is in
+        use. Only stats the config file otherwise. Returns True when read"""
+        try:
+            stamp = signature(os.stat(config_path(self.path)))
+        except OSError:
+            stamp = None
+        if stamp == self.configured:
+            return False
+        self.configured = stamp
+        config = read_config(self.path)
+        self.layouts = layouts(config)
+        self.layout = self.layouts[0]
+        self.ciphertext = config.get("ciphertext", ARMOR)
+        # previous versions kept per credential, 0 keeps none
+        self.keep = config.get("history", history.KEEP)
+        if not config.get("blobs"):
+            self.blobs = None
+        elif self.blobs is None:
+            self.blobs = BlobStore(self.path,
+                                   fsync=self.durability != "none")
+        return True
 
     @classmethod
-    def create(cls, path, passphrase):
+    def create(cls, path, passphrase, profile=DEFAULT_PROFILE, keyfile=None,
+               layout=FLAT, blobs=False, ciphertext=ARMOR):
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown database layout: {}".format(layout))
+        if ciphertext not in CIPHERTEXT_FORMATS:
+            raise ValueError("Unknown ciphertext format: {}".format(
+                ciphertext))
         try:
             makedirs(path, exist_ok=False)
         except OSError:
             raise DatabaseExistsError("Database exists")
-        create_keyring(os.path.join(path, ".keys"), passphrase)
+        config = {"layout": layout} if layout != FLAT else {}
+        if blobs:
+            config["blobs"] = True
+        if ciphertext != ARMOR:
+            config["ciphertext"] = ciphertext
+        if config:
+            # default databases have no config, like those created before it
+            write_config(path, config)
+        if keyfile:
+            import_keyring(os.path.join(path, ".keys"), keyfile)
+        else:
+            create_keyring(os.path.join(path, ".keys"), passphrase, profile)
+        # empty names cache, kept up to date by every write from now on
+        index.write_names(path, [], index.generation(path))
         return Database(path)
 
     @property
     def credentials(self):
-        creds = []
-        for root, dirnames, filenames in os.walk(self.path):
-            for filename in fnmatch.filter(filenames, '*.pyssword'):
-                with open(os.path.join(root, filename)) as f:
-                    creds.append(yaml.load(f))
-        return creds
+        found = scanner.scan(self.path, self.parsed.load, self.workers,
+                             lock=self.lock)
+        self.parsed.retain(path for path, _ in found)
+        return [credential for _, credential in found]
+
+    def changed(self, names=None):
+        """Record that credentials were written or removed. names are the
+        (full name, exists) pairs that changed, keeping the completion
+        names cache current, None when unknown"""
+        fsync = self.durability != "none"
+        with index_lock(self.path):
+            previous = index.generation(self.path)
+            token = index.touch(self.path, fsync=fsync)
+            index.update_names(self.path, previous, token, names, fsync)
+
+    def load_index(self):
+        """Index of credential names, rebuilt from a scan when a write
+        happened since it was built. Close it after use"""
+        token = index.generation(self.path)
+        current = index.Index.open(self.path, token)
+        if current is None:
+            found = scanner.scan(self.path, self.parsed.load, self.workers,
+                                 lock=self.lock)
+            self.parsed.retain(path for path, _ in found)
+            current = index.write(
+                self.path,
+                [(os.path.relpath(p, self.path), c) for p, c in found],
+                token)
+        return current
+
+    def load_paths(self, relpaths):
+        """Credentials of relative paths, skipping removed ones"""
+        found = []
+        for relpath in relpaths:
+            cred_path = os.path.join(self.path, relpath)
+            with self.lock(os.path.dirname(cred_path)):
+                try:
+                    found.append(self.parsed.load(cred_path))
+                except (IOError, OSError):
+                    continue
+        return found
+
+    @staticmethod
+    def read_credential(path):
+        with open(path) as f:
+            return yaml.load(f)
+
+    def load_credential(self, path):
+        credential = self.read_credential(path)
+        if self.blobs is not None:
+            credential = self.blobs.unpack(credential)
+        return credential
+
+    def pack(self, credential):
+        """Credential as stored in its file"""
+        if self.blobs is not None:
+            credential = self.blobs.pack(credential)
+        return credential
+
+    def expandpath(self, name, login):
+        """Path of a credential in the current layout"""
+        return expandpath(self.path, name, login, self.layout)
+
+    def locate(self, name, login):
+        """Layout holding a credential while a migration runs, the current
+        layout when it does not exist"""
+        for layout in self.layouts:
+            if exists(self.path, name, login, layout):
+                return layout
+        return self.layout
+
+    def lock(self, credential_dir, exclusive=False):
+        name = os.path.relpath(credential_dir, self.path)
+        if exclusive:
+            # shared by writers, a rekey stops them all taking it exclusive
+            return MultiLock([writers_lock(self.path),
+                              name_lock(self.path, name, exclusive)])
+        return name_lock(self.path, name, exclusive)
 
     def key(self, private=False):
         try:
@@ -58,6 +221,7 @@ class Database(object):
         return key.get("fingerprint")
 
     def build_credential(self, name, login, password, comment, encrypt=True):
+        check_name(name)
         if encrypt and not is_encrypted(password):
             password = self.encrypt(password)
         return Credential(
@@ -67,78 +231,348 @@ class Database(object):
             comment=comment
         )
 
+    @contextmanager
+    def batch(self):
+        """Group writes and removals in a journaled transaction, committed
+        with a single sync when the block exits and discarded if it raises"""
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = Transaction(self.path,
+                                  fsync=self.durability != "none")
+        try:
+            yield self._batch
+            self._batch.commit()
+            self.changed(self._batch_names)
+        except:
+            self._batch.rollback()
+            raise
+        finally:
+            self._batch = None
+            self._batch_names = []
+
     def write_credential(self, credential):
-        if exists(self.path, credential.name, credential.login):
-            raise CredentialExistsError(
-                asfullname(credential.name, credential.login))
-        cred_path = expandpath(self.path, credential.name, credential.login)
-        makedirs(os.path.dirname(cred_path), exist_ok=True)
-        with open(cred_path, "w") as f:
-            f.write(content(credential))
+        check_name(credential.name)
+        self.configure()
+        cred_path = self.expandpath(credential.name, credential.login)
+        fullname = asfullname(credential.name, credential.login)
+        if self._batch is not None:
+            if self._batch.exists(cred_path) or any(
+                    exists(self.path, credential.name, credential.login, l)
+                    for l in self.layouts[1:]):
+                raise CredentialExistsError(fullname)
+            self._batch.expect(cred_path, None, fullname)
+            self._batch.write(cred_path, content(self.pack(credential)))
+            self._batch_names.append((fullname, True))
+            return cred_path
+        with self.lock(os.path.dirname(cred_path), exclusive=True):
+            # a migration started while waiting for the lock would not
+            # find a credential written to the layout it moves away from
+            if self.configure():
+                cred_path = None
+            elif any(exists(self.path, credential.name, credential.login, l)
+                     for l in self.layouts):
+                raise CredentialExistsError(fullname)
+            else:
+                atomic_write(cred_path, content(self.pack(credential)),
+                             fsync=self.durability != "none")
+        if cred_path is None:
+            return self.write_credential(credential)
+        self.changed([(fullname, True)])
         return cred_path
 
     def add(self, name, login, password, comment):
         credential = self.build_credential(name, login, password, comment)
         self.write_credential(credential)
+        fingerprint = self.fingerprint(password)
+        if fingerprint is not None:
+            self.fingerprints.update({asfullname(name, login): fingerprint})
         return credential
 
+    def fingerprint(self, password):
+        """Fingerprint of a plain text password, None while the
+        fingerprint key is locked"""
+        if self.fingerprints.key is None or is_encrypted(password):
+            return None
+        return self.fingerprints.fingerprint(password)
+
+    def unlock_fingerprints(self, passphrase):
+        return self.fingerprints.unlock(passphrase)
+
+    def reuse(self, passphrase):
+        """Groups of full names sharing a password. Credentials written
+        while the fingerprint key was locked are decrypted once to
+        fingerprint them, others are not decrypted at all"""
+        if not self.unlock_fingerprints(passphrase):
+            raise ValueError("Wrong passphrase")
+        known = self.fingerprints.load()
+        current = dict((asfullname(c.name, c.login), c)
+                       for c in self.credentials)
+        missing = [c for n, c in current.items() if n not in known]
+
+        def fingerprint(credential):
+            password = self.unlock(credential.password, passphrase)
+            if password is None:
+                raise ValueError("Could not decrypt '{}'".format(
+                    asfullname(credential.name, credential.login)))
+            return (asfullname(credential.name, credential.login),
+                    self.fingerprints.fingerprint(password))
+
+        changes = dict((n, None) for n in known if n not in current)
+        if missing:
+            pool = ThreadPool(min(self.workers, len(missing)))
+            try:
+                changes.update(pool.map(fingerprint, missing))
+            finally:
+                pool.close()
+                pool.join()
+        self.fingerprints.update(changes)
+        return self.fingerprints.groups()
+
     def update(self, name, login, to_update):
         found = self.get(name, login)
         updated = []
-        for credential in found:
-            new_credential = self.build_credential(
-                name=to_update.get("name", credential.name),
-                login=to_update.get("login", credential.login),
-                password=to_update.get("password", credential.password),
-                comment=to_update.get("comment", credential.comment),
-                encrypt=True if to_update.get("password") else False
-            )
-            self.remove(credential.name, credential.login)
-            self.add(
-                name=new_credential.name,
-                login=new_credential.login,
-                password=new_credential.password,
-                comment=new_credential.comment,
-            )
-            updated.append(new_credential)
+        with self.batch():
+            for credential in found:
+                new_credential = self.build_credential(
+                    name=to_update.get("name", credential.name),
+                    login=to_update.get("login", credential.login),
+                    password=to_update.get("password", credential.password),
+                    comment=to_update.get("comment", credential.comment),
+                    encrypt=True if to_update.get("password") else False
+                )
+                if to_update.get("password"):
+                    fingerprint = self.fingerprint(to_update["password"])
+                elif self.fingerprints.key is not None:
+                    fingerprint = self.fingerprints.load().get(asfullname(
+                        credential.name, credential.login))
+                else:
+                    fingerprint = None
+                self.remove(credential.name, credential.login)
+                self.add(
+                    name=new_credential.name,
+                    login=new_credential.login,
+                    password=new_credential.password,
+                    comment=new_credential.comment,
+                )
+                if fingerprint is not None:
+                    self.fingerprints.update({asfullname(
+                        new_credential.name,
+                        new_credential.login): fingerprint})
+                updated.append(new_credential)
         return updated
 
     def remove(self, name, login):
         found = self.get(name, login)
         for credential in found:
-            clean(self.path, credential.name, credential.login)
+            self.remove_credential(credential)
+        self.fingerprints.update(dict(
+            (asfullname(c.name, c.login), None) for c in found))
+
+    def remove_credential(self, credential):
+        if self.cache is not None:
+            self.cache.invalidate(credential.password)
+        self.configure()
+        layout = self.locate(credential.name, credential.login)
+        cred_path = expandpath(self.path, credential.name, credential.login,
+                               layout)
+        fullname = asfullname(credential.name, credential.login)
+        stamp = self.parsed.version(cred_path)
+        if self._batch is not None:
+            # saved before the commit, a rollback leaves a copy of the
+            # current version in history
+            self.save_version(credential)
+            self._batch.expect(cred_path, stamp, fullname)
+            self._batch.remove(cred_path)
+            self._batch_names.append((fullname, False))
+            return
+        with self.lock(os.path.dirname(cred_path), exclusive=True):
+            if version(cred_path) != stamp:
+                raise CredentialModifiedError(fullname)
+            self.save_version(credential)
+            clean(self.path, credential.name, credential.login, layout)
+        self.changed([(fullname, False)])
+
+    def save_version(self, credential):
+        if self.keep:
+            history.append(self.path, self.pack(credential), self.keep,
+                           fsync=self.durability != "none")
+
+    def versions(self, name, login):
+        """Previous versions of a credential, newest first. Updates,
+        rotations and removals keep the version they replace"""
+        found = history.versions(self.path, name, login, self.keep)
+        if self.blobs is not None:
+            found = [v._replace(credential=self.blobs.unpack(v.credential))
+                     for v in found]
+        return found
+
+    def restore(self, name, login, number=0):
+        """Make a previous version current again, number 0 being the
+        newest. The version it replaces is kept in history"""
+        try:
+            credential = self.versions(name, login)[number].credential
+        except IndexError:
+            raise ValueError("'{}' has no version {}".format(
+                asfullname(name, login), number))
+        try:
+            current = self.get(name, login)[0]
+        except CredentialNotFoundError:
+            self.write_credential(credential)
+        else:
+            self.replace(current, credential)
+        # fingerprinted again by the next reuse report
+        self.fingerprints.update({asfullname(name, login): None})
+        return credential
+
+    def replace(self, credential, new_credential):
+        """Swap a credential read from this database for new_credential
+        in one transaction, without scanning the database again"""
+        with self.batch():
+            self.remove_credential(credential)
+            self.write_credential(new_credential)
+        return new_credential
 
     def get(self, name, login=None):
-        found = [c for c in self.credentials
-                 if c.name == name and ((login is None) or c.login == login)]
+        """Credentials named name, read from their expected paths instead
+        of scanning the whole database"""
+        self.configure()
+        found = []
+        for layout in self.layouts:
+            credential_dir = os.path.dirname(
+                expandpath(self.path, name, "", layout))
+            # names resolving outside the database or to its internals
+            if os.path.relpath(credential_dir, self.path).startswith("."):
+                continue
+            with self.lock(credential_dir):
+                if login is None:
+                    paths = [e.path for e in scanner.files(credential_dir)]
+                else:
+                    paths = [expandpath(self.path, name, login, layout)]
+                for cred_path in paths:
+                    try:
+                        credential = self.parsed.load(cred_path)
+                    except (IOError, OSError):
+                        continue
+                    if credential.name == name and (
+                            login is None or credential.login == login):
+                        found.append(credential)
         if not found:
             raise CredentialNotFoundError(asfullname(name, login))
         else:
             return found
 
     def search(self, query):
-        rgx = re.compile(query)
-        return [c for c in self.credentials if rgx.search(asstring(c))]
+        """Credentials matching a query, see `query` for its syntax"""
+        match = compile_query(query).match
+        with self.load_index() as current:
+            relpaths = current.search(match)
+        return self.load_paths(relpaths)
 
     def encrypt(self, text):
         encrypted = self.gpg.encrypt(
             text,
             self.key(),
             cipher_algo="AES256")
-        return str(encrypted)
+        return encode(str(encrypted), self.ciphertext)
 
-    def decrypt(self, text, passphrase):
-        decrypted = str(self.gpg.decrypt(text, passphrase=passphrase))
+    def cached(self, text, passphrase, decrypt):
+        """Plain text of text from the secret cache, or decrypt() cached
+        when it succeeds"""
+        if self.cache is not None:
+            cached = self.cache.get(text, passphrase)
+            if cached is not None:
+                return cached
+        decrypted = decrypt()
+        if self.cache is not None and decrypted:
+            self.cache.put(text, passphrase, decrypted)
         return decrypted
 
-    def check(self, passphrase):
+    def decrypt(self, text, passphrase):
+        return self.cached(text, passphrase, lambda: str(
+            self.gpg.decrypt(armor(text), passphrase=passphrase)))
+
+    def unlock(self, text, passphrase):
+        """Decrypt text, returning None when passphrase is wrong. A single
+        decryption proves the passphrase without the signature of check"""
+        def decrypt():
+            result = self.gpg.decrypt(armor(text), passphrase=passphrase)
+            return str(result) if result.ok else None
+        return self.cached(text, passphrase, decrypt)
+
+    def check(self, passphrase, key=None):
         sign = self.gpg.sign(
             "testing",
-            default_key=self.key(True),
+            default_key=key or self.key(True),
             passphrase=passphrase
         )
         return True if sign else False
 
+    def rekey(self, passphrase, new_passphrase, workers=4,
+              profile=DEFAULT_PROFILE):
+        """Re-encrypt all credentials to a new key protected by
+        new_passphrase. Interrupted runs resume from their checkpoint"""
+        rekey = Rekey(self, workers=workers)
+        rekey.prepare(new_passphrase, profile)
+        rekey.commit(passphrase)
+        self.changed(names=[])
+        self.gpg = getgpg(self.keys_path)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def migrate(self, layout):
+        """Move credentials to another layout while the database stays in
+        use. Returns the number of moved credentials"""
+        moved = migrate(self, layout)
+        self.changed(names=[])
+        return moved
+
+    def sync(self, other, prefer=None):
+        """Exchange changes with another replica of this database, see
+        `sync.sync`. Returns the relative paths pulled, pushed and in
+        conflict"""
+        return sync(self, other, prefer)
+
+    def watch(self, interval=1.0, polling=False, background=True):
+        """In memory view of the credentials kept current as any process
+        writes them, see `watch.LiveView`. Close it after use"""
+        view = LiveView(self, interval, polling)
+        return view.start() if background else view
+
+    def collect_blobs(self, grace=3600):
+        """Delete comment blobs no credential or saved version references
+        anymore, returns their number"""
+        if self.blobs is None:
+            return 0
+        found = scanner.scan(self.path,
+                             lambda path, _: self.read_credential(path),
+                             self.workers, lock=self.lock)
+        credentials = [c for _, c in found] + [
+            v.credential for filename in history.files(self.path)
+            for v in history.load(filename)]
+        return self.blobs.collect(
+            (c.comment["blob"] for c in credentials if isref(c.comment)),
+            grace)
+
+    def convert(self, ciphertext):
+        """Store every password in the ciphertext format, as written from
+        now on. Messages are only re-encoded, not decrypted. Returns the
+        number of converted credentials"""
+        if ciphertext not in CIPHERTEXT_FORMATS:
+            raise ValueError("Unknown ciphertext format: {}".format(
+                ciphertext))
+        update_config(self.path, ciphertext=ciphertext)
+        self.ciphertext = ciphertext
+        converted = 0
+        with self.batch():
+            for credential in self.credentials:
+                password = encode(credential.password, ciphertext)
+                if password != credential.password:
+                    self.replace(credential,
+                                 credential._replace(password=password))
+                    converted += 1
+        return converted
+
     def exportdb(self, dbfile):
         os.rename(shutil.make_archive(dbfile, "tar", self.path), dbfile)
 
@@ -149,8 +583,12 @@ class Database(object):
         else:
             with tarfile.open(dbfile) as tar:
                 tar.extractall(self.path)
+            self.changed()
+            # rebuilds the names cache for completion
+            self.load_index().close()
 
     def import1password(self, dbfile):
         creds = parsers.onepassword(dbfile)
-        for credential in creds:
-            self.add(**credential)
+        with self.batch():
+            for credential in creds:
+                self.add(**credential)
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+from multiprocessing.pool import ThreadPool
+
+from .credential import CredentialNotFoundError, asfullname
+
+
+def vault_names(paths):
+    """Short vault names: directory basenames, full paths when ambiguous"""
+    names = [os.path.basename(os.path.normpath(p)) for p in paths]
+    return [name if names.count(name) == 1 else path
+            for name, path in zip(names, paths)]
+
+
+class Federation(object):
+    """Several databases queried as one.
+
+    Lookups run against every vault concurrently and return (vault,
+    credential) pairs in vault order. Key fingerprints and passphrase
+    checks are cached for the life of the federation: each vault's keyring
+    is listed once and signed with at most once per passphrase.
+    """
+
+    def __init__(self, databases):
+        names = vault_names([database.path for database in databases])
+        self.vaults = OrderedDict(zip(names, databases))
+        self._keys = {}
+        self._checked = {}
+        self._salt = os.urandom(16)
+
+    def map(self, func, vaults=None):
+        """Call func(vault, database) for every vault concurrently"""
+        items = [(vault, database) for vault, database in self.vaults.items()
+                 if vaults is None or vault in vaults]
+        if not items:
+            return []
+        pool = ThreadPool(len(items))
+        try:
+            return pool.map(lambda item: func(*item), items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get(self, name, login=None):
+        def get_vault(vault, database):
+            try:
+                return [(vault, c) for c in database.get(name, login)]
+            except CredentialNotFoundError:
+                return []
+
+        found = [pair for pairs in self.map(get_vault) for pair in pairs]
+        if not found:
+            raise CredentialNotFoundError(asfullname(name, login))
+        return found
+
+    def search(self, query):
+        return [pair for pairs in self.map(
+                lambda vault, database: [(vault, c) for c in
+                                         database.search(query)])
+                for pair in pairs]
+
+    def key(self, vault):
+        """Private key fingerprint of vault"""
+        if vault not in self._keys:
+            self._keys[vault] = self.vaults[vault].key(private=True)
+        return self._keys[vault]
+
+    def check(self, vault, passphrase):
+        digest = hmac.new(self._salt, passphrase.encode("utf-8"),
+                          hashlib.sha256).hexdigest()
+        if (vault, digest) not in self._checked:
+            self._checked[vault, digest] = self.vaults[vault].check(
+                passphrase, key=self.key(vault))
+        return self._checked[vault, digest]
+
+    def unlocked(self, passphrase, vaults=None):
+        """Vaults opened by passphrase, checked concurrently"""
+        vaults = [v for v in self.vaults if vaults is None or v in vaults]
+        opened = self.map(lambda vault, _: self.check(vault, passphrase),
+                          vaults)
+        return [vault for vault, ok in zip(vaults, opened) if ok]
@@ -0,0 +1,166 @@
+import binascii
+import hashlib
+import hmac
+import json
+import os
+
+from pysswords.python_two import makedirs
+from .locking import FileLock, MultiLock, lockfile, writers_lock
+from .storage import atomic_write
+
+
+FINGERPRINTS_DIR = ".fingerprints"
+SECRET_FILE = os.path.join(FINGERPRINTS_DIR, "secret")
+INDEX_FILE = os.path.join(FINGERPRINTS_DIR, "index")
+
+
+COMPACT_AFTER = 32
+
+
+def records(filename):
+    """Encrypted change records of an index file, oldest first"""
+    try:
+        with open(filename) as f:
+            lines = f.readlines()
+    except IOError:
+        return []
+    found = []
+    for line in lines:
+        try:
+            found.append(json.loads(line))
+        except ValueError:
+            # line torn by a crash
+            continue
+    return found
+
+
+def dumps(record):
+    return json.dumps(record) + "\n"
+
+
+def rewrite(filename, func):
+    """Content of an index file with func applied to every record"""
+    return "".join(dumps(func(r)) for r in records(filename))
+
+
+class Fingerprints(object):
+    """HMAC-SHA256 fingerprints of passwords by credential full name.
+
+    Equal passwords have equal fingerprints, so reuse is found without
+    decrypting any credential. The HMAC key is random and stored encrypted
+    to the database key: without the passphrase fingerprints can't be
+    matched against guessed passwords. The index is encrypted too, so which
+    credentials share a password stays hidden. It is a log of encrypted
+    change records: writers append changes without the passphrase,
+    readers decrypt records they did not see yet and compact the log.
+    Fingerprints are only computed while the key is unlocked, credentials
+    written otherwise are fingerprinted by the next `Database.reuse`.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.path = database.path
+        self.key = None
+        self.passphrase = None
+        self.decrypted = {}
+
+    @property
+    def fsync(self):
+        return self.database.durability != "none"
+
+    @property
+    def enabled(self):
+        return os.path.isfile(os.path.join(self.path, SECRET_FILE))
+
+    def lock(self):
+        return MultiLock([writers_lock(self.path),
+                          FileLock(lockfile(self.path, FINGERPRINTS_DIR))])
+
+    def unlock(self, passphrase):
+        """Decrypt the key, created on first use. False when passphrase is
+        wrong"""
+        filename = os.path.join(self.path, SECRET_FILE)
+        key = None
+        if not os.path.isfile(filename):
+            with self.lock():
+                # unless another process created it meanwhile
+                if not os.path.isfile(filename):
+                    key = os.urandom(32)
+                    atomic_write(filename, self.database.encrypt(
+                        binascii.hexlify(key).decode("ascii")),
+                        fsync=self.fsync)
+        if key is None:
+            with open(filename) as f:
+                secret = self.database.unlock(f.read(), passphrase)
+            if secret is None:
+                return False
+            key = binascii.unhexlify(secret.strip())
+        self.key = key
+        self.passphrase = passphrase
+        return True
+
+    def fingerprint(self, password):
+        return hmac.new(self.key, password.encode("utf-8"),
+                        hashlib.sha256).hexdigest()
+
+    def decrypt(self, record):
+        """Changes of a record, decrypted once"""
+        if isinstance(record, dict):
+            # plain text index of earlier versions
+            return record
+        if record not in self.decrypted:
+            plain = self.database.unlock(record, self.passphrase)
+            if plain is None:
+                raise ValueError("Could not decrypt fingerprint index")
+            self.decrypted[record] = json.loads(plain)
+        return self.decrypted[record]
+
+    def load(self):
+        """Fingerprints by full name. The key must be unlocked"""
+        if self.passphrase is None:
+            raise ValueError("Fingerprints are locked")
+        filename = os.path.join(self.path, INDEX_FILE)
+        with self.lock():
+            found = records(filename)
+            index = {}
+            for record in found:
+                for fullname, fingerprint in self.decrypt(record).items():
+                    if fingerprint is None:
+                        index.pop(fullname, None)
+                    else:
+                        index[fullname] = fingerprint
+            if len(found) > COMPACT_AFTER:
+                record = self.database.encrypt(json.dumps(index))
+                self.decrypted = {record: dict(index)}
+                atomic_write(filename, dumps(record), fsync=self.fsync)
+        return index
+
+    def update(self, changes):
+        """Set fingerprints of full names, None removing them. Changes are
+        appended encrypted, without the passphrase"""
+        if not changes or not self.enabled:
+            return
+        record = self.database.encrypt(json.dumps(changes))
+        # never decrypted again by this process
+        self.decrypted[record] = dict(changes)
+        filename = os.path.join(self.path, INDEX_FILE)
+        with self.lock():
+            makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "a") as f:
+                f.write(dumps(record))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+    def reused(self, password):
+        """Full names whose password is password"""
+        fingerprint = self.fingerprint(password)
+        return sorted(n for n, f in self.load().items() if f == fingerprint)
+
+    def groups(self):
+        """Sorted groups of full names sharing a password"""
+        shared = {}
+        for fullname, fingerprint in self.load().items():
+            shared.setdefault(fingerprint, []).append(fullname)
+        return sorted(sorted(names) for names in shared.values()
+                      if len(names) > 1)
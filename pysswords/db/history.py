@@ -0,0 +1,100 @@
+from collections import namedtuple
+import hashlib
+import json
+import os
+import time
+
+from pysswords.python_two import makedirs
+from .credential import Credential, asdict, asfullname
+from .locking import FileLock, lockfile, writers_lock
+from .storage import atomic_write, fsync_dir
+from . import scanner
+
+
+HISTORY_DIR = ".history"
+KEEP = 10
+
+Version = namedtuple("Version", "time credential")
+
+
+def history_dir(path):
+    return os.path.join(path, HISTORY_DIR)
+
+
+def history_path(path, name, login):
+    """File of the versions of a credential, found from its full name
+    without looking at any other credential"""
+    fullname = asfullname(name, login)
+    digest = hashlib.sha1(fullname.encode("utf-8")).hexdigest()
+    return os.path.join(history_dir(path), digest[:2],
+                        "{}.jsonl".format(digest))
+
+
+def history_lock(path, filename):
+    return FileLock(lockfile(path, "history:{}".format(
+        os.path.basename(filename))))
+
+
+def dumps(version):
+    return json.dumps([version.time, asdict(version.credential)]) + "\n"
+
+
+def load(filename):
+    """Versions saved in a history file, oldest first"""
+    versions = []
+    try:
+        with open(filename) as f:
+            lines = f.readlines()
+    except IOError:
+        return versions
+    for line in lines:
+        try:
+            saved, fields = json.loads(line)
+        except ValueError:
+            # line torn by a crash
+            continue
+        versions.append(Version(saved, Credential(**fields)))
+    return versions
+
+
+def append(path, credential, keep=KEEP, fsync=True):
+    """Save credential as a previous version. Versions are appended as one
+    line each, the file is compacted to the last keep versions once it
+    holds twice as many"""
+    filename = history_path(path, credential.name, credential.login)
+    line = dumps(Version(time.time(), credential))
+    with writers_lock(path), history_lock(path, filename):
+        makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "a") as f:
+            f.write(line)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        versions = load(filename)
+        if len(versions) >= keep * 2:
+            atomic_write(filename, "".join(dumps(v)
+                                           for v in versions[-keep:]),
+                         fsync=fsync)
+        elif fsync and len(versions) == 1:
+            fsync_dir(os.path.dirname(filename))
+    return filename
+
+
+def versions(path, name, login, keep=KEEP):
+    """Previous versions of a credential, newest first"""
+    saved = load(history_path(path, name, login))
+    return list(reversed(saved))[:keep]
+
+
+def files(path):
+    """Every history file of the database at path"""
+    return [entry.path
+            for shard in scanner.entries(history_dir(path))
+            for entry in scanner.entries(shard.path)
+            if entry.name.endswith(".jsonl")]
+
+
+def rewrite(filename, func):
+    """Content of a history file with func applied to every credential"""
+    return "".join(dumps(v._replace(credential=func(v.credential)))
+                   for v in load(filename))
@@ -0,0 +1,217 @@
+import binascii
+import mmap
+import os
+import struct
+
+from pysswords.completion import names_path, read_names
+from .credential import asfullname, asstring
+from .storage import atomic_write
+
+
+INDEX_DIR = ".index"
+INDEX_FILE = "index"
+GENERATION_FILE = "generation"
+MAGIC = b"PYIX"
+VERSION = 1
+# magic, version, record count, generation the index was built from
+HEADER = struct.Struct("<4sHI32s")
+# line offset and length, name and login lengths, path offset and length.
+# A line is asstring(credential): name and login are its prefixes
+RECORD = struct.Struct("<IIIIII")
+
+
+def index_dir(path):
+    return os.path.join(path, INDEX_DIR)
+
+
+def generation(path):
+    """Token changed by every write to the database, empty before the
+    first one"""
+    try:
+        with open(os.path.join(index_dir(path), GENERATION_FILE)) as f:
+            return f.read().strip()
+    except IOError:
+        return ""
+
+
+def touch(path, fsync=True):
+    """Mark every index built so far as stale, returns the new token"""
+    token = binascii.hexlify(os.urandom(16)).decode("ascii")
+    atomic_write(os.path.join(index_dir(path), GENERATION_FILE), token,
+                 fsync=fsync)
+    return token
+
+
+def write_names(path, fullnames, token, fsync=False):
+    """Save the names cache read by shell completion: the generation it
+    was built at, then sorted full names one per line"""
+    lines = [token] + sorted(set(fullnames))
+    try:
+        atomic_write(names_path(path), "".join(l + "\n" for l in lines),
+                     fsync=fsync)
+    except (IOError, OSError):
+        pass
+
+
+def update_names(path, previous, token, changes, fsync=False):
+    """Apply (full name, exists) changes to a names cache built at
+    generation previous, now current at token. Caches of other generations
+    missed some changes, they are left stale until the next rebuild"""
+    built, fullnames = read_names(path)
+    if changes is None or built != previous:
+        return
+    fullnames = set(fullnames)
+    for fullname, present in changes:
+        if present:
+            fullnames.add(fullname)
+        else:
+            fullnames.discard(fullname)
+    write_names(path, fullnames, token, fsync)
+
+
+def build(entries, token):
+    """Index bytes of (relative path, credential) pairs"""
+    rows = sorted(
+        (c.name.encode("utf-8"), c.login.encode("utf-8"),
+         asstring(c).encode("utf-8"), relpath.encode("utf-8"))
+        for relpath, c in entries)
+    records, strings = [], []
+    offset = HEADER.size + RECORD.size * len(rows)
+    for name, login, line, relpath in rows:
+        records.append(RECORD.pack(offset, len(line), len(name), len(login),
+                                   offset + len(line), len(relpath)))
+        strings.extend([line, relpath])
+        offset += len(line) + len(relpath)
+    header = HEADER.pack(MAGIC, VERSION, len(rows), token.encode("ascii"))
+    return b"".join([header] + records + strings)
+
+
+def write(path, entries, token, fsync=False):
+    """Build and save the index and names cache of entries, returns the
+    index. A database that can't be written to still gets an index, kept
+    in memory"""
+    entries = list(entries)
+    data = build(entries, token)
+    write_names(path, (asfullname(c.name, c.login) for _, c in entries),
+                token, fsync)
+    try:
+        atomic_write(os.path.join(index_dir(path), INDEX_FILE), data,
+                     fsync=fsync)
+    except (IOError, OSError):
+        pass
+    return Index(data)
+
+
+class Index(object):
+    """Sorted name and login records read in place from a buffer.
+
+    Records have a fixed size, so the n-th is found by offset and names are
+    binary searched. Strings are only decoded for the records looked at,
+    no Credential is built.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        try:
+            self.view = memoryview(buffer)
+        except TypeError:
+            # python 2 mmaps only have the old buffer interface
+            self.view = buffer
+        magic, version, self.count, built = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a database index")
+        self.token = built.rstrip(b"\0").decode("ascii")
+
+    @classmethod
+    def open(cls, path, token):
+        """Memory mapped index of the database at path, None when it is
+        missing or was built before the generation token"""
+        filename = os.path.join(index_dir(path), INDEX_FILE)
+        try:
+            with open(filename, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            index = cls(buffer)
+        except (ValueError, struct.error):
+            buffer.close()
+            return None
+        if index.token != token:
+            index.close()
+            return None
+        return index
+
+    def close(self):
+        if hasattr(self.view, "release"):
+            self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        return RECORD.unpack_from(self.buffer, HEADER.size + RECORD.size * i)
+
+    def read(self, offset, length):
+        data = self.view[offset:offset + length]
+        return data.tobytes() if isinstance(data, memoryview) else data
+
+    def name(self, i):
+        offset, _, name_len, _, _, _ = self.record(i)
+        return self.read(offset, name_len)
+
+    def login(self, i):
+        offset, _, name_len, login_len, _, _ = self.record(i)
+        return self.read(offset + name_len + 1, login_len).decode("utf-8")
+
+    def line(self, i):
+        offset, length, _, _, _, _ = self.record(i)
+        return self.read(offset, length).decode("utf-8")
+
+    def path(self, i):
+        _, _, _, _, offset, length = self.record(i)
+        return self.read(offset, length).decode("utf-8")
+
+    def find(self, name, login=None):
+        """Relative paths of credentials named name, and login if given"""
+        key = name.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        paths = []
+        while low < self.count and self.name(low) == key:
+            if login is None or self.login(low) == login:
+                paths.append(self.path(low))
+            low += 1
+        return paths
+
+    def field(self, i, field):
+        """Name, login, comment or whole line of a record, see `query`"""
+        offset, length, name_len, login_len, _, _ = self.record(i)
+        if field == "name":
+            return self.read(offset, name_len).decode("utf-8")
+        elif field == "login":
+            return self.login(i)
+        elif field == "comment":
+            skipped = name_len + login_len + 2
+            return self.read(offset + skipped,
+                             length - skipped).decode("utf-8")
+        return self.line(i)
+
+    def search(self, match):
+        """Relative paths of credentials matching a compiled query. Fields
+        are only decoded when a predicate looks at them"""
+        return [self.path(i) for i in range(self.count)
+                if match(lambda field: self.field(i, field))]
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import tempfile
+
+from .cache import signature
+from .credential import CredentialModifiedError
+from .locking import UNLOCKED_READ, FileLock, journal_lock, names_lock
+from .storage import WriteBatch, apply, atomic_write
+from pysswords.python_two import makedirs
+
+
+JOURNAL_DIR = ".journal"
+JOURNAL_LOG = "commit.log"
+JOURNAL_OWNER = "owner.lock"
+
+
+def journal_dir(path):
+    return os.path.join(path, JOURNAL_DIR)
+
+
+def read_log(path, staging):
+    with open(os.path.join(staging, JOURNAL_LOG)) as f:
+        entries = json.load(f)
+    return [(os.path.join(path, target),
+             os.path.join(staging, tmp) if tmp else None)
+            for target, tmp in entries]
+
+
+def recover(path, fsync=True):
+    """Finish or discard transactions interrupted by a crash.
+
+    A transaction with a commit log is replayed, one without it never
+    reached its commit point and its staged files are dropped. Transactions
+    still owned by a live process are left alone, and so is everything on
+    a vault this process can't write to. Returns True when a committed
+    transaction was replayed.
+    """
+    root = journal_dir(path)
+    if not os.path.isdir(root) or not os.listdir(root):
+        # every transaction finished, nothing to lock for
+        return False
+    lock = journal_lock(path)
+    try:
+        lock.acquire()
+    except OSError as e:
+        if e.errno not in UNLOCKED_READ:
+            raise
+        # read only vault, left to a process that can write to it
+        return False
+    replayed = False
+    try:
+        for name in sorted(os.listdir(root)):
+            staging = os.path.join(root, name)
+            owner = FileLock(os.path.join(staging, JOURNAL_OWNER),
+                             blocking=False)
+            if not owner.acquire():
+                continue
+            try:
+                if os.path.isfile(os.path.join(staging, JOURNAL_LOG)):
+                    apply(read_log(path, staging), fsync, path)
+                    replayed = True
+                shutil.rmtree(staging)
+            finally:
+                owner.release()
+    finally:
+        lock.release()
+    return replayed
+
+
+def version(path):
+    try:
+        return signature(os.stat(path))
+    except OSError:
+        return None
+
+
+class Transaction(WriteBatch):
+    """All or nothing group of credential writes and removals.
+
+    New contents are staged in a private directory under the database
+    `.journal` directory. On commit, once they are synced and while the
+    touched name directories are locked, a log of every intended write and
+    removal is written atomically: that is the commit point. The log is
+    then applied and the staging directory deleted. `recover` replays a
+    committed log or discards an uncommitted one.
+
+    Expected versions registered with `expect` are verified under the locks
+    before committing, so concurrent modifications are detected instead of
+    being overwritten.
+    """
+
+    def __init__(self, path, fsync=True):
+        with journal_lock(path):
+            makedirs(journal_dir(path), exist_ok=True)
+            staging = tempfile.mkdtemp(dir=journal_dir(path))
+            self.owner = FileLock(os.path.join(staging, JOURNAL_OWNER))
+            self.owner.acquire()
+        super(Transaction, self).__init__(fsync, tempdir=staging)
+        self.path = path
+        self.expected = {}
+        self.committed = False
+
+    def expect(self, target, stamp, fullname):
+        """Require target to still be at version stamp, None meaning absent,
+        when committing. Only the first expectation of a path counts"""
+        if target not in self.expected:
+            self.expected[target] = (stamp, fullname)
+
+    def verify(self):
+        for target, (stamp, fullname) in self.expected.items():
+            if version(target) != stamp:
+                raise CredentialModifiedError(fullname)
+
+    def names(self):
+        return [os.path.relpath(os.path.dirname(p), self.path)
+                for p in self.ops]
+
+    def commit(self):
+        if not self.ops:
+            self.rollback()
+            return
+        self.sync()
+        with journal_lock(self.path):
+            with names_lock(self.path, self.names()):
+                self.verify()
+                entries = [(os.path.relpath(target, self.path),
+                            os.path.basename(tmp) if tmp else None)
+                           for target, tmp in self.ops.items()]
+                atomic_write(os.path.join(self.tempdir, JOURNAL_LOG),
+                             json.dumps(entries), fsync=self.fsync)
+                self.committed = True
+                apply(self.ops.items(), self.fsync, self.path)
+        self.ops.clear()
+        self.close()
+
+    def rollback(self):
+        self.ops.clear()
+        # past the commit point a failed apply is left for `recover`
+        self.close(discard=not self.committed)
+
+    def close(self, discard=True):
+        if discard and os.path.isdir(self.tempdir):
+            shutil.rmtree(self.tempdir)
+        self.owner.release()
@@ -0,0 +1,116 @@
+import os
+import yaml
+
+from pysswords.python_two import replace
+from .credential import FLAT, LAYOUTS, asfullname, expandpath, prune
+from .locking import journal_lock, names_lock, writers_lock
+from .storage import atomic_write, fsync_dir, with_dir
+from . import scanner
+
+
+CONFIG_FILE = ".config"
+
+
+def config_path(path):
+    return os.path.join(path, CONFIG_FILE)
+
+
+def read_config(path):
+    """Database settings, empty for databases created without any"""
+    try:
+        with open(config_path(path)) as f:
+            return yaml.load(f) or {}
+    except IOError:
+        return {}
+
+
+def write_config(path, config):
+    atomic_write(config_path(path), yaml.dump(config,
+                                              default_flow_style=False))
+
+
+def update_config(path, **settings):
+    """Change some settings, None removing them. Returns the new config"""
+    with journal_lock(path):
+        config = read_config(path)
+        for key, value in settings.items():
+            if value is None:
+                config.pop(key, None)
+            else:
+                config[key] = value
+        write_config(path, config)
+    return config
+
+
+def layouts(config):
+    """Layouts in use: the current one, followed by the one credentials
+    are being migrated from while a migration runs"""
+    used = [config.get("layout", FLAT)]
+    if config.get("migrating_from") not in (None, used[0]):
+        used.append(config["migrating_from"])
+    for layout in used:
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown database layout: {}".format(layout))
+    return used
+
+
+def move(database, source, target):
+    """Rename a credential file to its path in another layout, unless a
+    credential already sits there. Returns True when moved"""
+    relpaths = [os.path.relpath(os.path.dirname(p), database.path)
+                for p in (source, target)]
+    with writers_lock(database.path), names_lock(database.path, relpaths):
+        if not os.path.isfile(source) or os.path.exists(target):
+            return False
+        with_dir(os.path.dirname(target), lambda: replace(source, target))
+        if database.durability != "none":
+            fsync_dir(os.path.dirname(target))
+        prune(os.path.dirname(source), database.path)
+    return True
+
+
+def migrate(database, layout):
+    """Move every credential of database to layout, online.
+
+    The target layout is recorded first, along with the one migrated from,
+    so databases opened meanwhile write to the new layout and look names up
+    in both. Each credential is renamed under its name locks, being in
+    exactly one place at any time. Passes repeat until nothing is left to
+    move, then the old layout is forgotten. Returns the number of moved
+    credentials.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError("Unknown database layout: {}".format(layout))
+    with journal_lock(database.path):
+        config = read_config(database.path)
+        source = config.get("layout", FLAT)
+        if source == layout:
+            # an interrupted migration to layout, credentials are still
+            # moved from the layout it started from
+            source = config.get("migrating_from", source)
+        config.update(layout=layout, migrating_from=source)
+        write_config(database.path, config)
+    database.layouts = layouts(config)
+    database.layout = layout
+    moved = 0
+    while True:
+        found = scanner.scan(database.path, database.parsed.load,
+                             database.workers, lock=database.lock)
+        pending = [(path, credential) for path, credential in found
+                   if path != expandpath(database.path, credential.name,
+                                         credential.login, layout)]
+        count = 0
+        for path, credential in pending:
+            target = expandpath(database.path, credential.name,
+                                credential.login, layout)
+            if move(database, path, target):
+                count += 1
+            elif os.path.isfile(path):
+                raise ValueError("Cannot migrate '{}', {} exists".format(
+                    asfullname(credential.name, credential.login), target))
+        moved += count
+        if not count:
+            break
+    update_config(database.path, migrating_from=None)
+    database.layouts = [layout]
+    return moved
@@ -0,0 +1,127 @@
+import errno
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking on windows, locks become no-ops
+    fcntl = None
+
+from pysswords.python_two import makedirs
+
+
+LOCKS_DIR = ".locks"
+JOURNAL_LOCK = ".journal"
+INDEX_LOCK = ".index"
+WRITERS_LOCK = ".writers"
+# lock files a reader can't open: missing ones were never locked by a
+# writer, others sit on a vault it can't write to
+UNLOCKED_READ = (errno.ENOENT, errno.EACCES, errno.EPERM, errno.EROFS)
+
+
+def lockfile(path, key):
+    """Lock file of key, spread over directories like history files so
+    none grows with the number of names"""
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(path, LOCKS_DIR, digest[:2],
+                        "{}.lock".format(digest))
+
+
+class FileLock(object):
+    """Advisory flock on a lock file, shared or exclusive. Only exclusive
+    locks create lock files unless told to, other shared locks of read only
+    vaults read them unlocked"""
+
+    def __init__(self, filename, exclusive=True, blocking=True, create=None):
+        self.filename = filename
+        self.exclusive = exclusive
+        self.blocking = blocking
+        self.create = exclusive if create is None else create
+        self.fd = None
+
+    def acquire(self):
+        if fcntl is None:
+            return True
+        if self.create:
+            makedirs(os.path.dirname(self.filename), exist_ok=True)
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+        else:
+            try:
+                fd = os.open(self.filename, os.O_RDONLY)
+            except OSError as e:
+                if e.errno in UNLOCKED_READ:
+                    return True
+                raise
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        if not self.blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, operation)
+        except (IOError, OSError):
+            os.close(fd)
+            if self.blocking:
+                raise
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MultiLock(object):
+    """Several locks acquired in a stable order to avoid deadlocks"""
+
+    def __init__(self, locks):
+        self.locks = sorted(locks, key=lambda l: l.filename)
+
+    def __enter__(self):
+        acquired = []
+        try:
+            for lock in self.locks:
+                lock.acquire()
+                acquired.append(lock)
+        except:
+            for lock in reversed(acquired):
+                lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+def name_lock(path, name, exclusive=False):
+    """Lock scoped to one credential name directory. Readers take it shared
+    so they never block one another, writers take it exclusive"""
+    return FileLock(lockfile(path, "name:{}".format(name)), exclusive)
+
+
+def names_lock(path, names, exclusive=True):
+    return MultiLock(name_lock(path, n, exclusive) for n in set(names))
+
+
+def journal_lock(path):
+    return FileLock(lockfile(path, JOURNAL_LOCK))
+
+
+def index_lock(path):
+    return FileLock(lockfile(path, INDEX_LOCK))
+
+
+def writers_lock(path, exclusive=False):
+    """Lock every writer takes shared, rekey taking it exclusive stops them
+    all. Created by writers too, a missing lock file would let them in"""
+    return FileLock(lockfile(path, WRITERS_LOCK), exclusive, create=True)
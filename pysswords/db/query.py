@@ -0,0 +1,208 @@
+"""Search queries.
+
+Terms are separated by spaces and combined with AND, implied between
+adjacent terms, OR and NOT, grouped with parentheses:
+
+    name:*.com NOT login:admin
+    (name:github.com OR name:gitlab.com) comment:*work*
+
+`name:`, `login:` and `comment:` match one field against a glob: without
+wildcards the value must be equal, `git*` is a prefix, `*hub*` a substring.
+A value between slashes, as in `login:/^j(on|ane)$/`, is a regular
+expression searched in the field. Quotes keep spaces in a value. Terms
+without a field are regular expressions searched in "name login comment",
+like searches always were.
+"""
+from __future__ import unicode_literals
+from collections import namedtuple
+import fnmatch
+import re
+
+from .credential import asstring
+
+
+FIELDS = ("name", "login", "comment")
+# field of terms without one
+LINE = "line"
+OPERATORS = ("AND", "OR", "NOT", "(", ")")
+MAX_CACHED = 256
+# matcher costs, cheaper predicates are evaluated first
+EXACT, PREFIX, SUBSTRING, PATTERN = range(4)
+
+WORD = re.compile(r'(?:"[^"]*"|[^\s"])+|"')
+WILDCARDS = re.compile(r"[*?\[]")
+REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+Predicate = namedtuple("Predicate", "cost match")
+
+_cache = {}
+
+
+def fields(credential):
+    """Field getter of a credential, as matched by predicates"""
+    values = {"name": credential.name, "login": credential.login,
+              "comment": "{}".format(credential.comment)}
+    return lambda field: (asstring(credential) if field == LINE
+                          else values[field])
+
+
+def regex(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError("Invalid regular expression '{}': {}".format(
+            pattern, e))
+
+
+def unquote(value):
+    if len(value) > 1 and value.startswith('"') and value.endswith('"'):
+        return value[1:-1]
+    return value.replace('"', "")
+
+
+def value_matcher(pattern):
+    """Cost and test of the cheapest matcher of a field glob"""
+    if len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/"):
+        return PATTERN, regex(pattern[1:-1]).search
+    if not WILDCARDS.search(pattern):
+        return EXACT, lambda value: value == pattern
+    inner = pattern.strip("*")
+    if not WILDCARDS.search(inner):
+        if not inner:
+            return EXACT, lambda value: True
+        if pattern == inner + "*":
+            return PREFIX, lambda value: value.startswith(inner)
+        if pattern == "*" + inner:
+            # as cheap as a prefix
+            return PREFIX, lambda value: value.endswith(inner)
+        if pattern == "*" + inner + "*":
+            return SUBSTRING, lambda value: inner in value
+    return PATTERN, regex(fnmatch.translate(pattern)).match
+
+
+def term(word):
+    """Predicate of a single term"""
+    field, _, value = word.partition(":")
+    if field in FIELDS and value:
+        cost, test = value_matcher(unquote(value))
+    else:
+        field = LINE
+        if word.startswith('"'):
+            text = unquote(word)
+            cost, test = SUBSTRING, lambda value: text in value
+        elif not REGEX_CHARS.search(word):
+            cost, test = SUBSTRING, lambda value: word in value
+        else:
+            cost, test = PATTERN, regex(word).search
+    return Predicate(cost, lambda get: bool(test(get(field))))
+
+
+def all_of(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = sorted(predicates, key=lambda p: p.cost)
+    return Predicate(sum(p.cost for p in predicates),
+                     lambda get: all(p.match(get) for p in predicates))
+
+
+def any_of(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = sorted(predicates, key=lambda p: p.cost)
+    return Predicate(sum(p.cost for p in predicates),
+                     lambda get: any(p.match(get) for p in predicates))
+
+
+def tokenize(query):
+    """Words and operators of a query. Parentheses are split from the
+    words they open or close, unless they balance within the word as in a
+    regular expression"""
+    tokens = []
+    for word in WORD.findall(query):
+        if word == '"':
+            raise ValueError("Invalid query: unterminated quote")
+        while word.startswith("(") and word.count("(") > word.count(")"):
+            tokens.append("(")
+            word = word[1:]
+        closing = 0
+        while word.endswith(")") and word.count(")") > word.count("("):
+            closing += 1
+            word = word[:-1]
+        if word:
+            tokens.append(word)
+        tokens.extend([")"] * closing)
+    return tokens
+
+
+class Parser(object):
+    """Recursive descent parser, NOT binding tighter than AND, AND tighter
+    than OR"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Invalid query: nothing to search")
+        predicate = self.either()
+        if self.peek() is not None:
+            raise ValueError("Invalid query: unexpected '{}'".format(
+                self.peek()))
+        return predicate
+
+    def either(self):
+        predicates = [self.both()]
+        while self.peek() == "OR":
+            self.next()
+            predicates.append(self.both())
+        return any_of(predicates)
+
+    def both(self):
+        predicates = [self.negation()]
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.next()
+            predicates.append(self.negation())
+        return all_of(predicates)
+
+    def negation(self):
+        if self.peek() == "NOT":
+            self.next()
+            predicate = self.negation()
+            return Predicate(predicate.cost,
+                             lambda get: not predicate.match(get))
+        return self.primary()
+
+    def primary(self):
+        token = self.next()
+        if token == "(":
+            predicate = self.either()
+            if self.next() != ")":
+                raise ValueError("Invalid query: missing ')'")
+            return predicate
+        if token is None or token in OPERATORS:
+            raise ValueError("Invalid query: expected a term, got '{}'".format(
+                token or "end of query"))
+        return term(token)
+
+
+def compile_query(query):
+    """Predicate of a query, compiled once and cached"""
+    predicate = _cache.get(query)
+    if predicate is None:
+        predicate = Parser(tokenize(query)).parse()
+        if len(_cache) >= MAX_CACHED:
+            _cache.clear()
+        _cache[query] = predicate
+    return predicate
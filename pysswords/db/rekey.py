@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
+
+from pysswords.crypt import (
+    DEFAULT_PROFILE,
+    create_keyring,
+    encode,
+    getgpg
+)
+from pysswords.python_two import makedirs, replace
+from .cache import signature
+from .credential import asfullname, content, expandpath
+from .fingerprints import INDEX_FILE, SECRET_FILE
+from . import fingerprints
+from . import history
+from .locking import journal_lock, writers_lock
+from .storage import atomic_write, fsync_dir
+
+
+REKEY_DIR = ".rekey"
+
+
+def rekey_dir(path):
+    return os.path.join(path, REKEY_DIR)
+
+
+def finish(path):
+    """Move re-encrypted credentials and the new keyring into place.
+
+    Only called once the commit marker exists, every step can be replayed
+    after a crash: files already moved are skipped.
+    """
+    root = rekey_dir(path)
+    staged = os.path.join(root, "staged")
+    for dirpath, _, filenames in os.walk(staged):
+        for filename in filenames:
+            if filename.endswith(".tmp"):
+                continue
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(path, os.path.relpath(source, staged))
+            makedirs(os.path.dirname(target), exist_ok=True)
+            replace(source, target)
+    new_keys = os.path.join(root, "keys")
+    keys = os.path.join(path, ".keys")
+    if os.path.isdir(new_keys):
+        if os.path.isdir(keys):
+            os.rename(keys, os.path.join(root, "old-keys"))
+        os.rename(new_keys, keys)
+        fsync_dir(path)
+    shutil.rmtree(root)
+
+
+def complete(path):
+    """Complete a committed rekey interrupted by a crash. Uncommitted
+    progress is kept so `Rekey.run` can resume it"""
+    marker = os.path.join(rekey_dir(path), "COMMIT")
+    if not os.path.isfile(marker):
+        return False
+    with journal_lock(path):
+        # finished by another process while waiting for the lock
+        if not os.path.isfile(marker):
+            return False
+        finish(path)
+    return True
+
+
+class Rekey(object):
+    """Re-encrypt every credential of a database to a new keyring.
+
+    The new keyring and re-encrypted files are staged under `.rekey`,
+    progress being checkpointed to a log, so an interrupted run resumes
+    where it stopped. History files are staged too, all their versions
+    re-encrypted, and so are the fingerprint key and index. Credentials
+    modified after being staged are staged again. Writers are stopped from
+    the last check to the swap, writing the commit marker swaps keys and
+    files atomically: a crash afterwards is completed by `complete`.
+    """
+
+    def __init__(self, database, workers=4):
+        self.database = database
+        self.path = database.path
+        self.root = rekey_dir(self.path)
+        self.staged = os.path.join(self.root, "staged")
+        self.progress = os.path.join(self.root, "progress")
+        self.keys_path = os.path.join(self.root, "keys")
+        self.workers = workers
+
+    def prepare(self, new_passphrase, profile=DEFAULT_PROFILE):
+        """Create the new keyring unless a previous run already did, whose
+        passphrase new_passphrase must then be"""
+        if os.path.isdir(self.keys_path):
+            if not self.check(new_passphrase):
+                raise ValueError("Passphrase differs from the one of the "
+                                 "interrupted rekey")
+            return False
+        makedirs(self.root, exist_ok=True)
+        tmp_keys = self.keys_path + ".tmp"
+        if os.path.isdir(tmp_keys):
+            shutil.rmtree(tmp_keys)
+        makedirs(tmp_keys, exist_ok=True)
+        create_keyring(tmp_keys, new_passphrase, profile)
+        os.rename(tmp_keys, self.keys_path)
+        return True
+
+    def check(self, new_passphrase):
+        """Whether new_passphrase unlocks the new keyring"""
+        gpg = getgpg(self.keys_path)
+        try:
+            key = gpg.list_keys(True)[0]["fingerprint"]
+        except IndexError:
+            return False
+        sign = gpg.sign("testing", default_key=key, passphrase=new_passphrase)
+        return True if sign else False
+
+    def done(self):
+        """Checkpointed credentials: relative path to source version"""
+        if not os.path.isfile(self.progress):
+            return {}
+        done = {}
+        with open(self.progress) as f:
+            for line in f:
+                try:
+                    relpath, stamp = json.loads(line)
+                except ValueError:
+                    # line torn by a crash
+                    continue
+                done[relpath] = stamp
+        return done
+
+    def current(self):
+        """Credentials of the database with relative path and version,
+        then other encrypted files without credential"""
+        current = []
+        for credential in self.database.credentials:
+            cred_path = expandpath(self.path, credential.name,
+                                   credential.login, self.database.layout)
+            relpath = os.path.relpath(cred_path, self.path)
+            stamp = list(signature(os.stat(cred_path)))
+            current.append((relpath, stamp, credential))
+        others = history.files(self.path)
+        for relpath in (SECRET_FILE, INDEX_FILE):
+            if os.path.isfile(os.path.join(self.path, relpath)):
+                others.append(os.path.join(self.path, relpath))
+        for filename in others:
+            relpath = os.path.relpath(filename, self.path)
+            stamp = list(signature(os.stat(filename)))
+            current.append((relpath, stamp, None))
+        return current
+
+    def pending(self):
+        """Current entries not staged at their version, or whose staged
+        file is missing"""
+        done = self.done()
+        return [(relpath, stamp, credential)
+                for relpath, stamp, credential in self.current()
+                if done.get(relpath) != stamp or not os.path.isfile(
+                    os.path.join(self.staged, relpath))]
+
+    def run(self, passphrase):
+        """Stage every credential not staged yet, returns their number"""
+        gpg = getgpg(self.keys_path)
+        try:
+            fingerprint = gpg.list_keys()[0]["fingerprint"]
+        except IndexError:
+            raise ValueError("New database key not found or corrupted")
+
+        def encrypt(plain):
+            return encode(str(gpg.encrypt(plain, fingerprint,
+                                          cipher_algo="AES256")),
+                          self.database.ciphertext)
+
+        def reencrypt_text(text, label):
+            plain = self.database.decrypt(text, passphrase)
+            if not plain:
+                raise ValueError("Could not decrypt '{}'".format(label))
+            return encrypt(plain)
+
+        def reencrypt_record(record):
+            if isinstance(record, dict):
+                # plain text index of earlier versions
+                return encrypt(json.dumps(record))
+            return reencrypt_text(record, INDEX_FILE)
+
+        def reencrypt_password(credential):
+            return credential._replace(password=reencrypt_text(
+                credential.password,
+                asfullname(credential.name, credential.login)))
+
+        def reencrypt(item):
+            relpath, stamp, credential = item
+            source = os.path.join(self.path, relpath)
+            if relpath == SECRET_FILE:
+                with open(source) as f:
+                    data = reencrypt_text(f.read(), relpath)
+            elif relpath == INDEX_FILE:
+                data = fingerprints.rewrite(source, reencrypt_record)
+            elif credential is None:
+                data = history.rewrite(source, reencrypt_password)
+            else:
+                data = content(self.database.pack(
+                    reencrypt_password(credential)))
+            # durable before being checkpointed
+            atomic_write(os.path.join(self.staged, relpath), data,
+                         fsync=fsync)
+            return relpath, stamp
+
+        fsync = self.database.durability != "none"
+        pending = self.pending()
+        pool = ThreadPool(self.workers)
+        try:
+            with open(self.progress, "a") as log:
+                for relpath, stamp in pool.imap_unordered(reencrypt,
+                                                          pending):
+                    log.write(json.dumps([relpath, stamp]) + "\n")
+                    log.flush()
+                    if fsync:
+                        os.fsync(log.fileno())
+        finally:
+            pool.close()
+            pool.join()
+        return len(pending)
+
+    def commit(self, passphrase):
+        """Stage what changed meanwhile, then swap keys and credentials"""
+        while self.run(passphrase):
+            pass
+        staged = [os.path.join(d, f)
+                  for d, _, files in os.walk(self.staged) for f in files
+                  if not f.endswith(".tmp")]
+        # no writer changes the database between the last check and the
+        # swap, batches waiting on the journal lock and others on this one
+        with journal_lock(self.path), writers_lock(self.path, True):
+            if self.pending():
+                raise ValueError("Database modified during rekey, retry")
+            current = set(relpath for relpath, _, _ in self.current())
+            for source in staged:
+                if os.path.relpath(source, self.staged) not in current:
+                    # removed since it was staged
+                    os.remove(source)
+            atomic_write(os.path.join(self.root, "COMMIT"), "")
+            finish(self.path)
+
+    def abort(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from pysswords.python_two import scandir
+
+
+EXTENSION = ".pyssword"
+
+
+def entries(path):
+    """Sorted directory entries, empty when path vanished meanwhile"""
+    try:
+        return sorted(scandir(path), key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+def files(path):
+    """Sorted credential files directly under path"""
+    return [e for e in entries(path)
+            if e.name.endswith(EXTENSION) and e.is_file()]
+
+
+def find(path):
+    """Return sorted (dirpath, entries) groups of credential files under
+    path, one group per directory holding credential files"""
+    files, groups = [], []
+    for entry in entries(path):
+        if entry.is_dir():
+            groups.extend(find(entry.path))
+        elif entry.name.endswith(EXTENSION):
+            files.append(entry)
+    return [(path, files)] + groups if files else groups
+
+
+@contextmanager
+def unlocked(dirpath):
+    yield
+
+
+def namedirs(path):
+    """Top level credential directories. Entries starting with a dot are
+    reserved for database internals such as the `.keys` keyring"""
+    return [e.path for e in entries(path)
+            if not e.name.startswith(".") and e.is_dir()]
+
+
+def scan(path, load, workers=8, lock=unlocked):
+    """Load every credential file under path with load(path, stat).
+
+    Each top level directory is scanned and read by a thread pool worker,
+    results keep a deterministic, sorted order. Files of a directory are
+    stat'ed and read while holding lock(dirpath). Returns (path, result)
+    pairs.
+    """
+    def scan_dir(dirpath):
+        loaded = []
+        for credential_dir, files in find(dirpath):
+            with lock(credential_dir):
+                for entry in files:
+                    try:
+                        loaded.append(
+                            (entry.path, load(entry.path, entry.stat())))
+                    except (IOError, OSError):
+                        # removed between listing and reading
+                        continue
+        return loaded
+
+    dirs = namedirs(path)
+    if workers > 1 and len(dirs) > 1:
+        pool = ThreadPool(min(workers, len(dirs)))
+        try:
+            chunks = pool.map(scan_dir, dirs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [scan_dir(d) for d in dirs]
+    return [pair for chunk in chunks for pair in chunk]
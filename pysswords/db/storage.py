@@ -0,0 +1,155 @@
+from collections import OrderedDict
+import errno
+import os
+import tempfile
+
+from pysswords.python_two import makedirs, replace
+from .credential import prune
+
+
+def fsync_dir(path):
+    """Make renames inside path durable. Directories can't be opened on
+    windows, where this is a no-op"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sync(paths):
+    """Flush written files to disk. Unlike os.sync(), which flushes every
+    mounted file system and may return before data is durable, this waits
+    for these files only"""
+    for path in paths:
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+
+
+def with_dir(dirname, func):
+    """Call func once dirname exists. An empty directory may be pruned by
+    a concurrent removal before func creates anything in it, it is then
+    created again"""
+    while True:
+        try:
+            makedirs(dirname, exist_ok=True)
+            return func()
+        except OSError as e:
+            if e.errno != errno.ENOENT or os.path.isdir(dirname):
+                raise
+
+
+def write_temp(path, data, fsync=True, tempdir=None):
+    """Write data to a temporary file next to path, or inside tempdir, and
+    return its name"""
+    dirname = tempdir or os.path.dirname(path)
+    fd, tmp = with_dir(dirname, lambda: tempfile.mkstemp(
+        dir=dirname,
+        prefix=".{}.".format(os.path.basename(path)),
+        suffix=".tmp"))
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+    except:
+        os.remove(tmp)
+        raise
+    return tmp
+
+
+def atomic_write(path, data, fsync=True):
+    """Replace path with data so readers see either old or new content,
+    never a truncated file"""
+    tmp = write_temp(path, data, fsync=fsync)
+    try:
+        replace(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+    if fsync:
+        fsync_dir(os.path.dirname(path))
+    return path
+
+
+def apply(ops, fsync=True, root=None):
+    """Rename staged files over their targets and delete removed files.
+
+    ops are (path, tmp) pairs, tmp being None for removals. Writes whose
+    temporary file is gone were already applied, which makes replaying the
+    same ops after a crash safe. Directories left empty are pruned up to
+    root.
+    """
+    ops = list(ops)
+    for path, tmp in ops:
+        if tmp is not None and os.path.isfile(tmp):
+            with_dir(os.path.dirname(path), lambda: replace(tmp, path))
+    for path, tmp in ops:
+        if tmp is None:
+            if os.path.isfile(path):
+                os.remove(path)
+            prune(os.path.dirname(path), root)
+    if fsync:
+        dirs = set(os.path.dirname(p) for p, _ in ops)
+        for dirname in sorted(dirs):
+            # the nearest directory left, pruned ones being gone
+            while dirname and not os.path.isdir(dirname):
+                dirname = os.path.dirname(dirname)
+            fsync_dir(dirname)
+
+
+class WriteBatch(object):
+    """Group commit of file writes and removals.
+
+    Writes go to temporary files right away but are only renamed into place
+    on commit, once every file is synced. Each touched directory is then
+    fsynced once, whatever the number of files written in it.
+    """
+
+    def __init__(self, fsync=True, tempdir=None):
+        self.fsync = fsync
+        self.tempdir = tempdir
+        self.ops = OrderedDict()
+
+    def __contains__(self, path):
+        return path in self.ops
+
+    def exists(self, path):
+        if path in self.ops:
+            return self.ops[path] is not None
+        return os.path.isfile(path)
+
+    def _discard(self, path):
+        tmp = self.ops.pop(path, None)
+        if tmp is not None:
+            os.remove(tmp)
+
+    def write(self, path, data):
+        self._discard(path)
+        self.ops[path] = write_temp(path, data, fsync=False,
+                                    tempdir=self.tempdir)
+
+    def remove(self, path):
+        self._discard(path)
+        self.ops[path] = None
+
+    def sync(self):
+        tmps = [t for t in self.ops.values() if t is not None]
+        if self.fsync and tmps:
+            sync(tmps)
+
+    def commit(self):
+        self.sync()
+        apply(self.ops.items(), self.fsync)
+        self.ops.clear()
+
+    def rollback(self):
+        for path in list(self.ops):
+            self._discard(path)
+            prune(os.path.dirname(path))
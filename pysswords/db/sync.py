@@ -0,0 +1,242 @@
+from collections import namedtuple
+import binascii
+import hashlib
+import json
+import os
+
+from .cache import signature
+from .credential import asfullname, prune
+from .storage import atomic_write
+from . import scanner
+
+
+SYNC_DIR = ".sync"
+
+SyncResult = namedtuple("SyncResult", "pulled pushed conflicts")
+
+
+def sync_dir(path):
+    return os.path.join(path, SYNC_DIR)
+
+
+def vault_id(path):
+    """Random identifier of a vault, telling its peers apart whatever
+    path they are mounted at. It is saved with the inode of the vault
+    directory, so a copy, made by cp or by exporting and importing the
+    vault, gets an identifier of its own"""
+    filename = os.path.join(sync_dir(path), "id")
+    root = str(os.stat(path).st_ino)
+    try:
+        with open(filename) as f:
+            identifier, _, owner = f.read().strip().partition(" ")
+    except IOError:
+        identifier, owner = None, None
+    if not identifier or owner not in ("", root):
+        identifier = binascii.hexlify(os.urandom(16)).decode("ascii")
+    if owner != root:
+        # identifiers saved without inode are kept by their vault
+        atomic_write(filename, "{} {}".format(identifier, root))
+    return identifier
+
+
+def load_json(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def file_digest(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def leaves(database):
+    """Content digest of every credential file by relative path. Digests
+    are cached with the file signature, so only files written since the
+    last call are read"""
+    path = database.path
+    cache_file = os.path.join(sync_dir(path), "leaves")
+    cached = load_json(cache_file)
+
+    def load(cred_path, stat):
+        relpath = os.path.relpath(cred_path, path).replace(os.sep, "/")
+        stamp = list(signature(stat))
+        entry = cached.get(relpath)
+        if entry is not None and entry[0] == stamp:
+            return relpath, entry
+        return relpath, [stamp, file_digest(cred_path)]
+
+    found = dict(entry for _, entry in scanner.scan(
+        path, load, database.workers, lock=database.lock))
+    if found != cached:
+        atomic_write(cache_file, json.dumps(found, sort_keys=True),
+                     fsync=False)
+    return dict((relpath, entry[1]) for relpath, entry in found.items())
+
+
+class Manifest(object):
+    """Merkle tree of credential file digests.
+
+    Every directory is hashed from the sorted names and hashes of its
+    children, so two trees with equal root hashes hold the same files and
+    comparing them only descends into subtrees whose hashes differ.
+    """
+
+    def __init__(self, leaves):
+        self.leaves = leaves
+        self.children = {"": set()}
+        for relpath in leaves:
+            parts = relpath.split("/")
+            for depth in range(1, len(parts) + 1):
+                parent = "/".join(parts[:depth - 1])
+                self.children.setdefault(parent, set()).add(
+                    "/".join(parts[:depth]))
+        self.hashes = dict(leaves)
+        self.digest("")
+
+    def digest(self, node):
+        if node not in self.hashes:
+            lines = ["{} {}\n".format(child.rsplit("/", 1)[-1],
+                                      self.digest(child))
+                     for child in sorted(self.children[node])]
+            self.hashes[node] = hashlib.sha256(
+                "".join(lines).encode("utf-8")).hexdigest()
+        return self.hashes[node]
+
+    @property
+    def root(self):
+        return self.hashes[""]
+
+    def diff(self, other, node=""):
+        """Relative paths of files differing from other"""
+        if self.hashes.get(node) == other.hashes.get(node):
+            return []
+        if node in self.leaves or node in other.leaves:
+            return [node]
+        children = (self.children.get(node, set()) |
+                    other.children.get(node, set()))
+        return [relpath for child in sorted(children)
+                for relpath in self.diff(other, child)]
+
+
+def decide(local, remote, base, prefer=None):
+    """Direction a differing file is synced in: "pull", "push", or
+    "conflict" when both sides changed it since the last sync"""
+    if remote == base:
+        return "push"
+    if local == base:
+        return "pull"
+    if prefer == "local":
+        return "push"
+    if prefer == "remote":
+        return "pull"
+    return "conflict"
+
+
+def transfer(source, target, relpath, expected):
+    """Copy a credential file, or remove it when missing from source,
+    unless target changed since its manifest was built. The replaced
+    version goes to the history of target. Returns the (full name, exists)
+    change of target, None when target changed"""
+    source_file = os.path.join(source.path, relpath)
+    target_file = os.path.join(target.path, relpath)
+    with target.lock(os.path.dirname(target_file), exclusive=True):
+        current = (file_digest(target_file)
+                   if os.path.isfile(target_file) else None)
+        if current != expected:
+            return None
+        if current is not None:
+            replaced = target.load_credential(target_file)
+            target.save_version(replaced)
+        if os.path.isfile(source_file):
+            with open(source_file, "rb") as f:
+                atomic_write(target_file, f.read(),
+                             fsync=target.durability != "none")
+            credential = target.load_credential(target_file)
+        else:
+            credential = replaced
+            os.remove(target_file)
+            prune(os.path.dirname(target_file), target.path)
+    fullname = asfullname(credential.name, credential.login)
+    # the password may have changed, fingerprinted again by reuse reports
+    target.fingerprints.update({fullname: None})
+    return fullname, os.path.isfile(source_file)
+
+
+def copy_blobs(source, target, relpaths):
+    """Copy comment blobs referenced by transferred credentials"""
+    if source.blobs is None or target.blobs is None:
+        return
+    for relpath in relpaths:
+        try:
+            credential = source.read_credential(
+                os.path.join(source.path, relpath))
+        except (IOError, OSError):
+            continue
+        if isinstance(credential.comment, dict):
+            key = credential.comment.get("blob")
+            if key and not os.path.isfile(target.blobs.blobpath(key)):
+                target.blobs.put(source.blobs.get(key))
+
+
+def sync(local, remote, prefer=None):
+    """Two way sync of the credential files of two replicas of a vault.
+
+    Both manifests are compared to find differing files, each being copied
+    in the direction of the side that changed it since the last sync of
+    this pair, deletions included. Files both sides changed are conflicts,
+    left untouched unless prefer names the side that wins. Returns the
+    relative paths pulled, pushed and in conflict.
+    """
+    if local.layout != remote.layout:
+        raise ValueError("Cannot sync databases with different layouts")
+    if local.key() != remote.key():
+        raise ValueError("Cannot sync databases with different keys")
+    if prefer not in (None, "local", "remote"):
+        raise ValueError("Unknown sync preference: {}".format(prefer))
+    local_leaves, remote_leaves = leaves(local), leaves(remote)
+    local_id, remote_id = vault_id(local.path), vault_id(remote.path)
+    if local_id == remote_id:
+        raise ValueError("Cannot sync a database with itself")
+    base_file = os.path.join(sync_dir(local.path), remote_id)
+    base = load_json(base_file)
+    result = SyncResult([], [], [])
+    changes = {local.path: [], remote.path: []}
+    merged = dict(base)
+    for relpath in Manifest(local_leaves).diff(Manifest(remote_leaves)):
+        ours, theirs = local_leaves.get(relpath), remote_leaves.get(relpath)
+        direction = decide(ours, theirs, base.get(relpath), prefer)
+        if direction == "push":
+            source, target, expected = local, remote, theirs
+        elif direction == "pull":
+            source, target, expected = remote, local, ours
+        else:
+            result.conflicts.append(relpath)
+            continue
+        copy_blobs(source, target, [relpath])
+        change = transfer(source, target, relpath, expected)
+        if change is None:
+            # written meanwhile, the next sync compares it again
+            result.conflicts.append(relpath)
+            continue
+        changes[target.path].append(change)
+        (result.pushed if direction == "push" else result.pulled).append(
+            relpath)
+        merged[relpath] = ours if direction == "push" else theirs
+    # every file compared equal is in sync now
+    for relpath, digest in local_leaves.items():
+        if remote_leaves.get(relpath) == digest:
+            merged[relpath] = digest
+    merged = dict((relpath, digest) for relpath, digest in merged.items()
+                  if digest is not None and (
+                      relpath in local_leaves or relpath in remote_leaves or
+                      relpath in result.conflicts))
+    atomic_write(base_file, json.dumps(merged, sort_keys=True))
+    atomic_write(os.path.join(sync_dir(remote.path), local_id),
+                 json.dumps(merged, sort_keys=True))
+    for database in (local, remote):
+        if changes[database.path]:
+            database.changed(changes[database.path])
+    return result
@@ -0,0 +1,369 @@
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+from .cache import signature
+from .query import compile_query, fields
+from . import scanner
+
+
+# inotify(7) flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+# watch descriptor, mask, cookie and length of the name that follows
+EVENT = struct.Struct("iIII")
+
+# a credential file to load again, a directory to scan again, or the whole
+# database when events were lost
+FILE, DIRECTORY, RESCAN = "file", "directory", "rescan"
+
+Change = namedtuple("Change", "kind path credential")
+
+log = logging.getLogger(__name__)
+
+
+def fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def fsdecode(name):
+    return name.decode(sys.getfilesystemencoding())
+
+
+def libc():
+    """C library exposing inotify, None on other systems"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        library = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                              use_errno=True)
+    except OSError:
+        return None
+    return library if hasattr(library, "inotify_init1") else None
+
+
+class InotifyWatcher(object):
+    """Credential directories of a database watched with inotify.
+
+    A watch is added to every directory but the database internals, and to
+    directories as they are created. Events are read without blocking and
+    turned into the files and directories that changed.
+    """
+
+    def __init__(self, path, library=None):
+        self.path = path
+        self.libc = library or libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        try:
+            self.add(path)
+        except OSError:
+            self.close()
+            raise
+
+    def add(self, dirpath):
+        """Watch dirpath and every directory under it"""
+        wd = self.libc.inotify_add_watch(self.fd, fsencode(dirpath),
+                                         WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # removed meanwhile
+                return
+            raise OSError(error, "Could not watch {}".format(dirpath))
+        self.dirs[wd] = dirpath
+        subdirs = (scanner.namedirs(dirpath) if dirpath == self.path else
+                   [e.path for e in scanner.entries(dirpath) if e.is_dir()])
+        for subdir in subdirs:
+            self.add(subdir)
+
+    def forget(self, dirpath):
+        """Stop watching dirpath and the directories under it, moved away"""
+        prefix = os.path.join(dirpath, "")
+        for wd, watched in list(self.dirs.items()):
+            if watched == dirpath or watched.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def read(self):
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def wait(self, timeout):
+        """(kind, path) events seen within timeout seconds, oldest first"""
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except (OSError, select.error):
+            # interrupted by a signal
+            return []
+        if not ready:
+            return []
+        data, offset, events = self.read(), 0, []
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length]
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return [(RESCAN, self.path)]
+            dirpath = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            name = fsdecode(name.rstrip(b"\0"))
+            # temporary files of atomic writes and database internals
+            if dirpath is None or not name or name.startswith("."):
+                continue
+            path = os.path.join(dirpath, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add(path)
+                elif mask & IN_MOVED_FROM:
+                    self.forget(path)
+                events.append((DIRECTORY, path))
+            elif name.endswith(scanner.EXTENSION):
+                events.append((FILE, path))
+        unique = []
+        for event in events:
+            if event not in unique:
+                unique.append(event)
+        return unique
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+
+class PollingWatcher(object):
+    """Fallback rescanning the database every interval. Rescans only stat
+    files, those whose signature did not change aren't read again"""
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def wait(self, timeout):
+        self.stopped.wait(min(timeout, self.interval))
+        return [] if self.stopped.is_set() else [(RESCAN, self.path)]
+
+    def close(self):
+        self.stopped.set()
+
+
+def open_watcher(path, interval=1.0, polling=False):
+    """inotify watcher of the database at path, polling every interval
+    where inotify is missing or out of watches"""
+    if not polling:
+        try:
+            return InotifyWatcher(path)
+        except OSError:
+            pass
+    return PollingWatcher(path, interval)
+
+
+class LiveView(object):
+    """Credentials of a database kept in memory and updated as files change.
+
+    The database is scanned once, then the watcher tells which files and
+    directories changed, written by this process or any other, and only
+    those are read again. Reading the view never touches the disk.
+    Callbacks get a Change for every credential "added", "modified" or
+    "removed", from the thread that applied it.
+    """
+
+    def __init__(self, database, interval=1.0, polling=False):
+        self.database = database
+        self.interval = interval
+        self.watcher = open_watcher(database.path, interval, polling)
+        self.entries = {}
+        # signature of files that could not be parsed, by path
+        self.unreadable = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.refresh()
+
+    @property
+    def polling(self):
+        return isinstance(self.watcher, PollingWatcher)
+
+    @property
+    def credentials(self):
+        with self.lock:
+            return [self.entries[p][1] for p in sorted(self.entries)]
+
+    def get(self, name, login=None):
+        return [c for c in self.credentials
+                if c.name == name and (login is None or c.login == login)]
+
+    def search(self, query):
+        match = compile_query(query).match
+        return [c for c in self.credentials if match(fields(c))]
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def load(self, path, stat):
+        stamp = signature(stat)
+        try:
+            return stamp, self.database.parsed.load(path, stat)
+        except (IOError, OSError):
+            raise
+        except Exception:
+            # skipped, the last version read if any being kept, until the
+            # file changes again
+            if self.unreadable.get(path) != stamp:
+                self.unreadable[path] = stamp
+                log.exception("Could not read %s", path)
+            return stamp, None
+
+    def apply(self, found, within=None):
+        """Replace entries under within, every entry when None, with found
+        (path, (signature, credential)) pairs. Returns the changes"""
+        changes = []
+        with self.lock:
+            for path, entry in found.items():
+                if entry[1] is None:
+                    continue
+                previous = self.entries.get(path)
+                if previous is None:
+                    changes.append(Change("added", path, entry[1]))
+                elif previous[0] != entry[0]:
+                    changes.append(Change("modified", path, entry[1]))
+                self.entries[path] = entry
+            prefix = None if within is None else os.path.join(within, "")
+            for path in [p for p in self.entries if p not in found and (
+                    within is None or p == within or p.startswith(prefix))]:
+                changes.append(Change("removed", path,
+                                      self.entries.pop(path)[1]))
+        return changes
+
+    def refresh(self, dirpath=None):
+        """Scan the database again, or only dirpath"""
+        if dirpath is None:
+            found = scanner.scan(self.database.path, self.load,
+                                 self.database.workers,
+                                 lock=self.database.lock)
+        else:
+            found = []
+            for credential_dir, files in scanner.find(dirpath):
+                with self.database.lock(credential_dir):
+                    for entry in files:
+                        try:
+                            found.append((entry.path,
+                                          self.load(entry.path,
+                                                    entry.stat())))
+                        except (IOError, OSError):
+                            continue
+        return self.apply(dict(found), dirpath)
+
+    def reload(self, path):
+        """Read one credential file again"""
+        found = {}
+        with self.database.lock(os.path.dirname(path)):
+            try:
+                found[path] = self.load(path, os.stat(path))
+            except (IOError, OSError):
+                pass
+        return self.apply(found, path)
+
+    def poll(self, timeout=0):
+        """Apply the changes seen within timeout seconds and run callbacks.
+        Errors reading files or raised by callbacks are logged. Returns the
+        changes"""
+        try:
+            events = self.watcher.wait(timeout)
+        except OSError:
+            # out of inotify watches for new directories
+            self.watcher.close()
+            self.watcher = PollingWatcher(self.database.path,
+                                          self.interval)
+            events = [(RESCAN, self.database.path)]
+        changes = []
+        for kind, path in events:
+            try:
+                if kind == FILE:
+                    changes.extend(self.reload(path))
+                elif kind == DIRECTORY:
+                    changes.extend(self.refresh(path))
+                else:
+                    changes.extend(self.refresh())
+            except Exception:
+                # the view keeps updating, path is read on its next event
+                log.exception("Could not read %s", path)
+        for change in changes:
+            for callback in list(self.callbacks):
+                try:
+                    callback(change)
+                except Exception:
+                    log.exception("Callback failed on %s of %s",
+                                  change.kind, change.path)
+        return changes
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.poll(self.interval)
+
+    def start(self):
+        """Apply changes from a background thread until closed"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.stopped.set()
+        if isinstance(self.watcher, PollingWatcher):
+            self.watcher.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.watcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
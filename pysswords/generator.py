@@ -0,0 +1,133 @@
+from __future__ import unicode_literals
+import os
+
+from .python_two import string_types
+
+
+CHARSETS = {
+    "digits": "0123456789",
+    "lowercase": "abcdefghijklmnopqrstuvwxyz",
+    "uppercase": "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    "special": "#$%&*@!?><:;[]{}|\\/+=",
+}
+AMBIGUOUS = "0O1lI|"
+
+
+class Policy(object):
+    """Rules for generated passwords.
+
+    Character passwords are `length` characters long and drawn from the
+    charsets named in `classes`, every class in `required` appearing at
+    least once. With a `wordlist`, passphrases of `words` words joined by
+    `separator` are generated instead.
+    """
+
+    def __init__(self, length=32, classes=("digits", "lowercase",
+                                           "uppercase", "special"),
+                 required=(), exclude_ambiguous=False, wordlist=None,
+                 words=6, separator="-"):
+        self.length = length
+        self.classes = tuple(classes)
+        self.required = tuple(required)
+        self.exclude_ambiguous = exclude_ambiguous
+        self.wordlist = wordlist
+        self.words = words
+        self.separator = separator
+        for name in self.classes + self.required:
+            if name not in CHARSETS:
+                raise ValueError("Unknown character class: {}".format(name))
+        if wordlist:
+            return
+        if len(self.required) > length:
+            raise ValueError("Password too short for required classes")
+        if not self.classes:
+            raise ValueError("No character class to draw from")
+        for name in self.required:
+            if name not in self.classes:
+                raise ValueError(
+                    "Required class not in classes: {}".format(name))
+        for name in self.classes:
+            if not self.charset(name):
+                raise ValueError(
+                    "No characters left in class: {}".format(name))
+
+    def charset(self, name):
+        chars = CHARSETS[name]
+        if self.exclude_ambiguous:
+            chars = "".join(c for c in chars if c not in AMBIGUOUS)
+        return chars
+
+    @property
+    def alphabet(self):
+        return "".join(self.charset(name) for name in self.classes)
+
+
+DEFAULT_POLICY = Policy()
+
+
+class RandomBuffer(object):
+    """Random numbers from os.urandom, read in large chunks"""
+
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.position = 0
+
+    def read(self, size):
+        if self.position + size > len(self.buffer):
+            self.buffer = bytearray(os.urandom(max(size, self.chunk_size)))
+            self.position = 0
+        data = self.buffer[self.position:self.position + size]
+        self.position += size
+        return data
+
+    def below(self, n):
+        """Uniform integer in [0, n) using rejection sampling"""
+        size = 1
+        while 256 ** size < n:
+            size += 1
+        limit = (256 ** size // n) * n
+        while True:
+            value = 0
+            for byte in self.read(size):
+                value = value * 256 + byte
+            if value < limit:
+                return value % n
+
+
+def load_wordlist(path):
+    with open(path) as f:
+        words = [line.split()[-1] for line in f if line.strip()]
+    if not words:
+        raise ValueError("Empty wordlist: {}".format(path))
+    return words
+
+
+def passphrase(policy, rand, words):
+    return policy.separator.join(
+        words[rand.below(len(words))] for _ in range(policy.words))
+
+
+def password(policy, rand, alphabet, required):
+    while True:
+        candidate = "".join(alphabet[rand.below(len(alphabet))]
+                            for _ in range(policy.length))
+        if all(any(c in chars for c in candidate) for chars in required):
+            return candidate
+
+
+def genpass_many(n, policy=DEFAULT_POLICY):
+    """Generate n passwords following policy"""
+    rand = RandomBuffer()
+    if policy.wordlist:
+        words = (load_wordlist(policy.wordlist)
+                 if isinstance(policy.wordlist, string_types)
+                 else list(policy.wordlist))
+        return [passphrase(policy, rand, words) for _ in range(n)]
+    alphabet = policy.alphabet
+    required = [policy.charset(name) for name in policy.required]
+    return [password(policy, rand, alphabet, required) for _ in range(n)]
+
+
+def genpass(policy=DEFAULT_POLICY):
+    return genpass_many(1, policy)[0]
@@ -5,8 +5,42 @@ from functools import partial
 
 is_python2 = lambda: sys.version_info < (3,)
 
+
+class DirEntry(object):
+    """Minimal stand-in for os.DirEntry on pythons without os.scandir"""
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def listdir_entries(path):
+    return [DirEntry(path, name) for name in os.listdir(path)]
+
+
+def rename_over(src, dst):
+    """os.replace for pythons without it. Not atomic on windows"""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
 if is_python2():
     BUILTINS_NAME = "__builtin__"
+    string_types = (str, unicode)
 
     def input(prompt):
         return raw_input(prompt).decode("UTF-8")
@@ -19,5 +53,9 @@ if is_python2():
                 raise
 else:
     BUILTINS_NAME = "builtins"
+    string_types = (str,)
     input = input
     makedirs = partial(os.makedirs)
+
+scandir = getattr(os, "scandir", listdir_entries)
+replace = getattr(os, "replace", rename_over)
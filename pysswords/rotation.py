@@ -0,0 +1,114 @@
+from __future__ import unicode_literals
+import json
+import os
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from .db.credential import (
+    CredentialExistsError,
+    CredentialModifiedError,
+    CredentialNotFoundError,
+    asfullname
+)
+from .utils import genpass
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def write_report(path, entries):
+    """Append report entries as json lines to a file readable by the
+    owner only"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    with os.fdopen(fd, "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def run_hook(command, entries):
+    """Feed report entries to command as a json list on stdin"""
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+    process.communicate(json.dumps(entries).encode("utf-8"))
+    if process.returncode != 0:
+        raise ValueError("Rotation hook failed with exit code {}".format(
+            process.returncode))
+
+
+class Rotation(object):
+    """Replace the passwords of many credentials with generated ones.
+
+    Credentials are processed in batches: old passwords are decrypted and
+    new ones encrypted by a pool of workers, so gpg processes run side by
+    side, then the whole batch is written in one transaction. Once it is
+    committed, the batch is reported as old to new password mappings to a
+    report file and/or a hook command, so services are never told about
+    passwords the database does not hold. Batches whose commit fails
+    because credentials changed meanwhile are left as they were and listed
+    in `failed`, with their error.
+    """
+
+    def __init__(self, database, passphrase, batch_size=50, workers=4,
+                 generate=genpass, hook=None, report=None):
+        self.database = database
+        self.passphrase = passphrase
+        self.batch_size = batch_size
+        self.workers = workers
+        self.generate = generate
+        self.hook = hook
+        self.report = report
+        self.failed = []
+
+    def prepare(self, credential):
+        old_password = self.database.decrypt(credential.password,
+                                             self.passphrase)
+        if not old_password:
+            raise ValueError("Could not decrypt '{}'".format(
+                asfullname(credential.name, credential.login)))
+        new_password = self.generate()
+        new_credential = self.database.build_credential(
+            credential.name,
+            credential.login,
+            new_password,
+            credential.comment)
+        entry = {
+            "name": credential.name,
+            "login": credential.login,
+            "old": old_password,
+            "new": new_password,
+        }
+        return credential, new_credential, entry
+
+    def emit(self, entries):
+        if self.report:
+            write_report(self.report, entries)
+        if self.hook:
+            run_hook(self.hook, entries)
+
+    def run(self, credentials):
+        rotated = []
+        pool = ThreadPool(self.workers)
+        try:
+            for batch in chunks(list(credentials), self.batch_size):
+                prepared = pool.map(self.prepare, batch)
+                try:
+                    with self.database.batch():
+                        for credential, new_credential, _ in prepared:
+                            self.database.replace(credential,
+                                                  new_credential)
+                except (CredentialExistsError, CredentialModifiedError,
+                        CredentialNotFoundError) as e:
+                    self.failed.append((batch, e))
+                    continue
+                self.emit([entry for _, _, entry in prepared])
+                # fingerprints are dropped while their key is locked
+                self.database.fingerprints.update(dict(
+                    (asfullname(c.name, c.login),
+                     self.database.fingerprint(entry["new"]))
+                    for c, _, entry in prepared))
+                rotated.extend(new for _, new, _ in prepared)
+        finally:
+            pool.close()
+            pool.join()
+        return rotated
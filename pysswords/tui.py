@@ -0,0 +1,138 @@
+"""Interactive incremental search over credential names.
+
+Names, logins and comments are read once from the database index, then
+filtered in memory on every keystroke. Nothing is decrypted here: the
+selected credential is returned to the caller.
+"""
+from __future__ import unicode_literals
+import os
+import unicodedata
+
+try:
+    import curses
+except ImportError:
+    # not available on windows
+    curses = None
+
+from .db.cache import clock
+
+
+class Finder(object):
+    """Case insensitive filter of lines by space separated terms.
+
+    Results of every query typed so far are kept on a stack: typing more
+    only filters the previous matches, erasing pops back to them.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.folded = [line.lower() for line in lines]
+        self.stack = [("", list(range(len(lines))))]
+
+    def filter(self, query):
+        """Indexes of lines containing every term of query"""
+        query = query.lower()
+        while not query.startswith(self.stack[-1][0]):
+            self.stack.pop()
+        previous, candidates = self.stack[-1]
+        if query == previous:
+            return candidates
+        terms = query.split()
+        if len(terms) == 1:
+            term = terms[0]
+            matches = [i for i in candidates if term in self.folded[i]]
+        else:
+            matches = [i for i in candidates
+                       if all(t in self.folded[i] for t in terms)]
+        self.stack.append((query, matches))
+        return matches
+
+
+def printable(key):
+    return not unicodedata.category(key).startswith("C")
+
+
+def read_key(window):
+    """Next key, a character or a curses key code"""
+    if hasattr(window, "get_wch"):
+        return window.get_wch()
+    # python 2 only reads bytes
+    key = window.getch()
+    return chr(key) if 0 <= key < 128 else key
+
+
+class Screen(object):
+    """fzf like prompt above the list of matching lines"""
+
+    def __init__(self, window, lines):
+        self.window = window
+        self.lines = lines
+        self.finder = Finder(lines)
+        self.query = ""
+        self.selected = 0
+        self.matches = self.finder.filter("")
+        self.elapsed = 0.0
+
+    def update(self):
+        start = clock()
+        self.matches = self.finder.filter(self.query)
+        self.elapsed = clock() - start
+        self.selected = max(0, min(self.selected, len(self.matches) - 1))
+
+    def draw(self):
+        height, width = self.window.getmaxyx()
+        rows = height - 2
+        top = max(0, self.selected - rows + 1)
+        self.window.erase()
+        visible = self.matches[top:top + rows]
+        for row, i in enumerate(visible):
+            attribute = curses.A_REVERSE if top + row == self.selected else 0
+            self.window.addnstr(row, 0, self.lines[i], width - 1, attribute)
+        status = "{}/{} ({:.1f} ms)".format(
+            len(self.matches), len(self.lines), self.elapsed * 1000)
+        self.window.addnstr(height - 2, 0, status, width - 1, curses.A_DIM)
+        self.window.addnstr(height - 1, 0, "> " + self.query, width - 1)
+        self.window.refresh()
+
+    def handle(self, key):
+        """Apply a key press, returns the selected index once chosen, -1
+        when cancelled and None otherwise"""
+        if key in ("\n", "\r", curses.KEY_ENTER):
+            return self.matches[self.selected] if self.matches else -1
+        if key in ("\x1b", "\x03", "\x04"):
+            return -1
+        if key in (curses.KEY_UP, "\x10"):
+            self.selected = max(self.selected - 1, 0)
+        elif key in (curses.KEY_DOWN, "\x0e"):
+            self.selected = max(0, min(self.selected + 1,
+                                       len(self.matches) - 1))
+        elif key in (curses.KEY_BACKSPACE, "\x7f", "\x08"):
+            self.query = self.query[:-1]
+            self.update()
+        elif not isinstance(key, int) and printable(key):
+            self.query += key
+            self.selected = 0
+            self.update()
+        return None
+
+    def run(self):
+        curses.use_default_colors()
+        while True:
+            self.draw()
+            try:
+                key = read_key(self.window)
+            except KeyboardInterrupt:
+                return -1
+            chosen = self.handle(key)
+            if chosen is not None:
+                return chosen
+
+
+def select(lines):
+    """Let the user pick one of lines, returns its index or None"""
+    if curses is None:
+        raise ValueError("Interactive mode needs the curses module")
+    # escape cancels right away instead of waiting for a key sequence
+    os.environ.setdefault("ESCDELAY", "25")
+    chosen = curses.wrapper(lambda window: Screen(window, lines).run())
+    return None if chosen < 0 else chosen
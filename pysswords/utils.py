@@ -1,7 +1,8 @@
 import os
-import random
 import shutil
 
+from . import generator
+
 
 def which(program):
     """Mimics behavior of UNIX which command. """
@@ -19,11 +20,5 @@ def which(program):
                 return program_path
 
 
-def genpass():
-    length = 32
-    special = "#$%&*@!?><:;[]{}|\/+="
-    digits = '0123456789'
-    lowercase = 'abcdefghijklmnopqrstuvwxyz'
-    uppercase = lowercase.upper()
-    chars = "".join([digits, lowercase, uppercase, special])
-    return "".join(random.choice(chars) for _ in range(length))
+def genpass(policy=generator.DEFAULT_POLICY):
+    return generator.genpass(policy)
@@ -0,0 +1,116 @@
+"""Latency of the gpg operations behind a database, per key profile.
+
+Every operation spawns a gpg process, whose start up cost is measured on
+its own by running `gpg --version`, then subtracted from the operation
+medians to estimate the time spent on cryptography.
+
+    python -m tests.benchmark [--profiles rsa4096 ed25519] [--runs 50]
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+from pysswords.crypt import DEFAULT_PROFILE, KEY_PROFILES
+from pysswords.db import Database
+from pysswords.utils import which
+
+
+timer = getattr(time, "perf_counter", time.time)
+PASSPHRASE = "benchmark passphrase"
+HEADERS = ["Profile", "Operation", "p50 ms", "p95 ms", "p99 ms", "ops/s",
+           "crypto p50 ms"]
+
+
+def percentile(samples, p):
+    """Nearest rank percentile of samples"""
+    ordered = sorted(samples)
+    rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+def measure(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = timer()
+        func()
+        samples.append(timer() - start)
+    return samples
+
+
+def summarize(samples, spawn=None):
+    """p50, p95, p99 in milliseconds, operations per second, and the median
+    left once the median spawn time is removed"""
+    p50, p95, p99 = [percentile(samples, p) * 1000 for p in (50, 95, 99)]
+    row = [p50, p95, p99, len(samples) / sum(samples)]
+    row.append(max(p50 - percentile(spawn, 50) * 1000, 0) if spawn else None)
+    return row
+
+
+def spawn_samples(runs):
+    gpg = which("gpg")
+    with open(os.devnull, "w") as devnull:
+        return measure(
+            lambda: subprocess.call([gpg, "--version"], stdout=devnull),
+            runs)
+
+
+def profile_rows(profile, runs, ciphers, spawn):
+    path = tempfile.mkdtemp(prefix="pysswords-benchmark-")
+    try:
+        start = timer()
+        database = Database.create(os.path.join(path, "db"), PASSPHRASE,
+                                   profile=profile)
+        keygen = timer() - start
+        encrypted = database.encrypt("secret")
+        operations = [
+            ("encrypt", lambda: database.encrypt("secret")),
+            ("decrypt", lambda: database.decrypt(encrypted, PASSPHRASE)),
+            ("check", lambda: database.check(PASSPHRASE)),
+        ]
+        key = database.key()
+        for cipher in ciphers:
+            operations.append((
+                "encrypt {}".format(cipher),
+                lambda cipher=cipher: database.gpg.encrypt(
+                    "secret", key, cipher_algo=cipher)))
+        rows = [[profile, "keygen", keygen * 1000, None, None, None, None]]
+        for name, func in operations:
+            rows.append([profile, name] + summarize(measure(func, runs),
+                                                    spawn))
+        return rows
+    finally:
+        shutil.rmtree(path)
+
+
+def parse_args(cli_args=None):
+    parser = argparse.ArgumentParser(prog="benchmark")
+    parser.add_argument("--profiles", nargs="+", choices=sorted(KEY_PROFILES),
+                        default=[DEFAULT_PROFILE])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--ciphers", nargs="*",
+                        default=["AES128", "AES256", "CAMELLIA256"],
+                        help="symmetric ciphers compared for encryption")
+    return parser.parse_args(cli_args)
+
+
+def main(cli_args=None):
+    args = parse_args(cli_args)
+    spawn = spawn_samples(args.runs)
+    rows = [["-", "gpg spawn"] + summarize(spawn)]
+    for profile in args.profiles:
+        rows.extend(profile_rows(profile, args.runs, args.ciphers, spawn))
+    print(tabulate(rows, HEADERS, tablefmt="orgtbl", floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import argparse
+import base64
+import binascii
+import errno
 import inspect
+import json
 import os
 import shutil
 import sys
@@ -13,11 +17,11 @@ from functools import wraps
 import gnupg
 
 try:
-    from unittest.mock import patch, Mock, DEFAULT
+    from unittest.mock import patch, Mock, MagicMock, DEFAULT
     from io import StringIO
 except ImportError:
     # backwards compatbility with Python2
-    from mock import patch, Mock, DEFAULT
+    from mock import patch, Mock, MagicMock, DEFAULT
     from StringIO import StringIO
 
 __file__ = os.path.relpath(inspect.getsourcefile(lambda _: None))
@@ -30,7 +34,22 @@ from pysswords.db import (
     CredentialExistsError
 )
 from pysswords.db import parsers
+import pysswords.audit
+import pysswords.clipboard
+import pysswords.completion
+import pysswords.db.blobs
+import pysswords.db.fingerprints
+import pysswords.db.history
+import pysswords.db.index
+import pysswords.db.layout
+import pysswords.db.query
+import pysswords.db.sync
+import pysswords.db.watch
+import pysswords.generator
+import pysswords.rotation
+import pysswords.tui
 from pysswords.python_two import BUILTINS_NAME
+from tests import benchmark
 
 
 TEST_DIR = os.path.join(os.path.dirname(os.path.relpath(__file__)))
@@ -72,6 +91,15 @@ def build_keys():
         f.write(ascii_armored_private_keys)
 
 
+ARMORED_MESSAGE = """-----BEGIN PGP MESSAGE-----
+
+jA0ECQMCtgWImowXqSz/0jgB3nVu33ahHhJNcSkHLzawtdjJAN8wVXyYJJqKFeUQ
+xUYeLFcfL+C1IeEzduyq2TRSxO8dEIGZcw==
+=wGsN
+-----END PGP MESSAGE-----
+"""
+
+
 def mock_create_keyring(path, *args, **kwargs):
     """Import key.asc instead of generating new key
     passphrase used to create the key was 'dummy_database'"""
@@ -144,6 +172,71 @@ class CryptTests(unittest.TestCase):
         batch = pysswords.crypt.generate_key_input(self.path, self.passphrase)
         self.assertIn("\nPassphrase: {}".format(self.passphrase), batch)
 
+    @timethis
+    def test_compact_and_armor_convert_messages_both_ways(self):
+        compact = pysswords.crypt.compact(ARMORED_MESSAGE)
+        self.assertTrue(compact.startswith("pgp:"))
+        self.assertNotIn("\n", compact)
+        self.assertEqual(pysswords.crypt.armor(compact), ARMORED_MESSAGE)
+        self.assertEqual(pysswords.crypt.compact(compact), compact)
+        self.assertEqual(pysswords.crypt.armor(ARMORED_MESSAGE),
+                         ARMORED_MESSAGE)
+
+    @timethis
+    def test_compact_raises_valueerror_on_bad_checksum(self):
+        with self.assertRaises(ValueError):
+            pysswords.crypt.compact(ARMORED_MESSAGE.replace("=wGsN", "=AAAA"))
+
+    @timethis
+    def test_is_encrypted_detects_armored_and_compact_messages(self):
+        is_encrypted = pysswords.crypt.is_encrypted
+        self.assertTrue(is_encrypted(ARMORED_MESSAGE))
+        self.assertTrue(is_encrypted(
+            pysswords.crypt.compact(ARMORED_MESSAGE)))
+        self.assertFalse(is_encrypted("pgp:password"))
+        self.assertFalse(is_encrypted("password"))
+
+    @timethis
+    def test_is_encrypted_requires_session_key_and_data_packets(self):
+        def compact(data):
+            return "pgp:" + base64.b64encode(data).decode("ascii")
+
+        is_encrypted = pysswords.crypt.is_encrypted
+        session_key = b"\x8c\x04\x04\x09\x03\x02"
+        data = b"\xd2\x03\x01\xaa\xbb"
+        self.assertTrue(is_encrypted(compact(session_key + data)))
+        # partial body lengths, as streamed by gpg
+        self.assertTrue(is_encrypted(compact(session_key + b"\xd2\xe1ab")))
+        # an empty session key packet, plain text passwords such as hAAx
+        self.assertFalse(is_encrypted("pgp:hAAx"))
+        self.assertFalse(is_encrypted(compact(session_key)))
+        self.assertFalse(is_encrypted(compact(data)))
+        self.assertFalse(is_encrypted(compact(
+            b"\x8c\x04\x01\x09\x03\x02" + data)))
+        self.assertFalse(is_encrypted(compact(session_key + data[:-1])))
+
+    @timethis
+    def test_generate_key_input_uses_key_profile(self):
+        batch = pysswords.crypt.generate_key_input(
+            self.path, self.passphrase, profile="ed25519")
+        self.assertIn("Key-Type: EDDSA", batch)
+        self.assertIn("Key-Curve: ed25519", batch)
+        self.assertIn("Subkey-Curve: cv25519", batch)
+
+    @timethis
+    def test_generate_key_input_raises_valueerror_for_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            pysswords.crypt.generate_key_input(
+                self.path, self.passphrase, profile="dsa512")
+
+    @timethis
+    def test_import_keyring_imports_existing_key_pair(self):
+        keyring_path = os.path.join(self.path, ".keys")
+        pysswords.crypt.import_keyring(
+            keyring_path, os.path.join(TEST_DATA_DIR, "key.asc"))
+        gpg = pysswords.crypt.getgpg(keyring_path)
+        self.assertEqual(len(gpg.list_keys(secret=True)), 1)
+
     @timethis
     def test_create_keyring_generate_keys(self):
         self.cleanup()
@@ -488,6 +581,15 @@ class CredentialTests(unittest.TestCase):
         )
         self.assertEqual(credential_path, expected_path)
 
+    @timethis
+    def test_credential_expandpath_shards_names_in_sharded_layout(self):
+        credential_path = pysswords.db.credential.expandpath(
+            self.path, "example.com", "john", layout="sharded")
+        first, second = pysswords.db.credential.shard("example.com")
+        self.assertEqual(credential_path, os.path.join(
+            self.path, first, second, "example.com", "john.pyssword"))
+        self.assertEqual(len(first + second), 4)
+
     @timethis
     def test_credential_content_returns_yaml_content_parseable_to_dict(self):
         content = pysswords.db.credential.content(some_credential())
@@ -515,6 +617,1678 @@ class CredentialTests(unittest.TestCase):
             pysswords.db.credential.splitname(invalid)
 
 
+class SecretCacheTests(unittest.TestCase):
+
+    @timethis
+    def test_secret_cache_returns_cached_plaintext_for_same_passphrase(self):
+        cache = pysswords.db.SecretCache(maxsize=2, ttl=60)
+        cache.put("ciphertext", "passphrase", "secret")
+        self.assertEqual(cache.get("ciphertext", "passphrase"), "secret")
+        self.assertIsNone(cache.get("ciphertext", "wrong passphrase"))
+
+    @timethis
+    def test_secret_cache_evicts_least_recently_used_and_wipes_it(self):
+        cache = pysswords.db.SecretCache(maxsize=2, ttl=60)
+        cache.put("c1", "pass", "one")
+        cache.put("c2", "pass", "two")
+        secret = cache._entries[cache._key("c1", "pass")][1]
+        cache.get("c2", "pass")
+        cache.put("c3", "pass", "three")
+        cache.put("c4", "pass", "four")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("c1", "pass"))
+        self.assertEqual(secret, bytearray(3))
+
+    @timethis
+    def test_secret_cache_expires_entries_after_ttl(self):
+        cache = pysswords.db.SecretCache(maxsize=2, ttl=10)
+        with patch("pysswords.db.cache.clock", return_value=0):
+            cache.put("ciphertext", "pass", "secret")
+        with patch("pysswords.db.cache.clock", return_value=11):
+            self.assertIsNone(cache.get("ciphertext", "pass"))
+        self.assertEqual(len(cache), 0)
+
+    @timethis
+    def test_secret_cache_invalidate_drops_entries_for_ciphertext(self):
+        cache = pysswords.db.SecretCache(maxsize=4, ttl=60)
+        cache.put("ciphertext", "pass", "secret")
+        cache.put("ciphertext", "other", "secret")
+        cache.invalidate("ciphertext")
+        self.assertEqual(len(cache), 0)
+
+    @timethis
+    def test_database_decrypt_uses_cache_when_enabled(self):
+        with patch("pysswords.db.database.getgpg") as mocked:
+            mocked.return_value.decrypt.return_value = "secret"
+            database = Database("some path", cache_size=8)
+            database.decrypt("ciphertext", "pass")
+            self.assertEqual(database.decrypt("ciphertext", "pass"), "secret")
+            mocked.return_value.decrypt.assert_called_once_with(
+                "ciphertext", passphrase="pass")
+
+
+class CredentialCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "cached.pyssword")
+        with open(self.path, "w") as f:
+            f.write("first")
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @timethis
+    def test_credential_cache_loads_unchanged_file_only_once(self):
+        loader = Mock(return_value=some_credential())
+        cache = pysswords.db.cache.CredentialCache(loader)
+        cache.load(self.path)
+        cache.load(self.path)
+        loader.assert_called_once_with(self.path)
+
+    @timethis
+    def test_credential_cache_reloads_file_when_signature_changes(self):
+        loader = Mock(return_value=some_credential())
+        cache = pysswords.db.cache.CredentialCache(loader)
+        cache.load(self.path)
+        with open(self.path, "w") as f:
+            f.write("second write")
+        cache.load(self.path)
+        self.assertEqual(loader.call_count, 2)
+
+    @timethis
+    def test_credential_cache_retain_forgets_removed_paths(self):
+        cache = pysswords.db.cache.CredentialCache(Mock())
+        cache.load(self.path)
+        cache.retain([])
+        self.assertEqual(len(cache), 0)
+
+
+class ScannerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "scan")
+        clean(self.path)
+        for relpath in ["b.org/doe.pyssword", "a.com/jon.pyssword",
+                        "a.com/ann.pyssword", "emails/misc/c.net/x.pyssword",
+                        ".keys/pubring.pyssword", "a.com/notes.txt"]:
+            fullpath = os.path.join(self.path, relpath)
+            pysswords.python_two.makedirs(os.path.dirname(fullpath),
+                                          exist_ok=True)
+            with open(fullpath, "w") as f:
+                f.write(relpath)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_scan_returns_credential_files_in_sorted_order(self):
+        for workers in (1, 4):
+            found = pysswords.db.scanner.scan(
+                self.path, lambda path, stat: stat.st_size, workers)
+            self.assertEqual(
+                [os.path.relpath(p, self.path) for p, _ in found],
+                [os.path.join("a.com", "ann.pyssword"),
+                 os.path.join("a.com", "jon.pyssword"),
+                 os.path.join("b.org", "doe.pyssword"),
+                 os.path.join("emails", "misc", "c.net", "x.pyssword")])
+
+    @timethis
+    def test_scan_skips_dot_directories(self):
+        found = pysswords.db.scanner.scan(self.path, Mock())
+        self.assertFalse(any(".keys" in p for p, _ in found))
+
+
+class LayoutTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "layout")
+        clean(self.path)
+        self.credentials = [some_credential(login="jon"),
+                            some_credential(name="other.org")]
+        for credential in self.credentials:
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, credential.name, credential.login),
+                pysswords.db.credential.content(credential))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    def expandpath(self, credential, layout):
+        return pysswords.db.credential.expandpath(
+            self.path, credential.name, credential.login, layout)
+
+    @timethis
+    def test_layouts_include_layout_migrated_from(self):
+        layouts = pysswords.db.layout.layouts
+        self.assertEqual(layouts({}), ["flat"])
+        self.assertEqual(
+            layouts({"layout": "sharded", "migrating_from": "flat"}),
+            ["sharded", "flat"])
+        with self.assertRaises(ValueError):
+            layouts({"layout": "nested"})
+
+    @timethis
+    def test_migrate_moves_credentials_to_sharded_layout(self):
+        self.assertEqual(self.database.migrate("sharded"), 2)
+        for credential in self.credentials:
+            self.assertTrue(os.path.isfile(
+                self.expandpath(credential, "sharded")))
+            self.assertFalse(os.path.exists(os.path.dirname(
+                self.expandpath(credential, "flat"))))
+        self.assertEqual(pysswords.db.layout.read_config(self.path),
+                         {"layout": "sharded"})
+        self.assertEqual(sorted(self.database.credentials),
+                         sorted(self.credentials))
+        self.assertEqual(self.database.migrate("flat"), 2)
+        self.assertTrue(os.path.isfile(
+            self.expandpath(self.credentials[0], "flat")))
+
+    @timethis
+    def test_database_finds_credentials_in_both_layouts_while_migrating(self):
+        pysswords.db.layout.write_config(
+            self.path, {"layout": "sharded", "migrating_from": "flat"})
+        with patch("pysswords.db.database.getgpg"):
+            database = Database(self.path)
+        credential = self.credentials[0]
+        self.assertEqual(database.get(credential.name), [credential])
+        with self.assertRaises(CredentialExistsError):
+            database.write_credential(credential)
+        database.remove_credential(credential)
+        self.assertFalse(os.path.exists(self.expandpath(credential, "flat")))
+
+    @timethis
+    def test_rerun_of_interrupted_migration_keeps_layout_migrated_from(self):
+        pysswords.db.layout.write_config(
+            self.path, {"layout": "sharded", "migrating_from": "flat"})
+        with patch("pysswords.db.database.getgpg"):
+            database = Database(self.path)
+            other = Database(self.path)
+        found = []
+        move = pysswords.db.layout.move
+
+        def check(database, source, target):
+            credential = self.credentials[0]
+            found.append(other.get(credential.name, credential.login))
+            return move(database, source, target)
+
+        with patch("pysswords.db.layout.move", side_effect=check):
+            self.assertEqual(database.migrate("sharded"), 2)
+        self.assertEqual(found, [[self.credentials[0]]] * 2)
+        self.assertEqual(pysswords.db.layout.read_config(self.path),
+                         {"layout": "sharded"})
+
+    @timethis
+    def test_open_database_follows_migration_by_another_process(self):
+        with patch("pysswords.db.database.getgpg"):
+            other = Database(self.path)
+        other.migrate("sharded")
+        credential = some_credential(name="new.org")
+        self.database.write_credential(credential)
+        self.assertEqual(self.database.layout, "sharded")
+        self.assertTrue(os.path.isfile(self.expandpath(credential, "sharded")))
+        self.assertEqual(self.database.get(credential.name), [credential])
+
+    @timethis
+    def test_migrate_and_remove_prune_empty_shard_directories(self):
+        self.database.migrate("sharded")
+        credential = self.credentials[0]
+        shard_dir = os.path.dirname(os.path.dirname(
+            os.path.dirname(self.expandpath(credential, "sharded"))))
+        self.assertTrue(os.path.isdir(shard_dir))
+        self.database.remove_credential(credential)
+        self.assertFalse(os.path.exists(shard_dir))
+        self.assertTrue(os.path.isdir(self.path))
+        self.database.migrate("flat")
+        self.assertEqual(
+            [e for e in os.listdir(self.path) if not e.startswith(".")],
+            [self.credentials[1].name])
+
+    @timethis
+    def test_create_writes_layout_config(self):
+        path = os.path.join(self.path, "created")
+        with patch("pysswords.db.database.create_keyring"), \
+                patch("pysswords.db.database.getgpg"):
+            database = Database.create(path, "passphrase", layout="sharded")
+        self.assertEqual(database.layout, "sharded")
+        with self.assertRaises(ValueError):
+            Database.create(path + "2", "passphrase", layout="nested")
+
+
+class BlobStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "blobs")
+        clean(self.path)
+        self.blobs = pysswords.db.blobs.BlobStore(self.path, min_size=0)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_pack_stores_identical_comments_once(self):
+        first = self.blobs.pack(some_credential(login="jon"))
+        second = self.blobs.pack(some_credential(login="ann"))
+        self.assertEqual(first.comment, second.comment)
+        self.assertEqual(len(os.listdir(os.path.join(
+            self.blobs.root, first.comment["blob"][:2]))), 1)
+        self.assertEqual(self.blobs.unpack(first), some_credential(
+            login="jon"))
+
+    @timethis
+    def test_unpack_reads_blob_written_by_another_store(self):
+        packed = self.blobs.pack(some_credential(comment="Ünïcode"))
+        other = pysswords.db.blobs.BlobStore(self.path)
+        self.assertEqual(other.unpack(packed).comment, "Ünïcode")
+
+    @timethis
+    def test_collect_deletes_expired_unreferenced_blobs(self):
+        kept = self.blobs.put("kept")
+        self.blobs.put("dropped")
+        self.assertEqual(self.blobs.collect([kept]), 0)
+        self.assertEqual(self.blobs.collect([kept], grace=-1), 1)
+        self.assertEqual(self.blobs.get(kept), "kept")
+
+    @timethis
+    def test_pack_keeps_short_comments_inline(self):
+        blobs = pysswords.db.blobs.BlobStore(self.path)
+        credential = some_credential(comment="short")
+        self.assertEqual(blobs.pack(credential), credential)
+        self.assertFalse(os.path.exists(blobs.root))
+        long_comment = some_credential(comment="x" * blobs.min_size)
+        self.assertTrue(pysswords.db.blobs.isref(
+            blobs.pack(long_comment).comment))
+
+    @timethis
+    def test_database_with_blobs_writes_references_and_reads_comments(self):
+        with patch("pysswords.db.database.create_keyring"), \
+                patch("pysswords.db.database.getgpg"):
+            database = Database.create(self.path, "passphrase", blobs=True)
+        credential = some_credential(password="-----BEGIN PGP MESSAGE-----",
+                                     comment="Some comments " * 20)
+        cred_path = database.write_credential(credential)
+        self.assertTrue(pysswords.db.blobs.isref(
+            Database.read_credential(cred_path).comment))
+        self.assertEqual(database.credentials, [credential])
+        database.remove_credential(credential)
+        # still used by the removed version kept in history
+        self.assertEqual(database.collect_blobs(grace=-1), 0)
+        shutil.rmtree(pysswords.db.history.history_dir(self.path))
+        self.assertEqual(database.collect_blobs(grace=-1), 1)
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "index")
+        clean(self.path)
+        self.credentials = [some_credential(login="jon"),
+                            some_credential(login="ann", comment="work"),
+                            some_credential(name="ëxample.org")]
+        for credential in self.credentials:
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, credential.name, credential.login),
+                pysswords.db.credential.content(credential))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_index_finds_names_by_binary_search(self):
+        entries = [(c.login, c) for c in self.credentials]
+        current = pysswords.db.index.Index(
+            pysswords.db.index.build(entries, "token"))
+        self.assertEqual(len(current), 3)
+        self.assertEqual(current.find("example.com"), ["ann", "jon"])
+        self.assertEqual(current.find("example.com", "jon"), ["jon"])
+        self.assertEqual(current.find("ëxample.org"), ["john.doe"])
+        self.assertEqual(current.find("missing"), [])
+
+    @timethis
+    def test_search_uses_saved_index_until_next_write(self):
+        self.assertEqual(self.database.search("work"),
+                         [self.credentials[1]])
+        with patch("pysswords.db.scanner.scan") as mocked:
+            self.assertEqual(len(self.database.search("xample")), 3)
+            self.assertFalse(mocked.called)
+        self.database.write_credential(some_credential(name="new.com"))
+        self.assertEqual(len(self.database.search("com")), 4)
+
+    @timethis
+    def test_search_matches_index_fields(self):
+        self.assertEqual(self.database.search("comment:work"),
+                         [self.credentials[1]])
+        self.assertEqual(self.database.search("name:*.org OR login:jon"),
+                         [self.credentials[0], self.credentials[2]])
+
+    @timethis
+    def test_index_is_stale_once_generation_changes(self):
+        self.database.load_index().close()
+        token = pysswords.db.index.generation(self.path)
+        current = pysswords.db.index.Index.open(self.path, token)
+        self.assertIsNotNone(current)
+        current.close()
+        pysswords.db.index.touch(self.path)
+        self.assertIsNone(pysswords.db.index.Index.open(
+            self.path, pysswords.db.index.generation(self.path)))
+
+
+class QueryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.credentials = [
+            some_credential(name="github.com", login="jon", comment="prod"),
+            some_credential(name="prod.example.com", login="admin",
+                            comment="old"),
+            some_credential(name="gitlab.com", login="jane",
+                            comment="work laptop")]
+
+    def search(self, query):
+        match = pysswords.db.query.compile_query(query).match
+        return [c.name for c in self.credentials
+                if match(pysswords.db.query.fields(c))]
+
+    @timethis
+    def test_globs_compile_to_the_cheapest_matcher(self):
+        query = pysswords.db.query
+        self.assertEqual(query.value_matcher("github.com")[0], query.EXACT)
+        self.assertEqual(query.value_matcher("git*")[0], query.PREFIX)
+        self.assertEqual(query.value_matcher("*.com")[0], query.PREFIX)
+        self.assertEqual(query.value_matcher("*hub*")[0], query.SUBSTRING)
+        self.assertEqual(query.value_matcher("g?t*")[0], query.PATTERN)
+        self.assertEqual(query.value_matcher("/^j/")[0], query.PATTERN)
+        self.assertEqual(query.term("prod").cost, query.SUBSTRING)
+        self.assertIs(query.compile_query("name:git*"),
+                      query.compile_query("name:git*"))
+
+    @timethis
+    def test_field_predicates_and_boolean_operators(self):
+        self.assertEqual(self.search("prod"), ["github.com",
+                                               "prod.example.com"])
+        self.assertEqual(self.search("name:prod*"), ["prod.example.com"])
+        self.assertEqual(self.search("name:git*.com NOT login:jon"),
+                         ["gitlab.com"])
+        self.assertEqual(self.search("login:admin OR comment:prod"),
+                         ["github.com", "prod.example.com"])
+        self.assertEqual(
+            self.search("(login:jon OR login:jane) AND comment:*o*"),
+            ["github.com", "gitlab.com"])
+        self.assertEqual(self.search('comment:"work laptop"'),
+                         ["gitlab.com"])
+        self.assertEqual(self.search("login:/^ja?/ name:g?tlab.com"),
+                         ["gitlab.com"])
+        # regular expressions without a field, as searched before
+        self.assertEqual(self.search("(github|gitlab)\\.com"),
+                         ["github.com", "gitlab.com"])
+        self.assertEqual(self.search("hub|lab"),
+                         ["github.com", "gitlab.com"])
+
+    @timethis
+    def test_evaluation_short_circuits_cheapest_first(self):
+        get = Mock(side_effect=lambda field: "x")
+        match = pysswords.db.query.compile_query(
+            "comment:/x+/ name:y").match
+        self.assertFalse(match(get))
+        get.assert_called_once_with("name")
+
+    @timethis
+    def test_invalid_queries_raise_value_error(self):
+        for query in ("", "name:a OR", "(name:a", "name:a)", 'comment:"a',
+                      "login:/(/"):
+            with self.assertRaises(ValueError):
+                pysswords.db.query.compile_query(query)
+
+
+class CompletionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "completion")
+        clean(self.path)
+        pysswords.db.storage.atomic_write(
+            pysswords.db.credential.expandpath(
+                self.path, "example.com", "jon"),
+            pysswords.db.credential.content(some_credential(login="jon")))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+        self.database.load_index().close()
+
+    def tearDown(self):
+        clean(self.path)
+
+    def names(self):
+        return pysswords.completion.read_names(self.path)[1]
+
+    @timethis
+    def test_names_cache_follows_writes_and_removals(self):
+        self.assertEqual(self.names(), ["jon@example.com"])
+        with self.database.batch():
+            self.database.write_credential(some_credential(name="a.org"))
+            self.database.write_credential(some_credential(name="b.org"))
+        self.database.remove("example.com", "jon")
+        self.assertEqual(self.names(), ["john.doe@a.org", "john.doe@b.org"])
+        token, _ = pysswords.completion.read_names(self.path)
+        self.assertEqual(token, pysswords.db.index.generation(self.path))
+
+    @timethis
+    def test_names_cache_is_stale_after_unknown_changes(self):
+        self.database.changed()
+        self.database.write_credential(some_credential(name="a.org"))
+        self.assertEqual(self.names(), ["jon@example.com"])
+        self.database.load_index().close()
+        self.assertEqual(self.names(), ["john.doe@a.org", "jon@example.com"])
+
+    @timethis
+    def test_complete_offers_full_and_bare_names_after_name_options(self):
+        self.database.write_credential(some_credential(name="exa.org",
+                                                       login=""))
+        line = "pysswords -D {} -c ex".format(self.path)
+        self.assertEqual(pysswords.completion.complete(line),
+                         ["exa.org", "example.com"])
+        self.assertEqual(pysswords.completion.complete(line[:-2] + "jon@"),
+                         ["jon@example.com"])
+        self.assertEqual(pysswords.completion.complete(
+            "pysswords -D {} -s ex".format(self.path)), [])
+
+    @timethis
+    def test_main_prints_completion_script_without_gpg(self):
+        with patch("pysswords.__main__.which") as which, \
+                patch("pysswords.__main__.print") as mocked:
+            pysswords.__main__.main(["--completion", "bash"])
+        self.assertFalse(which.called)
+        self.assertIn("complete -o default -F _pysswords pysswords",
+                      mocked.call_args[0][0])
+
+
+class FingerprintTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "fingerprints")
+        clean(self.path)
+        for name, password in [("a.com", "same"), ("b.com", "same"),
+                               ("c.com", "other")]:
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, name, "jon"),
+                pysswords.db.credential.content(some_credential(
+                    name=name, login="jon", password=self.encrypt(password))))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+        self.database.encrypt = Mock(side_effect=self.encrypt)
+        self.database.unlock = Mock(side_effect=lambda text, _: binascii.
+                                    unhexlify(text[4:]).decode("utf-8"))
+
+    @staticmethod
+    def encrypt(text):
+        return "enc " + binascii.hexlify(text.encode("utf-8")).decode()
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_reuse_decrypts_only_credentials_without_fingerprint(self):
+        self.assertFalse(self.database.fingerprints.enabled)
+        self.assertEqual(self.database.reuse("passphrase"),
+                         [["jon@a.com", "jon@b.com"]])
+        self.assertTrue(self.database.fingerprints.enabled)
+        self.assertEqual(self.database.unlock.call_count, 3)
+        self.database.unlock.reset_mock()
+        self.database.fingerprints.key = None
+        self.assertEqual(self.database.reuse("passphrase"),
+                         [["jon@a.com", "jon@b.com"]])
+        # only the fingerprint key
+        self.assertEqual(self.database.unlock.call_count, 1)
+
+    @timethis
+    def test_fingerprints_follow_add_update_and_remove(self):
+        self.database.reuse("passphrase")
+        self.assertEqual(self.database.fingerprints.reused("other"),
+                         ["jon@c.com"])
+        self.database.add("d.com", "ann", "other", "")
+        self.database.update("a.com", "jon", {"name": "e.com"})
+        self.database.remove("c.com", "jon")
+        self.assertEqual(self.database.fingerprints.groups(),
+                         [["jon@b.com", "jon@e.com"]])
+        self.assertEqual(self.database.fingerprints.reused("other"),
+                         ["ann@d.com"])
+
+    @timethis
+    def test_unlock_uses_key_created_meanwhile_by_another_process(self):
+        fingerprints = self.database.fingerprints
+        secret = os.path.join(self.path,
+                              pysswords.db.fingerprints.SECRET_FILE)
+        lock = MagicMock()
+        lock.__enter__.side_effect = lambda: pysswords.db.storage.\
+            atomic_write(secret, self.encrypt("ab" * 32))
+        with patch.object(fingerprints, "lock", return_value=lock):
+            self.assertTrue(fingerprints.unlock("passphrase"))
+        self.assertEqual(fingerprints.key, b"\xab" * 32)
+        with open(secret) as f:
+            self.assertEqual(f.read(), self.encrypt("ab" * 32))
+
+    @timethis
+    def test_index_is_an_encrypted_log_compacted_on_load(self):
+        fingerprints = self.database.fingerprints
+        self.database.reuse("passphrase")
+        for i in range(pysswords.db.fingerprints.COMPACT_AFTER):
+            self.database.add("new{}.com".format(i), "jon", "same", "")
+        filename = os.path.join(self.path,
+                                pysswords.db.fingerprints.INDEX_FILE)
+        with open(filename) as f:
+            data = f.read()
+        self.assertNotIn("jon@", data)
+        self.assertEqual(len(data.splitlines()),
+                         pysswords.db.fingerprints.COMPACT_AFTER + 1)
+        self.assertEqual(len(fingerprints.groups()[0]),
+                         pysswords.db.fingerprints.COMPACT_AFTER + 2)
+        with open(filename) as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        # removals are recorded without the passphrase
+        fingerprints.key = fingerprints.passphrase = None
+        self.database.remove("a.com", "jon")
+        with self.assertRaises(ValueError):
+            fingerprints.load()
+        self.database.reuse("passphrase")
+        self.assertNotIn("jon@a.com", fingerprints.load())
+
+
+class SyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.local_path = os.path.join(TEST_DATA_DIR, "sync", "local")
+        self.remote_path = os.path.join(TEST_DATA_DIR, "sync", "remote")
+        clean(os.path.dirname(self.local_path))
+        for i in range(10):
+            for path in (self.local_path, self.remote_path):
+                self.write(path, self.credential(name="site{}.com".format(i)))
+        with patch("pysswords.db.database.getgpg"):
+            self.local = Database(self.local_path)
+            self.remote = Database(self.remote_path)
+        for database in (self.local, self.remote):
+            database.gpg.list_keys.return_value = [{"fingerprint": "KEY"}]
+
+    def tearDown(self):
+        clean(os.path.dirname(self.local_path))
+
+    def copy(self, database, path):
+        shutil.copytree(database.path, path)
+        with patch("pysswords.db.database.getgpg"):
+            copied = Database(path)
+        copied.gpg = database.gpg
+        return copied
+
+    def credential(self, **kwargs):
+        return some_credential(password=ARMORED_MESSAGE, **kwargs)
+
+    def write(self, path, credential):
+        pysswords.db.storage.atomic_write(
+            pysswords.db.credential.expandpath(
+                path, credential.name, credential.login),
+            pysswords.db.credential.content(credential))
+
+    @timethis
+    def test_manifest_diff_only_descends_into_changed_subtrees(self):
+        leaves = {"a/x.pyssword": "1", "b/x.pyssword": "2",
+                  "b/y.pyssword": "3"}
+        manifest = pysswords.db.sync.Manifest(leaves)
+        changed = pysswords.db.sync.Manifest(dict(leaves, **{
+            "b/y.pyssword": "4", "c/z.pyssword": "5"}))
+        self.assertEqual(manifest.hashes["a"], changed.hashes["a"])
+        self.assertNotEqual(manifest.root, changed.root)
+        self.assertEqual(manifest.diff(changed),
+                         ["b/y.pyssword", "c/z.pyssword"])
+        self.assertEqual(manifest.diff(manifest), [])
+
+    @timethis
+    def test_sync_copies_each_side_changes_and_reports_conflicts(self):
+        self.write(self.local_path, self.credential(name="new.com"))
+        self.write(self.local_path, self.credential(name="both.com"))
+        self.write(self.remote_path, self.credential(name="both.com",
+                                                    comment="remote"))
+        result = self.local.sync(self.remote)
+        self.assertEqual(result.pushed, ["new.com/john.doe.pyssword"])
+        self.assertEqual(result.conflicts, ["both.com/john.doe.pyssword"])
+        self.assertEqual(len(self.remote.credentials), 12)
+
+        self.local.remove("site1.com", "john.doe")
+        self.remote.update("site2.com", "john.doe", {"comment": "edited"})
+        result = self.remote.sync(self.local)
+        self.assertEqual(result.pushed, ["site2.com/john.doe.pyssword"])
+        self.assertEqual(result.pulled, ["site1.com/john.doe.pyssword"])
+        self.assertEqual(self.local.get("site2.com")[0].comment, "edited")
+        self.assertEqual(
+            self.local.versions("site2.com", "john.doe")[0].credential,
+            self.credential(name="site2.com"))
+        with self.assertRaises(CredentialNotFoundError):
+            self.remote.get("site1.com")
+
+        result = self.local.sync(self.remote, prefer="remote")
+        self.assertEqual(result.pulled, ["both.com/john.doe.pyssword"])
+        self.assertEqual(self.local.sync(self.remote),
+                         ([], [], []))
+
+    @timethis
+    def test_sync_reads_only_files_written_since_last_sync(self):
+        self.local.sync(self.remote)
+        self.write(self.local_path, self.credential(name="site3.com",
+                                                    comment="changed"))
+        with patch("pysswords.db.sync.file_digest",
+                   wraps=pysswords.db.sync.file_digest) as mocked:
+            result = self.local.sync(self.remote)
+        self.assertEqual(result.pushed, ["site3.com/john.doe.pyssword"])
+        # the changed file, then the copy it replaces
+        self.assertEqual(mocked.call_count, 2)
+
+    @timethis
+    def test_sync_gives_copied_vaults_their_own_id(self):
+        self.local.sync(self.remote)
+        copied = self.copy(self.local, os.path.join(
+            os.path.dirname(self.local_path), "copied"))
+        self.assertNotEqual(pysswords.db.sync.vault_id(copied.path),
+                            pysswords.db.sync.vault_id(self.local.path))
+        self.local.update("site1.com", "john.doe", {"comment": "v2"})
+        self.local.sync(self.remote)
+        result = self.remote.sync(copied)
+        self.assertEqual(result.pulled, [])
+        self.assertEqual(result.conflicts, ["site1.com/john.doe.pyssword"])
+        self.assertEqual(self.remote.get("site1.com")[0].comment, "v2")
+
+    @timethis
+    def test_sync_refuses_same_vault_and_different_keys(self):
+        with patch("pysswords.db.database.getgpg"):
+            same = Database(self.local_path)
+        same.gpg = self.local.gpg
+        with self.assertRaises(ValueError):
+            self.local.sync(same)
+        self.remote.gpg = Mock()
+        self.remote.gpg.list_keys.return_value = [{"fingerprint": "OTHER"}]
+        with self.assertRaises(ValueError):
+            self.local.sync(self.remote)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.remote_path, pysswords.db.sync.SYNC_DIR)))
+
+
+class WatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "watch")
+        clean(self.path)
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+            # another process writing to the same database
+            self.other = Database(self.path)
+        self.database.add("site.com", "john", ARMORED_MESSAGE, "")
+
+    def tearDown(self):
+        clean(self.path)
+
+    def check_view(self, view):
+        changes = []
+        view.subscribe(changes.append)
+        self.assertEqual([c.name for c in view.credentials], ["site.com"])
+        self.other.add("new.com", "jane", ARMORED_MESSAGE, "")
+        self.other.update("site.com", "john", {"comment": "edited"})
+        self.other.remove("site.com", "john")
+        # changes seen by the same poll are applied together
+        while [c.name for c in view.credentials] != ["new.com"]:
+            self.assertTrue(view.poll(5), "changes were not seen")
+        self.assertEqual([(c.kind, c.credential.name) for c in changes
+                          if c.credential.name == "new.com"],
+                         [("added", "new.com")])
+        self.assertEqual(changes[-1].kind, "removed")
+        self.assertEqual(changes[-1].credential.name, "site.com")
+        with patch("pysswords.db.scanner.scan") as mocked:
+            self.assertEqual([c.name for c in view.credentials],
+                             ["new.com"])
+            self.assertEqual(view.get("new.com", "jane")[0].login, "jane")
+        self.assertFalse(mocked.called)
+
+    @unittest.skipIf(pysswords.db.watch.libc() is None,
+                     "inotify is not available")
+    @timethis
+    def test_inotify_view_applies_changes_of_other_writers(self):
+        with self.database.watch(background=False) as view:
+            self.assertFalse(view.polling)
+            self.check_view(view)
+            # files only are read again, not the whole database
+            with patch("pysswords.db.scanner.scan") as mocked:
+                self.other.add("other.com", "jane", ARMORED_MESSAGE, "")
+                view.poll(5)
+            self.assertFalse(mocked.called)
+            self.assertEqual(len(view.credentials), 2)
+
+    @timethis
+    def test_polling_view_applies_changes_of_other_writers(self):
+        with self.database.watch(interval=0.01, polling=True,
+                                 background=False) as view:
+            self.assertTrue(view.polling)
+            self.check_view(view)
+
+    @timethis
+    def test_background_view_runs_callbacks(self):
+        seen = []
+        with self.database.watch(interval=0.01) as view:
+            view.subscribe(lambda change: seen.append(change.kind))
+            self.other.add("new.com", "jane", ARMORED_MESSAGE, "")
+            deadline = time.time() + 5
+            while not seen and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(seen, ["added"])
+        self.assertIsNone(view.thread)
+
+    @timethis
+    def test_view_survives_failing_callbacks_and_unreadable_files(self):
+        seen = []
+
+        def fail(change):
+            raise RuntimeError("broken subscriber")
+
+        with patch("pysswords.db.watch.log") as log, \
+                self.database.watch(interval=0.01, polling=True) as view:
+            view.subscribe(fail)
+            view.subscribe(lambda change: seen.append(change.credential.name))
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, "broken.com", "john"), "{unparseable")
+            self.other.add("new.com", "jane", ARMORED_MESSAGE, "")
+            deadline = time.time() + 5
+            while "new.com" not in seen and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(view.thread.is_alive())
+        self.assertEqual(seen, ["new.com"])
+        self.assertEqual([c.name for c in view.credentials],
+                         ["new.com", "site.com"])
+        self.assertTrue(log.exception.called)
+
+
+class HistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "history")
+        clean(self.path)
+        self.credential = some_credential(login="jon",
+                                          password=ARMORED_MESSAGE)
+        pysswords.db.storage.atomic_write(
+            pysswords.db.credential.expandpath(
+                self.path, self.credential.name, self.credential.login),
+            pysswords.db.credential.content(self.credential))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_updates_keep_replaced_versions_newest_first(self):
+        self.database.update("example.com", "jon", {"comment": "second"})
+        self.database.update("example.com", "jon", {"comment": "third"})
+        versions = self.database.versions("example.com", "jon")
+        self.assertEqual([v.credential.comment for v in versions],
+                         ["second", "Some comments"])
+        self.assertGreaterEqual(versions[0].time, versions[1].time)
+
+    @timethis
+    def test_restore_swaps_current_and_previous_version(self):
+        self.database.update("example.com", "jon", {"comment": "changed"})
+        self.database.restore("example.com", "jon")
+        self.assertEqual(self.database.get("example.com", "jon"),
+                         [self.credential])
+        self.assertEqual(
+            self.database.versions("example.com", "jon")[0].credential
+            .comment, "changed")
+        with self.assertRaises(ValueError):
+            self.database.restore("example.com", "jon", number=5)
+
+    @timethis
+    def test_restore_brings_back_removed_credential(self):
+        self.database.remove("example.com", "jon")
+        self.database.restore("example.com", "jon")
+        self.assertEqual(self.database.credentials, [self.credential])
+
+    @timethis
+    def test_history_is_compacted_to_kept_versions(self):
+        for comment in "abc":
+            pysswords.db.history.append(
+                self.path, self.credential._replace(comment=comment), keep=2)
+        filename = pysswords.db.history.history_path(
+            self.path, "example.com", "jon")
+        self.assertEqual(len(pysswords.db.history.load(filename)), 3)
+        pysswords.db.history.append(
+            self.path, self.credential._replace(comment="d"), keep=2)
+        self.assertEqual(
+            [v.credential.comment
+             for v in pysswords.db.history.load(filename)], ["c", "d"])
+
+
+class ConvertTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "convert")
+        clean(self.path)
+        self.credential = some_credential(password=ARMORED_MESSAGE)
+        pysswords.db.storage.atomic_write(
+            pysswords.db.credential.expandpath(
+                self.path, self.credential.name, self.credential.login),
+            pysswords.db.credential.content(self.credential))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_convert_rewrites_passwords_in_format(self):
+        self.assertEqual(self.database.convert("compact"), 1)
+        password = self.database.credentials[0].password
+        self.assertEqual(password, pysswords.crypt.compact(ARMORED_MESSAGE))
+        self.assertEqual(self.database.convert("compact"), 0)
+        self.assertEqual(self.database.convert("armor"), 1)
+        self.assertEqual(self.database.credentials, [self.credential])
+
+    @timethis
+    def test_compact_database_encrypts_compact_and_decrypts_armored(self):
+        self.database.convert("compact")
+        self.database.gpg.encrypt.return_value = ARMORED_MESSAGE
+        self.database.key = Mock()
+        encrypted = self.database.encrypt("secret")
+        self.assertEqual(encrypted, pysswords.crypt.compact(ARMORED_MESSAGE))
+        self.database.decrypt(encrypted, "passphrase")
+        self.database.gpg.decrypt.assert_called_once_with(
+            ARMORED_MESSAGE, passphrase="passphrase")
+
+
+class GetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "get")
+        clean(self.path)
+        for credential in [some_credential(login="jon"),
+                           some_credential(login="ann"),
+                           some_credential(name="other.org")]:
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, credential.name, credential.login),
+                pysswords.db.credential.content(credential))
+        with patch("pysswords.db.database.getgpg"):
+            self.database = Database(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_get_reads_credential_directory_without_scanning(self):
+        with patch("pysswords.db.scanner.scan") as mocked:
+            found = self.database.get("example.com")
+            self.assertFalse(mocked.called)
+        self.assertEqual(sorted(c.login for c in found), ["ann", "jon"])
+
+    @timethis
+    def test_get_with_login_reads_single_credential(self):
+        found = self.database.get("example.com", "jon")
+        self.assertEqual(found, [some_credential(login="jon")])
+        with self.assertRaises(CredentialNotFoundError):
+            self.database.get("example.com", "bob")
+
+    @timethis
+    def test_names_starting_with_a_dot_are_rejected(self):
+        for name in (".hidden", ".keys", "sub/.journal", ".."):
+            with self.assertRaises(ValueError):
+                self.database.add(name, "jon", ARMORED_MESSAGE, "")
+            with self.assertRaises(ValueError):
+                self.database.write_credential(some_credential(name=name))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.path, ".hidden")))
+
+    @timethis
+    def test_get_does_not_resolve_names_outside_database(self):
+        for name in ["..", ".keys", os.path.join("..", "get")]:
+            with self.assertRaises(CredentialNotFoundError):
+                self.database.get(name)
+
+    @timethis
+    def test_unlock_returns_none_when_passphrase_is_wrong(self):
+        self.database.gpg.decrypt.return_value = Mock(ok=False)
+        self.assertIsNone(self.database.unlock("ciphertext", "wrong"))
+        self.database.gpg.decrypt.return_value = Mock(
+            ok=True, __str__=lambda _: "secret")
+        self.assertEqual(self.database.unlock("ciphertext", "pass"), "secret")
+
+
+class ClipboardTests(unittest.TestCase):
+
+    @timethis
+    def test_clear_if_unchanged_clears_copied_value(self):
+        salt = b"salt"
+        expected = pysswords.clipboard.digest("secret", salt)
+        mocked = Mock()
+        with patch.dict(sys.modules, {"pyperclip": mocked}):
+            mocked.paste.return_value = "secret"
+            self.assertTrue(
+                pysswords.clipboard.clear_if_unchanged(salt, expected))
+            mocked.copy.assert_called_once_with("")
+
+    @timethis
+    def test_clear_if_unchanged_keeps_value_copied_meanwhile(self):
+        salt = b"salt"
+        expected = pysswords.clipboard.digest("secret", salt)
+        mocked = Mock()
+        with patch.dict(sys.modules, {"pyperclip": mocked}):
+            mocked.paste.return_value = "something else"
+            self.assertFalse(
+                pysswords.clipboard.clear_if_unchanged(salt, expected))
+            self.assertFalse(mocked.copy.called)
+
+    @timethis
+    def test_schedule_clear_sends_only_digest_to_child(self):
+        with patch("pysswords.clipboard.subprocess.Popen") as mocked:
+            pysswords.clipboard.schedule_clear("secret", 5)
+        args = mocked.call_args[0][0]
+        self.assertEqual(args[-2:], ["pysswords.clipboard", "5"])
+        sent = mocked.return_value.stdin.write.call_args[0][0]
+        self.assertNotIn(b"secret", sent)
+        message = json.loads(sent.decode("utf-8"))
+        self.assertEqual(
+            message["digest"],
+            pysswords.clipboard.digest(
+                "secret", binascii.unhexlify(message["salt"])))
+
+
+class TuiTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ["example.com", "jon@example.com", "github.com",
+                      "jon@Example.org"]
+
+    @timethis
+    def test_finder_matches_every_term_ignoring_case(self):
+        finder = pysswords.tui.Finder(self.lines)
+        self.assertEqual(finder.filter(""), [0, 1, 2, 3])
+        self.assertEqual(finder.filter("EXAMPLE"), [0, 1, 3])
+        self.assertEqual(finder.filter("example jon"), [1, 3])
+        self.assertEqual(finder.filter("example jon org"), [3])
+
+    @timethis
+    def test_finder_narrows_previous_matches_and_pops_back(self):
+        finder = pysswords.tui.Finder(self.lines)
+        finder.filter("jon")
+        finder.filter("jon@")
+        self.assertEqual([q for q, _ in finder.stack], ["", "jon", "jon@"])
+        self.assertEqual(finder.filter("jo"), [1, 3])
+        self.assertEqual([q for q, _ in finder.stack], ["", "jo"])
+        self.assertEqual(finder.filter("git"), [2])
+
+    @timethis
+    def test_screen_handles_typing_moving_and_selecting(self):
+        screen = pysswords.tui.Screen(Mock(), self.lines)
+        for key in "jon":
+            self.assertIsNone(screen.handle(key))
+        self.assertEqual(screen.matches, [1, 3])
+        screen.handle(pysswords.tui.curses.KEY_DOWN)
+        screen.handle(pysswords.tui.curses.KEY_DOWN)
+        self.assertEqual(screen.handle("\n"), 3)
+        screen.handle("x")
+        self.assertEqual(screen.handle("\n"), -1)
+        screen.handle("\x7f")
+        self.assertEqual(screen.query, "jon")
+        self.assertEqual(screen.handle("\x1b"), -1)
+
+    @timethis
+    def test_screen_selects_first_match_after_moving_without_matches(self):
+        screen = pysswords.tui.Screen(Mock(), self.lines)
+        for key in ["z", "z", pysswords.tui.curses.KEY_DOWN, "\x7f", "\x7f"]:
+            screen.handle(key)
+        self.assertEqual(screen.selected, 0)
+        self.assertEqual(screen.handle("\n"), 0)
+
+
+class FederationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.work, self.personal = Mock(path="/vaults/work"), Mock(
+            path="/vaults/personal")
+        self.work.get.return_value = [some_credential(login="jon")]
+        self.personal.get.side_effect = CredentialNotFoundError
+        self.federation = pysswords.db.Federation(
+            [self.work, self.personal])
+
+    @timethis
+    def test_vault_names_use_full_path_when_ambiguous(self):
+        self.assertEqual(
+            pysswords.db.federation.vault_names(["/a/db", "/b/db", "/c/x"]),
+            ["/a/db", "/b/db", "x"])
+
+    @timethis
+    def test_federation_get_merges_results_with_vault(self):
+        self.assertEqual(self.federation.get("example.com"),
+                         [("work", some_credential(login="jon"))])
+        self.work.get.return_value = []
+        with self.assertRaises(CredentialNotFoundError):
+            self.federation.get("example.com")
+
+    @timethis
+    def test_federation_search_queries_every_vault(self):
+        self.work.search.return_value = [some_credential(login="jon")]
+        self.personal.search.return_value = [some_credential(login="ann")]
+        found = self.federation.search("example")
+        self.assertEqual([(v, c.login) for v, c in found],
+                         [("work", "jon"), ("personal", "ann")])
+
+    @timethis
+    def test_federation_caches_keys_and_passphrase_checks(self):
+        self.work.key.return_value = "FINGERPRINT"
+        self.work.check.return_value = True
+        self.personal.check.return_value = False
+        for _ in range(2):
+            self.assertEqual(self.federation.unlocked("passphrase"),
+                             ["work"])
+        self.work.key.assert_called_once_with(private=True)
+        self.work.check.assert_called_once_with("passphrase",
+                                                key="FINGERPRINT")
+        self.federation.check("work", "other passphrase")
+        self.assertEqual(self.work.check.call_count, 2)
+
+
+class StorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "storage")
+        self.filepath = os.path.join(self.path, "example.com", "doe.pyssword")
+        clean(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_atomic_write_replaces_file_without_leaving_temp_files(self):
+        pysswords.db.storage.atomic_write(self.filepath, "first")
+        pysswords.db.storage.atomic_write(self.filepath, "second")
+        with open(self.filepath) as f:
+            self.assertEqual(f.read(), "second")
+        self.assertEqual(os.listdir(os.path.dirname(self.filepath)),
+                         ["doe.pyssword"])
+
+    @timethis
+    def test_write_batch_renames_files_only_on_commit(self):
+        batch = pysswords.db.storage.WriteBatch()
+        batch.write(self.filepath, "content")
+        self.assertFalse(os.path.isfile(self.filepath))
+        self.assertTrue(batch.exists(self.filepath))
+        batch.commit()
+        self.assertTrue(os.path.isfile(self.filepath))
+
+    @timethis
+    def test_write_batch_rollback_discards_pending_writes(self):
+        batch = pysswords.db.storage.WriteBatch()
+        batch.write(self.filepath, "content")
+        batch.rollback()
+        self.assertFalse(os.path.exists(os.path.dirname(self.filepath)))
+
+    @timethis
+    def test_write_batch_remove_then_write_keeps_new_content(self):
+        pysswords.db.storage.atomic_write(self.filepath, "old")
+        batch = pysswords.db.storage.WriteBatch(fsync=False)
+        batch.remove(self.filepath)
+        self.assertFalse(batch.exists(self.filepath))
+        batch.write(self.filepath, "new")
+        batch.commit()
+        with open(self.filepath) as f:
+            self.assertEqual(f.read(), "new")
+
+    @timethis
+    def test_write_batch_commit_fsyncs_its_files_and_each_directory_once(self):
+        batch = pysswords.db.storage.WriteBatch()
+        batch.write(self.filepath, "first")
+        batch.write(os.path.join(os.path.dirname(self.filepath),
+                                 "ann.pyssword"), "second")
+        with patch("os.fsync") as fsync, \
+                patch("pysswords.db.storage.fsync_dir") as fsync_dir:
+            if hasattr(os, "sync"):
+                with patch("os.sync") as global_sync:
+                    batch.commit()
+                self.assertFalse(global_sync.called)
+            else:
+                batch.commit()
+        self.assertEqual(fsync.call_count, 2)
+        fsync_dir.assert_called_once_with(os.path.dirname(self.filepath))
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "journal")
+        self.filepath = os.path.join(self.path, "example.com", "doe.pyssword")
+        clean(self.path)
+        pysswords.python_two.makedirs(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_transaction_commit_applies_writes_and_removes_journal(self):
+        transaction = pysswords.db.journal.Transaction(self.path)
+        transaction.write(self.filepath, "content")
+        transaction.commit()
+        self.assertTrue(os.path.isfile(self.filepath))
+        self.assertEqual(os.listdir(pysswords.db.journal.journal_dir(
+            self.path)), [])
+
+    @timethis
+    def test_recover_replays_committed_transaction(self):
+        pysswords.db.storage.atomic_write(self.filepath, "old")
+        other = os.path.join(self.path, "other.org", "doe.pyssword")
+        transaction = pysswords.db.journal.Transaction(self.path)
+        transaction.remove(self.filepath)
+        transaction.write(other, "new")
+        with patch("pysswords.db.journal.apply", side_effect=OSError):
+            with self.assertRaises(OSError):
+                transaction.commit()
+        transaction.rollback()
+        self.assertTrue(pysswords.db.journal.recover(self.path))
+        self.assertFalse(os.path.exists(self.filepath))
+        with open(other) as f:
+            self.assertEqual(f.read(), "new")
+
+    @timethis
+    def test_recover_discards_uncommitted_transaction(self):
+        transaction = pysswords.db.journal.Transaction(self.path)
+        transaction.write(self.filepath, "content")
+        transaction.owner.release()
+        self.assertFalse(pysswords.db.journal.recover(self.path))
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertEqual(os.listdir(pysswords.db.journal.journal_dir(
+            self.path)), [])
+
+    @timethis
+    def test_recover_skips_transactions_owned_by_live_process(self):
+        transaction = pysswords.db.journal.Transaction(self.path)
+        transaction.write(self.filepath, "content")
+        pysswords.db.journal.recover(self.path)
+        self.assertTrue(os.path.isdir(transaction.tempdir))
+        transaction.rollback()
+
+    @timethis
+    def test_transaction_commit_raises_when_credential_was_modified(self):
+        pysswords.db.storage.atomic_write(self.filepath, "old")
+        stamp = pysswords.db.journal.version(self.filepath)
+        pysswords.db.storage.atomic_write(self.filepath, "concurrent")
+        transaction = pysswords.db.journal.Transaction(self.path)
+        transaction.expect(self.filepath, stamp, "doe@example.com")
+        transaction.remove(self.filepath)
+        with self.assertRaises(pysswords.db.CredentialModifiedError):
+            transaction.commit()
+        transaction.rollback()
+        self.assertTrue(os.path.isfile(self.filepath))
+
+
+class LockingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "locking")
+        clean(self.path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @unittest.skipIf(pysswords.db.locking.fcntl is None, "no fcntl")
+    @timethis
+    def test_shared_name_locks_do_not_block_each_other(self):
+        lock = pysswords.db.locking.name_lock(self.path, "example.com")
+        with lock:
+            other = pysswords.db.locking.name_lock(self.path, "example.com")
+            other.blocking = False
+            self.assertTrue(other.acquire())
+            other.release()
+
+    @unittest.skipIf(pysswords.db.locking.fcntl is None, "no fcntl")
+    @timethis
+    def test_exclusive_name_lock_blocks_readers_of_same_name_only(self):
+        with pysswords.db.locking.name_lock(self.path, "example.com", True):
+            reader = pysswords.db.locking.name_lock(self.path, "example.com")
+            reader.blocking = False
+            self.assertFalse(reader.acquire())
+            other = pysswords.db.locking.name_lock(self.path, "other.org")
+            other.blocking = False
+            self.assertTrue(other.acquire())
+            other.release()
+
+    @unittest.skipIf(pysswords.db.locking.fcntl is None, "no fcntl")
+    @timethis
+    def test_lock_files_are_sharded(self):
+        for i in range(20):
+            with pysswords.db.locking.name_lock(
+                    self.path, "site{}.com".format(i), True):
+                pass
+        locks_dir = os.path.join(self.path, pysswords.db.locking.LOCKS_DIR)
+        shards = os.listdir(locks_dir)
+        self.assertTrue(all(len(shard) == 2 for shard in shards))
+        self.assertEqual(sum(len(os.listdir(os.path.join(locks_dir, shard)))
+                             for shard in shards), 20)
+
+    @unittest.skipIf(pysswords.db.locking.fcntl is None, "no fcntl")
+    @timethis
+    def test_read_only_vault_is_read_without_locks(self):
+        credential = some_credential()
+        pysswords.db.storage.atomic_write(
+            pysswords.db.credential.expandpath(
+                self.path, credential.name, credential.login),
+            pysswords.db.credential.content(credential))
+        with patch("pysswords.db.database.getgpg"):
+            database = Database(self.path)
+        read_only = OSError(errno.EROFS, "Read-only file system")
+        # nothing can be created, as on a read only mount
+        with patch("os.open", side_effect=read_only):
+            self.assertEqual(database.get("example.com"), [credential])
+            self.assertEqual(database.credentials, [credential])
+            self.assertEqual(database.search("name:example.com"),
+                             [credential])
+        self.assertFalse(os.path.exists(os.path.join(
+            self.path, pysswords.db.locking.LOCKS_DIR)))
+
+    @timethis
+    def test_read_only_vault_opens_after_transactions(self):
+        with patch("pysswords.db.database.getgpg"):
+            database = Database(self.path)
+        with database.batch():
+            database.write_credential(some_credential())
+        read_only = OSError(errno.EROFS, "Read-only file system")
+        with patch("os.open", side_effect=read_only), \
+                patch("pysswords.db.database.getgpg"):
+            database = Database(self.path)
+        self.assertEqual(len(database.credentials), 1)
+        # left by a crash, recovered once the vault is writable again
+        staging = os.path.join(pysswords.db.journal.journal_dir(self.path),
+                               "crashed")
+        pysswords.python_two.makedirs(staging)
+        with patch("os.open", side_effect=read_only), \
+                patch("pysswords.db.database.getgpg"):
+            Database(self.path)
+        self.assertTrue(os.path.isdir(staging))
+        with patch("pysswords.db.database.getgpg"):
+            Database(self.path)
+        self.assertFalse(os.path.exists(staging))
+
+
+class RotationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = MagicMock()
+        self.database.decrypt.side_effect = lambda text, _: "old " + text
+        self.database.build_credential.side_effect = \
+            lambda name, login, password, comment: some_credential(
+                name=name, login=login, password=password, comment=comment)
+        self.credentials = [some_credential(login=str(n)) for n in range(5)]
+
+    @timethis
+    def test_rotation_commits_one_transaction_per_batch(self):
+        rotation = pysswords.rotation.Rotation(
+            self.database, "passphrase", batch_size=2,
+            generate=lambda: "new")
+        rotated = rotation.run(self.credentials)
+        self.assertEqual(len(rotated), 5)
+        self.assertEqual(self.database.batch.call_count, 3)
+        self.assertEqual(self.database.replace.call_count, 5)
+
+    @timethis
+    def test_rotation_reports_old_and_new_passwords_to_hook(self):
+        rotation = pysswords.rotation.Rotation(
+            self.database, "passphrase", generate=lambda: "new",
+            hook="some command")
+        with patch("pysswords.rotation.run_hook") as mocked:
+            rotation.run(self.credentials[:1])
+            entries = mocked.call_args[0][1]
+        self.assertEqual(entries[0]["old"], "old " +
+                         self.credentials[0].password)
+        self.assertEqual(entries[0]["new"], "new")
+
+    @timethis
+    def test_rotation_reports_only_committed_batches(self):
+        committed = []
+        batch = self.database.batch.return_value
+        batch.__enter__.side_effect = lambda: committed.append(False)
+
+        def commit(*exc_info):
+            if len(committed) == 1:
+                raise pysswords.db.CredentialModifiedError("changed meanwhile")
+            committed[-1] = True
+
+        batch.__exit__.side_effect = commit
+        rotation = pysswords.rotation.Rotation(
+            self.database, "passphrase", batch_size=2,
+            generate=lambda: "new", hook="some command")
+        with patch("pysswords.rotation.run_hook") as mocked:
+            mocked.side_effect = lambda _, entries: self.assertTrue(
+                committed[-1])
+            rotated = rotation.run(self.credentials)
+        self.assertEqual(mocked.call_count, 2)
+        self.assertEqual(len(rotated), 3)
+        self.assertEqual([len(b) for b, _ in rotation.failed], [2])
+        self.assertIsInstance(rotation.failed[0][1],
+                              pysswords.db.CredentialModifiedError)
+
+    @timethis
+    def test_rotation_raises_valueerror_when_password_cant_be_decrypted(self):
+        self.database.decrypt.side_effect = None
+        self.database.decrypt.return_value = ""
+        rotation = pysswords.rotation.Rotation(self.database, "bad")
+        with self.assertRaises(ValueError):
+            rotation.run(self.credentials)
+        self.assertFalse(self.database.replace.called)
+
+
+class GeneratorTests(unittest.TestCase):
+
+    @timethis
+    def test_genpass_many_returns_n_passwords_of_policy_length(self):
+        policy = pysswords.generator.Policy(length=12)
+        passwords = pysswords.generator.genpass_many(10, policy)
+        self.assertEqual(len(passwords), 10)
+        self.assertTrue(all(len(p) == 12 for p in passwords))
+
+    @timethis
+    def test_genpass_includes_every_required_class(self):
+        policy = pysswords.generator.Policy(
+            length=4, required=("digits", "lowercase", "uppercase"))
+        for password in pysswords.generator.genpass_many(50, policy):
+            for name in policy.required:
+                charset = pysswords.generator.CHARSETS[name]
+                self.assertTrue(any(c in charset for c in password))
+
+    @timethis
+    def test_genpass_excludes_ambiguous_characters(self):
+        policy = pysswords.generator.Policy(length=64,
+                                            exclude_ambiguous=True)
+        for password in pysswords.generator.genpass_many(20, policy):
+            self.assertFalse(
+                set(password) & set(pysswords.generator.AMBIGUOUS))
+
+    @timethis
+    def test_genpass_with_wordlist_returns_passphrase(self):
+        words = ["correct", "horse", "battery", "staple"]
+        policy = pysswords.generator.Policy(wordlist=words, words=5)
+        passphrase = pysswords.generator.genpass(policy)
+        self.assertEqual(len(passphrase.split("-")), 5)
+        self.assertTrue(all(w in words for w in passphrase.split("-")))
+
+    @timethis
+    def test_policy_raises_valueerror_for_unknown_class(self):
+        with self.assertRaises(ValueError):
+            pysswords.generator.Policy(classes=("emoji",))
+
+    @timethis
+    def test_policy_raises_valueerror_for_required_class_not_drawn(self):
+        with self.assertRaises(ValueError):
+            pysswords.generator.Policy(classes=("lowercase",),
+                                       required=("digits",))
+
+    @timethis
+    def test_policy_raises_valueerror_without_characters(self):
+        with self.assertRaises(ValueError):
+            pysswords.generator.Policy(classes=())
+        with patch.dict(pysswords.generator.CHARSETS, {"digits": "01"}):
+            with self.assertRaises(ValueError):
+                pysswords.generator.Policy(classes=("digits",),
+                                           exclude_ambiguous=True)
+
+    @timethis
+    def test_random_buffer_below_stays_in_range(self):
+        rand = pysswords.generator.RandomBuffer(chunk_size=16)
+        values = [rand.below(1000) for _ in range(500)]
+        self.assertTrue(all(0 <= v < 1000 for v in values))
+
+    @timethis
+    def test_genpass_many_throughput(self):
+        passwords = pysswords.generator.genpass_many(10000)
+        self.assertEqual(len(set(passwords)), 10000)
+
+
+class RekeyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "rekey")
+        clean(self.path)
+        self.database = Mock()
+        self.database.path = self.path
+        self.database.decrypt.side_effect = lambda text, _: "plain " + text
+        self.database.pack.side_effect = lambda credential: credential
+        self.credentials = [some_credential(login="jon"),
+                            some_credential(login="ann")]
+        self.database.credentials = self.credentials
+        for credential in self.credentials:
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, credential.name, credential.login),
+                pysswords.db.credential.content(credential))
+        pysswords.python_two.makedirs(os.path.join(self.path, ".keys"))
+        self.rekey = pysswords.db.rekey.Rekey(self.database, workers=2)
+        self.gpg = Mock()
+        self.gpg.list_keys.return_value = [{"fingerprint": "NEW"}]
+        self.gpg.encrypt.side_effect = lambda text, *a, **kw: "new " + text
+        pysswords.python_two.makedirs(self.rekey.keys_path)
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_rekey_run_checkpoints_staged_credentials(self):
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.assertEqual(self.rekey.run("passphrase"), 2)
+            self.assertEqual(self.rekey.run("passphrase"), 0)
+        self.assertEqual(len(self.rekey.done()), 2)
+
+    @timethis
+    def test_rekey_run_stages_again_credentials_modified_meanwhile(self):
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.run("passphrase")
+            credential = self.credentials[0]
+            pysswords.db.storage.atomic_write(
+                pysswords.db.credential.expandpath(
+                    self.path, credential.name, credential.login),
+                "modified")
+            self.assertEqual(self.rekey.run("passphrase"), 1)
+
+    @timethis
+    def test_rekey_run_fsyncs_staged_files_and_progress(self):
+        synced = []
+        fsync = os.fsync
+
+        def record(fd):
+            synced.append(os.fstat(fd).st_ino)
+            fsync(fd)
+
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg), \
+                patch("os.fsync", side_effect=record):
+            self.rekey.run("passphrase")
+        for relpath in self.rekey.done():
+            self.assertIn(os.stat(os.path.join(self.rekey.staged,
+                                               relpath)).st_ino, synced)
+        self.assertIn(os.stat(self.rekey.progress).st_ino, synced)
+
+    @timethis
+    def test_rekey_commit_stages_again_missing_staged_files(self):
+        credential = self.credentials[0]
+        relpath = os.path.relpath(pysswords.db.credential.expandpath(
+            self.path, credential.name, credential.login), self.path)
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.run("passphrase")
+            os.remove(os.path.join(self.rekey.staged, relpath))
+            self.assertEqual(len(self.rekey.pending()), 1)
+            self.rekey.commit("passphrase")
+        with open(os.path.join(self.path, relpath)) as f:
+            self.assertIn("new plain", f.read())
+
+    @timethis
+    def test_rekey_commit_blocks_writers_until_swapped(self):
+        blocked = []
+        finish = pysswords.db.rekey.finish
+
+        def check(path):
+            writer = pysswords.db.locking.FileLock(
+                pysswords.db.locking.lockfile(
+                    path, pysswords.db.locking.WRITERS_LOCK),
+                exclusive=False, blocking=False, create=True)
+            blocked.append(not writer.acquire())
+            writer.release()
+            finish(path)
+
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg), \
+                patch("pysswords.db.rekey.finish", side_effect=check):
+            self.rekey.commit("passphrase")
+        self.assertEqual(blocked, [True])
+
+    @timethis
+    def test_rekey_commit_swaps_credentials_and_keys(self):
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.commit("passphrase")
+        credential = self.credentials[0]
+        with open(pysswords.db.credential.expandpath(
+                self.path, credential.name, credential.login)) as f:
+            self.assertIn("new plain", f.read())
+        self.assertTrue(os.path.isdir(os.path.join(self.path, ".keys")))
+        self.assertFalse(os.path.exists(self.rekey.root))
+
+    @timethis
+    def test_rekey_commit_reencrypts_every_saved_version(self):
+        pysswords.db.history.append(self.path, self.credentials[0])
+        pysswords.db.history.append(self.path, self.credentials[0])
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.commit("passphrase")
+        versions = pysswords.db.history.versions(self.path, "example.com",
+                                                 "jon")
+        self.assertEqual(
+            [v.credential.password for v in versions],
+            ["new plain " + self.credentials[0].password] * 2)
+
+    @timethis
+    def test_rekey_commit_reencrypts_fingerprint_key(self):
+        secret = os.path.join(self.path,
+                              pysswords.db.fingerprints.SECRET_FILE)
+        pysswords.db.storage.atomic_write(secret, "key")
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.commit("passphrase")
+        with open(secret) as f:
+            self.assertEqual(f.read(), "new plain key")
+
+    @timethis
+    def test_rekey_commit_reencrypts_fingerprint_index(self):
+        index = os.path.join(self.path,
+                             pysswords.db.fingerprints.INDEX_FILE)
+        pysswords.db.storage.atomic_write(index, '"first"\n"second"\n')
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.rekey.commit("passphrase")
+        self.assertEqual(pysswords.db.fingerprints.records(index),
+                         ["new plain first", "new plain second"])
+
+    @timethis
+    def test_rekey_prepare_resumes_only_with_same_passphrase(self):
+        self.gpg.sign.side_effect = \
+            lambda text, default_key, passphrase: passphrase == "new"
+        with patch("pysswords.db.rekey.getgpg", return_value=self.gpg):
+            self.assertFalse(self.rekey.prepare("new"))
+            with self.assertRaises(ValueError):
+                self.rekey.prepare("other")
+
+    @timethis
+    def test_complete_skips_rekey_finished_while_waiting(self):
+        pysswords.db.storage.atomic_write(
+            os.path.join(self.rekey.root, "COMMIT"), "")
+        lock = MagicMock()
+        # another process completes it first
+        lock.__enter__.side_effect = lambda: shutil.rmtree(self.rekey.root)
+        with patch("pysswords.db.rekey.journal_lock", return_value=lock):
+            self.assertFalse(pysswords.db.rekey.complete(self.path))
+
+    @timethis
+    def test_complete_finishes_committed_rekey_only(self):
+        self.assertFalse(pysswords.db.rekey.complete(self.path))
+        pysswords.db.storage.atomic_write(
+            os.path.join(self.rekey.root, "COMMIT"), "")
+        self.assertTrue(pysswords.db.rekey.complete(self.path))
+        self.assertFalse(os.path.exists(self.rekey.root))
+
+
+class AuditTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(TEST_DATA_DIR, "audit")
+        clean(self.path)
+        pysswords.python_two.makedirs(self.path)
+        self.breached = ["password", "123456", "qwerty", "letmein"]
+        digests = sorted(
+            binascii.hexlify(pysswords.audit.sha1(p)).upper().decode("ascii")
+            for p in self.breached + ["x{}".format(i) for i in range(200)])
+        self.hashlist = os.path.join(self.path, "hashes.txt")
+        with open(self.hashlist, "w") as f:
+            for i, digest in enumerate(digests):
+                f.write("{}:{}\r\n".format(digest, i + 1))
+
+    def tearDown(self):
+        clean(self.path)
+
+    @timethis
+    def test_hash_list_finds_every_listed_digest(self):
+        with pysswords.audit.HashList(self.hashlist) as hashes:
+            for password in self.breached + ["x0", "x199"]:
+                self.assertGreater(
+                    hashes.count(pysswords.audit.sha1(password)), 0)
+            self.assertEqual(hashes.count(pysswords.audit.sha1("s3cr3t")), 0)
+
+    @timethis
+    def test_bloom_filter_contains_every_listed_digest(self):
+        filename = pysswords.audit.BloomFilter.build(
+            self.hashlist, self.hashlist + ".bloom")
+        self.assertEqual(pysswords.audit.default_bloom(self.hashlist),
+                         filename)
+        bloom = pysswords.audit.BloomFilter.open(filename)
+        with pysswords.audit.HashList(self.hashlist, bloom) as hashes:
+            for password in self.breached:
+                self.assertIn(pysswords.audit.sha1(password), bloom)
+                self.assertGreater(
+                    hashes.count(pysswords.audit.sha1(password)), 0)
+            misses = sum(pysswords.audit.sha1("y{}".format(i)) in bloom
+                         for i in range(1000))
+            self.assertLess(misses, 10)
+
+    @timethis
+    def test_audit_reports_breached_credentials_only(self):
+        database = Mock()
+        database.decrypt.side_effect = lambda text, _: text
+        credentials = [some_credential(login="jon", password="qwerty"),
+                       some_credential(login="ann", password="s3cr3t")]
+        with pysswords.audit.HashList(self.hashlist) as hashes:
+            found = pysswords.audit.audit(database, "passphrase", hashes,
+                                          credentials, workers=2)
+        self.assertEqual([c for c, _ in found], credentials[:1])
+        database.decrypt.return_value = ""
+        database.decrypt.side_effect = None
+        with pysswords.audit.HashList(self.hashlist) as hashes:
+            with self.assertRaises(ValueError):
+                pysswords.audit.audit(database, "passphrase", hashes,
+                                      credentials)
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    @timethis
+    def test_percentile_uses_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(samples, 50), 50)
+        self.assertEqual(benchmark.percentile(samples, 99), 99)
+        self.assertEqual(benchmark.percentile([3], 95), 3)
+
+    @timethis
+    def test_summarize_subtracts_spawn_median(self):
+        p50, p95, p99, ops, crypto = benchmark.summarize(
+            [0.010] * 10, spawn=[0.004] * 10)
+        self.assertAlmostEqual(p50, 10)
+        self.assertAlmostEqual(ops, 100)
+        self.assertAlmostEqual(crypto, 6)
+
+
 class UtilsTests(unittest.TestCase):
 
     @timethis
@@ -593,6 +2367,19 @@ class MainTests(unittest.TestCase):
         args = pysswords.__main__.parse_args([])
         self.assertEqual(args.database, pysswords.__main__.default_db())
 
+    @timethis
+    def test_main_parse_args_repeated_database_adds_vaults(self):
+        args = pysswords.__main__.parse_args(["-D", "main", "-D", "other"])
+        self.assertEqual(args.database, "main")
+        self.assertEqual(args.vaults, ["other"])
+
+    @timethis
+    def test_main_passes_vaults_to_cli(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["-D", "main", "-D", "other"])
+            self.assertEqual(mocked.call_args[-1]["database_path"], "main")
+            self.assertEqual(mocked.call_args[-1]["vaults"], ["other"])
+
     @timethis
     def test_main_parse_args_has_add_arg(self):
         args = pysswords.__main__.parse_args(["--add"])
@@ -684,6 +2471,33 @@ class MainTests(unittest.TestCase):
         self.assertIn("verbose", args.__dict__)
         self.assertIn("verbose", args_short.__dict__)
 
+    @timethis
+    def test_main_parse_args_has_rotate_args(self):
+        args = pysswords.__main__.parse_args(
+            ["--rotate", "example", "--hook", "cmd", "--batch-size", "10"])
+        self.assertEqual(args.rotate, "example")
+        self.assertEqual(args.hook, "cmd")
+        self.assertEqual(args.batch_size, 10)
+
+    @timethis
+    def test_main_parse_args_has_rekey_arg(self):
+        args = pysswords.__main__.parse_args(["--rekey"])
+        self.assertTrue(args.rekey)
+
+    @timethis
+    def test_main_calls_migrate_database_when_migrate_passed(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--migrate", "sharded"])
+            mocked().migrate_database.assert_called_once_with(
+                layout="sharded")
+
+    @timethis
+    def test_main_calls_convert_database_when_convert_passed(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--convert", "compact"])
+            mocked().convert_database.assert_called_once_with(
+                ciphertext="compact")
+
     @timethis
     def test_main_parse_args_has_clean_arg(self):
         args = pysswords.__main__.parse_args(["--clean"])
@@ -716,6 +2530,14 @@ class MainTests(unittest.TestCase):
                 randompass=False
             )
 
+    @timethis
+    def test_main_passes_key_options_to_cli_when_given(self):
+        args = ["--init", "--key-profile", "ed25519", "--import-key", "k"]
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(args)
+            self.assertEqual(mocked.call_args[-1]["key_profile"], "ed25519")
+            self.assertEqual(mocked.call_args[-1]["keyfile"], "k")
+
     @timethis
     def test_main_calls_cli_add_credential_when_add_passed(self):
         args = ["-D", "/tmp/pysswords", "--add"]
@@ -806,7 +2628,46 @@ class MainTests(unittest.TestCase):
         with patch("pysswords.__main__.CLI") as mocked:
             pysswords.__main__.main(args)
             mocked().copy_to_clipboard.assert_called_once_with(
-                fullname=fullname)
+                fullname=fullname, clear_after=30)
+
+    @timethis
+    def test_main_calls_history_and_restore(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--history", "jon@example.com"])
+            mocked().show_history.assert_called_once_with(
+                fullname="jon@example.com")
+            pysswords.__main__.main(["--restore", "jon@example.com",
+                                     "--restore-version", "2"])
+            mocked().restore_credential.assert_called_once_with(
+                fullname="jon@example.com", number=2)
+
+    @timethis
+    def test_main_calls_sync_database_when_sync_passed(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--sync", "/mnt/db", "--prefer",
+                                     "local"])
+            mocked().sync_database.assert_called_once_with(
+                path="/mnt/db", prefer="local")
+
+    @timethis
+    def test_main_calls_reuse_report_when_reuse_report_passed(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--reuse-report"])
+            mocked().reuse_report.assert_called_once_with()
+
+    @timethis
+    def test_main_calls_audit_credentials_when_audit_passed(self):
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(["--audit", "hashes.txt"])
+            mocked().audit_credentials.assert_called_once_with(
+                hashlist="hashes.txt", bloom=None)
+
+    @timethis
+    def test_main_calls_interactive_when_interactive_passed(self):
+        args = ["-D", "/tmp/pysswords", "-i", "--clear-after", "5"]
+        with patch("pysswords.__main__.CLI") as mocked:
+            pysswords.__main__.main(args)
+            mocked().interactive.assert_called_once_with(clear_after=5)
 
     @timethis
     def test_main_handles_credential_not_found_error(self):
@@ -936,6 +2797,14 @@ class CLITests(unittest.TestCase):
             pysswords.cli.CLI.prompt("Pass:", password=True)
             self.assertTrue(mocked.called)
 
+    @timethis
+    def test_cli_sync_database_refuses_missing_database(self, mocked):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        with self.assertRaises(ValueError):
+            interface.sync_database(os.path.join(TEST_DATA_DIR, "missing"))
+        self.assertEqual(mocked.call_count, 1)
+        self.assertFalse(interface.database.sync.called)
+
     @timethis
     def test_promt_password_returns_entered_password(self, _):
         with patch(BUILTINS_NAME + ".print"):
@@ -980,6 +2849,32 @@ class CLITests(unittest.TestCase):
             login=login
         )
 
+    @timethis
+    def test_get_credentials_shows_vault_column_with_vaults(self, _):
+        with patch("pysswords.cli.Federation") as mocked:
+            interface = pysswords.cli.CLI("some path", show_password=False,
+                                          vaults=["other path"])
+            mocked().get.return_value = [("other", some_credential())]
+            with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                interface.get_credentials("doe@example.com")
+                output = mock_stdout.getvalue()
+            mocked().get.assert_called_once_with(name="example.com",
+                                                 login="doe")
+        self.assertIn("Vault", output)
+        self.assertIn("other", output)
+
+    @timethis
+    def test_get_vault_passphrases_asks_for_vaults_not_opened(self, _):
+        with patch("pysswords.cli.Federation") as mocked:
+            interface = pysswords.cli.CLI("some path", show_password=False,
+                                          vaults=["other path"])
+            mocked().unlocked.return_value = ["main"]
+            mocked().check.return_value = True
+            with patch("pysswords.cli.getpass", side_effect=["p1", "p2"]):
+                passphrases = interface.get_vault_passphrases(
+                    ["main", "other"])
+        self.assertEqual(passphrases, {"main": "p1", "other": "p2"})
+
     @timethis
     def test_cli_clean_removes_database_path_with_prompt_confirmation(self, _):
         interface = pysswords.cli.CLI("some path", show_password=False)
@@ -1149,10 +3044,25 @@ class CLITests(unittest.TestCase):
             interface.show()
         self.assertTrue(interface.decrypt_credentials.called)
 
+    @timethis
+    def test_add_credential_warns_about_reused_password(self, mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        mockdb().fingerprints.enabled = True
+        mockdb().fingerprints.reused.return_value = ["jon@example.org"]
+        with patch("pysswords.cli.CLI.prompt_credential",
+                   return_value=some_credential_dict()), \
+                patch("pysswords.cli.getpass"), \
+                patch("pysswords.cli.logging.warning") as warning:
+            interface.add_credential()
+        warning.assert_called_once_with(
+            "Password already used by jon@example.org")
+        self.assertTrue(mockdb().add.called)
+
     @timethis
     def test_add_credential_calls_db_add_with_credential_dict(self, mockdb):
         credential_dict = some_credential_dict()
         interface = pysswords.cli.CLI("some path", show_password=False)
+        interface.database.fingerprints.enabled = False
         with patch("pysswords.cli.CLI.prompt_credential") as mockprompt:
             mockprompt.return_value = credential_dict
             interface.add_credential()
@@ -1218,7 +3128,8 @@ class CLITests(unittest.TestCase):
             some_credential(),
             some_credential(name="something_else")]
         with patch("pysswords.cli.logging.warning") as logger:
-            with patch("pysswords.cli.getpass"):
+            with patch("pysswords.cli.getpass"), \
+                    patch("pysswords.cli.schedule_clear"):
                 interface.copy_to_clipboard("fullname")
             self.assertTrue(logger.called)
 
@@ -1227,13 +3138,87 @@ class CLITests(unittest.TestCase):
         interface = pysswords.cli.CLI("some path", show_password=False)
         password = "password"
         mockdb().get.return_value = [some_credential()]
-        mockdb().decrypt.return_value = password
+        mockdb().unlock.return_value = password
         interface.write = Mock()
-        interface.get_passphrase = Mock()
-        with patch("pysswords.cli.pyperclip") as mockpyperclip:
+        with patch("pysswords.cli.pyperclip") as mockpyperclip, \
+                patch("pysswords.cli.getpass"), \
+                patch("pysswords.cli.schedule_clear"):
             interface.copy_to_clipboard("fullname")
             mockpyperclip.copy.assert_called_once_with(password)
 
+    @timethis
+    def test_copy_to_clipboard_decrypts_once_without_check(self, mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        mockdb().get.return_value = [some_credential()]
+        mockdb().unlock.return_value = "password"
+        with patch("pysswords.cli.getpass", return_value="passphrase"), \
+                patch("pysswords.cli.schedule_clear"):
+            interface.copy_to_clipboard("fullname")
+        mockdb().unlock.assert_called_once_with(
+            some_credential().password, "passphrase")
+        self.assertFalse(mockdb().check.called)
+
+    @timethis
+    def test_copy_to_clipboard_schedules_clipboard_clear(self, mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        mockdb().get.return_value = [some_credential()]
+        mockdb().unlock.return_value = "password"
+        with patch("pysswords.cli.getpass"), \
+                patch("pysswords.cli.schedule_clear") as mocked:
+            interface.copy_to_clipboard("fullname", clear_after=10)
+            mocked.assert_called_once_with("password", 10)
+            mocked.reset_mock()
+            interface.copy_to_clipboard("fullname", clear_after=0)
+            self.assertFalse(mocked.called)
+
+    @timethis
+    def test_interactive_copies_password_of_selected_line(self, mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        entries = [("jon/example.com.pyssword", some_credential(login="jon")),
+                   ("example.org/example.org.pyssword",
+                    some_credential(name="example.org"))]
+        mockdb().load_index.return_value = pysswords.db.index.Index(
+            pysswords.db.index.build(entries, "token"))
+        mockdb().load_paths.return_value = [some_credential(login="jon")]
+        mockdb().unlock.return_value = "password"
+        with patch("pysswords.cli.tui.select", return_value=0) as select, \
+                patch("pysswords.cli.pyperclip") as mockpyperclip, \
+                patch("pysswords.cli.getpass"), \
+                patch("pysswords.cli.schedule_clear") as clear:
+            interface.interactive(clear_after=5)
+        self.assertEqual(select.call_args[0][0],
+                         ["example.com jon Some comments",
+                          "example.org john.doe Some comments"])
+        mockdb().load_paths.assert_called_once_with(
+            ["jon/example.com.pyssword"])
+        mockpyperclip.copy.assert_called_once_with("password")
+        clear.assert_called_once_with("password", 5)
+
+    @timethis
+    def test_interactive_reports_full_name_of_removed_credential(self,
+                                                                 mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        mockdb().load_index.return_value = pysswords.db.index.Index(
+            pysswords.db.index.build([("jon/example.com.pyssword",
+                                       some_credential(login="jon"))],
+                                     "token"))
+        mockdb().load_paths.return_value = []
+        with patch("pysswords.cli.tui.select", return_value=0):
+            with self.assertRaises(CredentialNotFoundError) as raised:
+                interface.interactive()
+        self.assertEqual(str(raised.exception), "jon@example.com")
+
+    @timethis
+    def test_interactive_decrypts_nothing_when_cancelled(self, mockdb):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        mockdb().load_index.return_value = pysswords.db.index.Index(
+            pysswords.db.index.build([], "token"))
+        with patch("pysswords.cli.tui.select", return_value=None), \
+                patch("pysswords.cli.getpass") as mocked:
+            interface.interactive()
+        self.assertFalse(mocked.called)
+        self.assertFalse(mockdb().load_paths.called)
+
     @timethis
     def test_get_passphrase_returns_none_when_bad_passphrase(self, _):
         interface = pysswords.cli.CLI("some path", show_password=False)
@@ -1256,7 +3241,7 @@ class CLITests(unittest.TestCase):
     def test_copy_to_clipboard_raises_valueerror_when_bad_passphrase(self, _):
         interface = pysswords.cli.CLI("some path", show_password=False)
         interface.database.get.return_value = [some_credential()]
-        interface.database.check = Mock(return_value=False)
+        interface.database.unlock = Mock(return_value=None)
         with patch("pysswords.cli.getpass"):
             with self.assertRaises(ValueError) as raised:
                 interface.copy_to_clipboard("fullname")
@@ -1278,6 +3263,19 @@ class CLITests(unittest.TestCase):
         interface.database.importdb.assert_called_once_with(
             dbfile)
 
+    @timethis
+    def test_rotate_credentials_runs_rotation_on_search_results(self, _):
+        interface = pysswords.cli.CLI("some path", show_password=False)
+        credentials = [some_credential()]
+        interface.database.search = Mock(return_value=credentials)
+        interface.show = Mock()
+        interface.prompt_confirmation = Mock(return_value=True)
+        interface.get_passphrase = Mock(return_value="passphrase")
+        with patch("pysswords.cli.Rotation") as mocked:
+            mocked.return_value.run.return_value = credentials
+            interface.rotate_credentials("example", report="report.json")
+            mocked.return_value.run.assert_called_once_with(credentials)
+
     @timethis
     def test_cli_prompt_credential_calls_utils_genpass(self, _):
         interface = pysswords.cli.CLI("some path",
@@ -1296,6 +3294,7 @@ class CLITests(unittest.TestCase):
         interface = pysswords.cli.CLI("some path",
                                       show_password=False,
                                       randompass=True)
+        interface.database.fingerprints.enabled = False
         with patch("pysswords.cli.CLI.prompt_credential") as mocked:
             with patch("pysswords.cli.CLI.prompt"):
                 with patch("pysswords.cli.genpass"):